@@ -62,6 +62,31 @@ class HendelseAdmin(admin.ModelAdmin):
     list_filter = (('startDate', DateFieldListFilter),)
 
 
+@admin.register(Jobb)
+class JobbAdmin(admin.ModelAdmin):
+    list_display = ['funksjon', 'status', 'forsøk', 'sammenslått', 'opprettet', 'kjøretid']
+    list_filter = ['status', 'funksjon']
+    readonly_fields = ['funksjon', 'argumenter', 'nøkkel', 'sammenslått', 'opprettet', 'startet', 'kjøretid', 'feilmelding']
+
+
+@admin.register(Geokode)
+class GeokodeAdmin(admin.ModelAdmin):
+    list_display = ['adresse', 'cord', 'oppdatert']
+    search_fields = ['adresse']
+
+
+@admin.register(GoogleKalender)
+class GoogleKalenderAdmin(admin.ModelAdmin):
+    list_display = ['medlem', 'kor', 'calendarId']
+    list_filter = ['kor']
+
+
+@admin.register(GoogleHendelse)
+class GoogleHendelseAdmin(admin.ModelAdmin):
+    list_display = ['UID', 'kalender', 'eventId']
+    search_fields = ['UID']
+
+
 class MedlemInline(admin.StackedInline):
     model = Medlem
     show_change_link = True
@@ -7,4 +7,11 @@ class MytxsConfig(AppConfig):
     def ready(self):
         # Implicitly connect signal handlers decorated with @receiver.
         import mytxs.signals.fileSignals
-        import mytxs.signals.logSignals
\ No newline at end of file
+        import mytxs.signals.iCalSignals
+        import mytxs.signals.kartSignals
+        import mytxs.signals.logSignals
+        import mytxs.signals.navBarSignals
+        import mytxs.signals.tilgangSignals
+
+        from mytxs.utils.modelCacheUtils import buildDbCacheRegistry
+        buildDbCacheRegistry()
@@ -9,7 +9,7 @@ from mytxs import consts
 from mytxs.fields import BitmapMultipleChoiceField, MyDateFormField
 from mytxs.models import Hendelse, Kor, Medlem, MedlemQuerySet, Verv, VervInnehavelse, Oppmøte
 from mytxs.utils.formUtils import postIfPost, toolTip
-from mytxs.utils.modelUtils import getPathToKor, stemmegruppeVerv, vervInnehavelseAktiv
+from mytxs.utils.modelUtils import getPathToKor, stemmegruppeVerv, søk, vervInnehavelseAktiv
 
 
 class KorFilterForm(forms.Form):
@@ -133,10 +133,9 @@ class MedlemFilterForm(NavnKorFilterForm):
             queryset = queryset.filter(vervInnehavelser__verv__in=sgVerv)
 
         if navn := self.cleaned_data['navn']:
-            queryset = queryset.annotateFulltNavn()
-            queryset = queryset.filter(*map(lambda n: Q(fulltNavn__unaccent__icontains=n), navn.split()))
+            queryset = søk(queryset, 'søkenavn', navn)
         
-        if navn := self.cleaned_data['ikkeOverførtData']:
+        if self.cleaned_data['ikkeOverførtData']:
             queryset = queryset.filter(overførtData=False)
 
         if harPermisjon := self.cleaned_data['harPermisjon']:
@@ -148,9 +147,10 @@ class MedlemFilterForm(NavnKorFilterForm):
         if 'notisInnhold' in self.fields and (notis := self.cleaned_data['notisInnhold']):
             queryset = queryset.filter(*map(lambda n: Q(notis__icontains=n), notis.split()))
         
-        queryset = queryset.order_by(*Medlem._meta.ordering)
-        
-        return queryset
+        if navn:
+            # Beste treff først når vi søke på navn
+            return queryset.order_by('-rangering', *Medlem._meta.ordering)
+        return queryset.order_by(*Medlem._meta.ordering)
 
 
 class LoggFilterForm(KorFilterForm):
@@ -0,0 +1,140 @@
+import datetime
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from mytxs import consts
+from mytxs.models import Hendelse, Kor, Medlem, Oppmøte, Verv, VervInnehavelse
+from mytxs.utils.downloadUtils import getVeventFromHendelse, iCalLinjer, lagICal, slettBaseVevents
+from mytxs.utils.sqlUtils import SqlMåling
+
+class Command(BaseCommand):
+    help = '''
+    Mål hvor lang tid det tar å generer iCal kalenderen til et medlem med flere år med semesterplan, med antall
+    spørringer, minnebruk og tid til første del av streamen. Sammenlignes med å lage hver hendelse for seg uten
+    prefetch, og med og uten de cachede basene til hendelsene. Forutsetter at seed har kjørt, og legg inn medlemmet
+    og hendelsene i en transaksjon som rulles tilbake, så databasen e urørt etterpå.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--år',
+            type=int,
+            default=6,
+            help='Antall år med semesterplan medlemmet har.'
+        )
+
+        parser.add_argument(
+            '--hendelser',
+            type=int,
+            default=20,
+            help='Antall hendelser per semester.'
+        )
+
+        parser.add_argument(
+            '--undergrupper',
+            type=int,
+            default=4,
+            help='Antall av hendelsene per semester som er undergruppe hendelser medlemmet er invitert til.'
+        )
+
+        parser.add_argument(
+            '--inviterte',
+            type=int,
+            default=15,
+            help='Antall andre inviterte til hver undergruppe hendelse.'
+        )
+
+        parser.add_argument(
+            '--gjentakelser',
+            type=int,
+            default=3,
+            help='Antall ganger hver måling gjøres, vi skriv ut medianen.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            medlem = self.lagSemesterplan(options['år'], options['hendelser'], options['undergrupper'], options['inviterte'])
+            antall = medlem.getHendelser(consts.Kor.TSS).count()
+            self.stdout.write(f'{antall} hendelser over {options["år"]} år')
+
+            def utenPrefetch():
+                for hendelse in medlem.getHendelser(consts.Kor.TSS):
+                    getVeventFromHendelse(hendelse, medlem)
+
+            self.skrivMåling('Uten prefetch', self.mål(utenPrefetch, options['gjentakelser']))
+
+            def kaldCache():
+                # Bare basene til hendelsene til medlemmet, resten av cachen lar vi være
+                slettBaseVevents(medlem.getHendelser(consts.Kor.TSS).values_list('pk', flat=True))
+                lagICal(medlem, consts.Kor.TSS)
+
+            self.skrivMåling('Kald cache', self.mål(kaldCache, options['gjentakelser']))
+            self.skrivMåling('lagICal', self.mål(lambda: lagICal(medlem, consts.Kor.TSS), options['gjentakelser']))
+
+            def førsteHendelse():
+                # Den første delen er hodet, den andre er den første hendelsen
+                linjer = iCalLinjer(medlem, consts.Kor.TSS)
+                next(linjer)
+                next(linjer)
+
+            self.skrivMåling('Første hendelse', self.mål(førsteHendelse, options['gjentakelser']))
+
+            transaction.set_rollback(True)
+
+    def lagSemesterplan(self, år, hendelser, undergrupper, inviterte):
+        'Lag et medlem i TSS med år semestre med hendelser bakover i tid, og oppmøter som hendelsene ville fått'
+        kor = Kor.objects.get(navn=consts.Kor.TSS)
+        start = datetime.date(datetime.date.today().year - år, 1, 1)
+        stemmegruppe = Verv.objects.get_or_create(kor=kor, navn='1T')[0]
+
+        medlem = Medlem.objects.create(fornavn='Benchmark', etternavn='iCal')
+        VervInnehavelse.objects.create(medlem=medlem, verv=stemmegruppe, start=start)
+        andre = [Medlem.objects.create(fornavn='Invitert', etternavn=str(i)) for i in range(inviterte)]
+
+        alleHendelser = []
+        for semester in range(år * 2):
+            semesterStart = start + datetime.timedelta(days=semester * 182)
+            for i in range(hendelser):
+                undergruppe = i < undergrupper
+                alleHendelser.append(Hendelse(
+                    navn=f'Undergruppe {i}' if undergruppe else f'Øvelse {i}',
+                    beskrivelse='Husk noter og vannflaske. ' * 5,
+                    kategori=Hendelse.UNDERGRUPPE if undergruppe else Hendelse.OBLIG,
+                    kor=kor,
+                    startDate=semesterStart + datetime.timedelta(weeks=i),
+                    startTime=datetime.time(18, 30),
+                    sluttTime=datetime.time(21, 30)
+                ))
+        Hendelse.bulkCreate(alleHendelser)
+
+        Oppmøte.opprettFor(
+            {(hendelse.pk, medlem.pk) for hendelse in alleHendelser} |
+            {(hendelse.pk, annen.pk) for hendelse in alleHendelser if hendelse.kategori == Hendelse.UNDERGRUPPE for annen in andre}
+        )
+        return medlem
+
+    def mål(self, funksjon, gjentakelser):
+        '''
+        Median av tid i millisekund og antall spørringer over gjentakelsene, og minnet (topp, i kB) fra en egen
+        kjøring, siden tracemalloc gjør koden en god del tregere. 
+        '''
+        målinger = []
+        for i in range(gjentakelser):
+            måling = SqlMåling()
+            start = time.perf_counter()
+            with connection.execute_wrapper(måling):
+                funksjon()
+            målinger.append(((time.perf_counter() - start) * 1000, måling.antall))
+
+        tracemalloc.start()
+        funksjon()
+        minne = tracemalloc.get_traced_memory()[1] / 1000
+        tracemalloc.stop()
+        return (*sorted(målinger)[len(målinger) // 2], minne)
+
+    def skrivMåling(self, navn, måling):
+        tid, spørringer, minne = måling
+        self.stdout.write(f'{navn:>16}: {tid:8.1f}ms, {spørringer:5} spørringer, {minne:8.0f}kB')
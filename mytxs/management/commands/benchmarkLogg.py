@@ -0,0 +1,87 @@
+import random
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mytxs.models import Logg, LoggHode
+
+FØRSTE_PK = 2_000_000_000
+'instancePK til det første syntetiske objektet, langt over pk til ekte objekter'
+
+class Command(BaseCommand):
+    help = '''
+    Mål hvor lang tid det tar å finn nyeste logg for et objekt etterhvert som Logg tabellen vokse,
+    via LoggHode (getLoggFor) og ved å sortere loggene til objektet slik vi gjorde før, samt lastLogg.
+    Legg inn syntetiske logger i en transaksjon som rulles tilbake, så databasen e urørt etterpå.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--størrelser',
+            type=int,
+            nargs='+',
+            default=[10_000, 100_000, 1_000_000],
+            help='Antall syntetiske logger å måle ved, i stigende rekkefølge.'
+        )
+
+        parser.add_argument(
+            '--objekter',
+            type=int,
+            default=5_000,
+            help='Antall objekter loggene fordeles på.'
+        )
+
+        parser.add_argument(
+            '--oppslag',
+            type=int,
+            default=500,
+            help='Antall oppslag per måling.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            lagt = 0
+            for størrelse in options['størrelser']:
+                lagt = self.leggTilLogger(lagt, størrelse, options['objekter'])
+
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE mytxs_logg, mytxs_logghode')
+
+                pks = [FØRSTE_PK + random.randrange(options['objekter']) for i in range(options['oppslag'])]
+                hode = self.mål(lambda pk: LoggHode.objects.filter(model='Medlem', instancePK=pk).select_related('logg')[:1], pks)
+                sortert = self.mål(lambda pk: Logg.objects.filter(model='Medlem', instancePK=pk).order_by('-timeStamp', '-pk')[:1], pks)
+                historikk = self.mål(lambda pk: Logg.objects.filter(model='Medlem', instancePK=pk, timeStamp__lt=timezone.now()).order_by('-timeStamp')[:1], pks)
+
+                self.stdout.write(
+                    f'{Logg.objects.count():>10} logger: LoggHode {hode:.3f}ms, '
+                    f'sortert {sortert:.3f}ms, lastLogg {historikk:.3f}ms per oppslag'
+                )
+
+            transaction.set_rollback(True)
+
+    def leggTilLogger(self, fra, til, objekter):
+        '''
+        Legg til logger til vi har til syntetiske logger totalt. De får instancePK fra FØRSTE_PK så de ikke
+        kolliderer med ekte objekter, og LoggHode oppdateres som i lagreLogger.
+        '''
+        for start in range(fra, til, 10_000):
+            logger = Logg.objects.bulk_create([Logg(
+                model='Medlem',
+                instancePK=FØRSTE_PK + i % objekter,
+                change=Logg.UPDATE,
+                value={},
+                strRep='Benchmark'
+            ) for i in range(start, min(start + 10_000, til))])
+
+            LoggHode.objects.bulk_create(
+                list({logg.instancePK: LoggHode(model='Medlem', instancePK=logg.instancePK, logg=logg) for logg in logger}.values()),
+                update_conflicts=True, unique_fields=['model', 'instancePK'], update_fields=['logg']
+            )
+        return til
+
+    def mål(self, spørring, pks):
+        'Gjennomsnittlig Execution Time fra EXPLAIN ANALYZE i millisekund, så vi måle databasen og ikke python'
+        tider = [float(re.search(r'Execution Time: ([\d.]+) ms', spørring(pk).explain(analyze=True))[1]) for pk in pks]
+        return sum(tider) / len(tider)
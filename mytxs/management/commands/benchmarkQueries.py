@@ -1,11 +1,25 @@
+import json
+import statistics
 import time
+import tracemalloc
 
-from django.core.management.base import BaseCommand
-from django.db import connection
-from django.test import RequestFactory
-from django.urls import resolve
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count
+from django.test import Client, RequestFactory, override_settings
+from django.urls import URLPattern, get_resolver, resolve, reverse
+from django.utils.html import escape
 
-from mytxs.models import Medlem
+from mytxs import consts
+from mytxs.models import Dekorasjon, Hendelse, Kor, Lenke, Logg, Medlem, Repertoar, Sang, Tilgang, Turne, Verv
+from mytxs.utils.modelUtils import stemmegruppeVerv, vervInnehavelseAktiv
+from mytxs.utils.sqlUtils import SqlMåling, analyserPlan, explain, tabellStørrelser
+
+IKKE_BENCHMARK = ['admin', 'login', 'logout', 'registrer', 'overfør', 'serve', 'serveSangZip', 'docs', 'publish']
+'Url navn vi ikke benchmarke, fordi de endre noe, ikke e sider, eller treng en nøkkel'
+
+REGRESJON_GULV = {'spørringer': 1, 'dbTid': 0.005, 'pythonTid': 0.005, 'minne': 100_000}
+'Minste absolutte økning som telles som regresjon, så støy på små tall ikke feile benchmarken'
 
 class Command(BaseCommand):
     help = '''
@@ -13,15 +27,22 @@ class Command(BaseCommand):
     siden e ikke har samme datamengder lokalt. Følgende kode ble prototypet for å få fiks dette i prod,
     og dette er en generalisering som skal gjøre det enda lettere å jobbe med performance i prod seinar.
     Kan bare mocke get requests, greit det fordi e bryr meg mest om hastigheten av SELECT spørringer.
+
+    Uten url benchmarke vi hele siden: Alle url patterns i mytxs/urls.py med parametre fra ekte rader, for en
+    vanlig korist, et styremedlem, en superbruker og en med tversAvKor. Resultatet kan lagres med --lagre, og
+    sammenlignes med en tidligere kjøring med --baseline, som avslutte med feilkode om noe har blitt tregere.
+    Med --explain kjøres også EXPLAIN ANALYZE på hver unike SELECT sidene gjør, og planene skrives til en rapport.
+    Alt kjøres i en transaksjon som rulles tilbake.
     '''
     def add_arguments(self, parser):
         parser.add_argument(
             'url',
-            help='Quoted url path requesten skal til, kan ha query parameters.'
+            nargs='?',
+            help='Quoted url path requesten skal til, kan ha query parameters. Uten url benchmarkes alle sidene.'
         )
 
         parser.add_argument(
-            '--medlem', 
+            '--medlem',
             type=int,
             default=2806,
             help='Hvilket medlem som "sendte requesten".'
@@ -33,7 +54,66 @@ class Command(BaseCommand):
             help='Sorer lista fra raskest til tregest heller enn kronologisk.',
         )
 
+        parser.add_argument(
+            '--gjentakelser',
+            type=int,
+            default=3,
+            help='Antall ganger hver side lastes, vi lagre medianen.'
+        )
+
+        parser.add_argument(
+            '--lagre',
+            help='Fil å lagre resultatet i, som json.'
+        )
+
+        parser.add_argument(
+            '--baseline',
+            help='Json fil fra en tidligere --lagre å sammenligne med.'
+        )
+
+        parser.add_argument(
+            '--terskel',
+            type=float,
+            default=0.2,
+            help='Hvor my tregere (andel) en side kan bli før det telles som en regresjon.'
+        )
+
+        parser.add_argument(
+            '--explain',
+            help='Fil å skrive planene fra EXPLAIN ANALYZE til, som html om filnavnet ender på .html, ellers json.'
+        )
+
+        parser.add_argument(
+            '--explainBaseline',
+            help='Json fil fra en tidligere --explain, for å finne spørringer som har fått en annen plan.'
+        )
+
     def handle(self, *args, **options):
+        if options['url']:
+            return self.benchmarkUrl(options)
+
+        planer = {} if options['explain'] else None
+        with transaction.atomic(), override_settings(SQL_SAMPLING=0):
+            resultater = self.benchmarkAlle(options['gjentakelser'], planer)
+            transaction.set_rollback(True)
+
+        if options['explain']:
+            self.rapporterPlaner(planer, options)
+
+        if options['lagre']:
+            with open(options['lagre'], 'w') as fil:
+                json.dump(resultater, fil, indent=4, ensure_ascii=False)
+
+        if options['baseline']:
+            with open(options['baseline']) as fil:
+                regresjoner = sammenlign(json.load(fil), resultater, options['terskel'])
+            for regresjon in regresjoner:
+                self.stdout.write(self.style.ERROR(regresjon))
+            if regresjoner:
+                raise CommandError(f'{len(regresjoner)} regresjoner over {options["terskel"]:.0%}')
+            self.stdout.write(self.style.SUCCESS('Ingen regresjoner'))
+
+    def benchmarkUrl(self, options):
         queries_log = []
 
         def query_logger(execute, sql, params, many, context):
@@ -63,3 +143,228 @@ class Command(BaseCommand):
             print(f"\t{sql}\n{duration:.4f}s\n")
 
         print(f'Heile requesten tok {totalTime:.4f}')
+
+    def benchmarkAlle(self, gjentakelser, planer=None):
+        'Last alle sidene for alle rollene, og returne {"rolle url": måling}. Om planer er gitt fylles den med explainSide per side.'
+        resultater = {}
+        tabeller = tabellStørrelser()
+        for rolle, medlem in finnMedlemmer().items():
+            if not medlem:
+                self.stdout.write(self.style.WARNING(f'Fant ingen {rolle}, hopper over'))
+                continue
+
+            client = Client(SERVER_NAME='127.0.0.1')
+            client.force_login(medlem.user)
+
+            for url in lagUrler(medlem):
+                resultater[f'{rolle} {url}'] = resultat = målSide(client, url, gjentakelser)
+                self.stdout.write(
+                    f'{rolle:<10} {url:<60} {resultat["status"]} {resultat["spørringer"]:>4} spørringer '
+                    f'{resultat["dbTid"] * 1000:>7.1f}ms db {resultat["pythonTid"] * 1000:>7.1f}ms python '
+                    f'{resultat["minne"] / 1000:>8.0f}kB'
+                )
+                if planer != None:
+                    planer[f'{rolle} {url}'] = explainSide(client, url, tabeller)
+        return resultater
+
+    def rapporterPlaner(self, planer, options):
+        'Skriv rapporten, og list opp sidene med flaggede planer og planer som har endra seg siden --explainBaseline'
+        endringer = []
+        if options['explainBaseline']:
+            with open(options['explainBaseline']) as fil:
+                endringer = sammenlignPlaner(json.load(fil), planer)
+
+        with open(options['explain'], 'w') as fil:
+            if options['explain'].endswith('.html'):
+                fil.write(htmlRapport(planer))
+            else:
+                json.dump(planer, fil, indent=4, ensure_ascii=False)
+
+        for side, sidePlaner in planer.items():
+            seqScans = sum(bool(p.get('seqScans')) for p in sidePlaner.values())
+            feilestimater = sum(bool(p.get('feilestimater')) for p in sidePlaner.values())
+            if seqScans or feilestimater:
+                self.stdout.write(self.style.WARNING(f'{side}: {seqScans} med seq scan på store tabeller, {feilestimater} med feilestimat'))
+        for endring in endringer:
+            self.stdout.write(self.style.WARNING(endring))
+
+
+def finnMedlemmer():
+    'Representative medlemmer å benchmarke som, ett per rolle'
+    innloggbare = Medlem.objects.filter(user__isnull=False)
+    return {
+        'korist': innloggbare.filter(
+            vervInnehavelseAktiv(),
+            stemmegruppeVerv('vervInnehavelser__verv'),
+            user__is_superuser=False,
+            medlemTilganger__isnull=True
+        ).first(),
+        'styre': innloggbare.filter(user__is_superuser=False).exclude(
+            medlemTilganger__tilgang__navn=consts.Tilgang.tversAvKor
+        ).annotate(antallTilganger=Count('medlemTilganger')).filter(antallTilganger__gt=0).order_by('-antallTilganger').first(),
+        'superuser': innloggbare.filter(user__is_superuser=True).first(),
+        'tversAvKor': innloggbare.filter(user__is_superuser=False, medlemTilganger__tilgang__navn=consts.Tilgang.tversAvKor).first(),
+    }
+
+
+def lagUrler(medlem):
+    '''
+    Alle url patterns i mytxs/urls.py som ikke e i IKKE_BENCHMARK, med parametre fylt inn fra ekte rader i
+    medlemmets (første) kor. Patterns med parametre vi ikke finn rader for hoppes over.
+    '''
+    kor = medlem.aktiveKor.first() or Kor.objects.get(navn=consts.Kor.TSS)
+    hendelse = Hendelse.objects.filter(kor=kor).order_by('-startDate').first()
+    turne = Turne.objects.filter(kor=kor).first()
+    undergruppe = Tilgang.objects.filter(kor=kor, sjekkheftetSynlig=True).first()
+
+    def navn(model):
+        return getattr(model.objects.filter(kor=kor).first(), 'navn', None)
+
+    parametre = {
+        'kor': kor.navn,
+        'medlemPK': medlem.pk,
+        'hendelsePK': getattr(hendelse, 'pk', None),
+        'loggPK': getattr(Logg.objects.first(), 'pk', None),
+        'modelName': 'Medlem',
+        'instancePK': medlem.pk,
+        'vervNavn': navn(Verv),
+        'tilgangNavn': navn(Tilgang),
+        'dekorasjonNavn': navn(Dekorasjon),
+        'lenkeNavn': navn(Lenke),
+        'repertoarNavn': navn(Repertoar),
+        'sangNavn': navn(Sang),
+        'år': turne.start.year if turne else None,
+        'turneNavn': getattr(turne, 'navn', None),
+    }
+
+    # Sider som tar en side parameter, og hvilke sider vi vil ha med. Varianter med parametre
+    # et pattern ikke har gjelder for et anna pattern med samme navn.
+    varianter = {
+        'sjekkheftet': [
+            *({'side': side} for side in [kor.navn, 'søk', 'kart', 'jubileum', 'fellesEmner', 'sjekkhefTest']),
+            {'side': kor.navn, 'underside': getattr(undergruppe, 'navn', None)}
+        ],
+        'notearkiv': [{'side': 'repertoar'}, {'side': 'søk'}],
+        'fravær': [{'side': 'søknader'}, {'side': 'oversikt', 'underside': kor.navn}, {'side': 'statistikk', 'underside': kor.navn}],
+        'tilgang': [{}, {'side': 'oversikt'}],
+    }
+
+    urler = []
+    for pattern in get_resolver().url_patterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name or pattern.name in IKKE_BENCHMARK:
+            continue
+
+        parametreIPattern = set(pattern.pattern.converters.keys())
+        for variant in varianter.get(pattern.name, [{}]):
+            verdier = {**parametre, **variant}
+            if set(variant) - parametreIPattern or any(verdier.get(p) == None for p in parametreIPattern):
+                continue
+            url = reverse(pattern.name, kwargs={p: verdier[p] for p in parametreIPattern})
+            if url not in urler:
+                urler.append(url)
+    return urler
+
+
+def målSide(client, url, gjentakelser):
+    '''
+    Last siden gjentakelser ganger (etter en oppvarming) og returne medianen av antall spørringer, tid i databasen og tid i python,
+    og toppen av minnebruken fra en ekstra lasting med tracemalloc (som gjør alt tregere, så den måles for seg).
+    '''
+    # Første lasting fylle cacher (navBar o.l.), og telles ikke med
+    client.get(url)
+
+    målinger = []
+    for i in range(gjentakelser):
+        måling = SqlMåling()
+        start = time.perf_counter()
+        with connection.execute_wrapper(måling):
+            response = client.get(url)
+        totalTid = time.perf_counter() - start
+        målinger.append((måling.antall, måling.tid, totalTid - måling.tid))
+
+    tracemalloc.start()
+    client.get(url)
+    minne = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'spørringer': statistics.median(m[0] for m in målinger),
+        'dbTid': statistics.median(m[1] for m in målinger),
+        'pythonTid': statistics.median(m[2] for m in målinger),
+        'minne': minne,
+    }
+
+
+def explainSide(client, url, tabeller):
+    '''
+    Last siden, og kjør EXPLAIN ANALYZE på hver unike SELECT den gjør. Returne {sqlForm: analyse} med tregeste først,
+    der analyse e fra analyserPlan, pluss sql og antall ganger formen ble kjørt. 
+    '''
+    måling = SqlMåling()
+    with connection.execute_wrapper(måling):
+        client.get(url)
+
+    planer = {}
+    for form, (sql, params) in måling.eksempler.items():
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        try:
+            with transaction.atomic():
+                planer[form] = {'sql': sql, 'antall': måling.former[form], **analyserPlan(explain(sql, params), tabeller)}
+        except DatabaseError as feil:
+            planer[form] = {'sql': sql, 'antall': måling.former[form], 'tid': 0, 'feil': str(feil)}
+    return dict(sorted(planer.items(), key=lambda p: -p[1]['tid']))
+
+
+def sammenlignPlaner(baseline, planer):
+    'Returne en liste av spørringer som har fått en annen planForm siden baseline, og marker dem med endretFra i planer'
+    endringer = []
+    for side, sidePlaner in planer.items():
+        for form, plan in sidePlaner.items():
+            gammel = baseline.get(side, {}).get(form)
+            if gammel and plan.get('form') and gammel.get('form') != plan['form']:
+                plan['endretFra'] = gammel.get('form')
+                endringer.append(f'{side}: {form[:150]}\n\t{gammel.get("form")}\n\t-> {plan["form"]}')
+    return endringer
+
+
+def htmlRapport(planer):
+    'Rapporten fra --explain som en html side, med sidene som har flest flaggede spørringer først'
+    def flagg(plan):
+        return len(plan.get('seqScans', [])) + len(plan.get('feilestimater', [])) + ('endretFra' in plan) + ('feil' in plan)
+
+    deler = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>EXPLAIN rapport</title><style>',
+        'body{font-family:sans-serif} td,th{border:1px solid #ccc;padding:4px;vertical-align:top} table{border-collapse:collapse}',
+        '.flagg{background:#fdd} pre{white-space:pre-wrap;max-width:60em}</style></head><body><h1>EXPLAIN rapport</h1>']
+    for side, sidePlaner in sorted(planer.items(), key=lambda s: -sum(flagg(p) for p in s[1].values())):
+        deler.append(f'<h2>{escape(side)}</h2><table><tr><th>ms</th><th>antall</th><th>funn</th><th>dyreste noder</th><th>spørring</th></tr>')
+        for plan in sidePlaner.values():
+            funn = [
+                *(f'Seq Scan på {s["tabell"]} ({s["rader"]} rader, {s["loops"]} loops)' for s in plan.get('seqScans', [])),
+                *(f'{f["node"]}: estimert {f["estimert"]}, faktisk {f["faktisk"]} rader' for f in plan.get('feilestimater', [])),
+                *([f'Endret plan, var {plan["endretFra"]}'] if 'endretFra' in plan else []),
+                *([plan['feil']] if 'feil' in plan else []),
+            ]
+            dyreste = [f'{n["node"]}: {n["egenTid"]}ms' for n in plan.get('dyresteNoder', [])]
+            deler.append(
+                f'<tr class="{"flagg" if flagg(plan) else ""}"><td>{plan["tid"]:.2f}</td><td>{plan["antall"]}</td>'
+                f'<td>{"<br>".join(escape(f) for f in funn)}</td><td>{"<br>".join(escape(d) for d in dyreste)}</td>'
+                f'<td><details><summary>{escape(plan["sql"][:100])}</summary><pre>{escape(plan["sql"])}</pre>'
+                f'<pre>{escape(plan.get("form", ""))}</pre></details></td></tr>'
+            )
+        deler.append('</table>')
+    deler.append('</body></html>')
+    return '\n'.join(deler)
+
+
+def sammenlign(baseline, resultater, terskel):
+    'Returne en liste av regresjoner, der en måling har økt med mer enn terskel (og REGRESJON_GULV) siden baseline'
+    regresjoner = []
+    for nøkkel, resultat in resultater.items():
+        if not (gammel := baseline.get(nøkkel)):
+            continue
+        for felt, gulv in REGRESJON_GULV.items():
+            if resultat[felt] > gammel[felt] * (1 + terskel) and resultat[felt] - gammel[felt] >= gulv:
+                regresjoner.append(f'{nøkkel}: {felt} {gammel[felt]:.4g} -> {resultat[felt]:.4g}')
+    return regresjoner
@@ -7,8 +7,10 @@ from django.db.models.functions import Cast
 
 from mytxs import consts
 from mytxs.management.commands.fixGoogleCalendar import fixGoogleCalendar
-from mytxs.models import Hendelse, Medlem, Oppmøte
+from mytxs.models import Hendelse, Medlem, MedlemTilgang, Oppmøte
 from mytxs.utils.googleCalendar import GoogleCalendarManager
+from mytxs.utils.jobbUtils import kjørJobber, slettGamleJobber
+from mytxs.utils.loggUtils import samleLogger
 from mytxs.utils.modelUtils import vervInnehavelseAktiv
 from mytxs.utils.threadUtils import mailException
 
@@ -19,16 +21,26 @@ class Command(BaseCommand):
     help = 'Dette kjøre en gong hvert minutt på serveren, slik får vi cron jobs'
 
     @mailException
+    @samleLogger()
     def handle(self, *args, **options):
         now = datetime.datetime.now()
 
         fraværEpost(now)
 
+        # Plukk opp jobber som ikke ble kjørt etter requesten, i tilfelle ingen jobbWorker kjøre
+        kjørJobber(tidsgrense=40)
+
         if now.minute == 0:
             # Dette medføre refresh av tokenet, slik at vi aldri går 7 dager uten bruk
             # https://developers.google.com/identity/protocols/oauth2#expiration
             fixGoogleCalendar(gCalManager=GoogleCalendarManager(requestCountDown=100))
 
+            slettGamleJobber()
+
+            if now.hour == 3:
+                # VervInnehavelser går ut på dato uten at noe lagres, så oppdater tilgangstabellen for alle en gang i døgnet
+                MedlemTilgang.oppdater()
+
 
 def fraværEpost(now):
     start = now + datetime.timedelta(hours=2)
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from mytxs.utils.modelCacheUtils import dbCacheRegistry
+
+class Command(BaseCommand):
+    help = '''
+    Skriv ut avhengighetsgrafen til dbCache fra registeret, altså hvilke felt på hvilke modeller som trigger
+    hvilke cachede metoder. Flagge også sykler mellom modeller. propagateDbCache går ikke i loop på sykler,
+    men de betyr at en verdi kan bli stående utdatert om den avhenge av noe som rekalkuleres etter den.
+    '''
+
+    def handle(self, *args, **options):
+        graf = {}
+        for model, dbCacheInfo in dbCacheRegistry.items():
+            if not dbCacheInfo['methods'] and not dbCacheInfo['relations']:
+                continue
+
+            self.stdout.write(model.__name__)
+            for method, localFields in dbCacheInfo['localFields'].items():
+                self.stdout.write(f'\t{method}' + (f' (lokale felt: {", ".join(localFields)})' if localFields else ''))
+
+            for relation in dbCacheInfo['relations']:
+                graf.setdefault(model, set()).add(relation['model'])
+                for field, methods in relation['triggers'].items():
+                    for method in methods:
+                        self.stdout.write(f'\t{relation["relation"]}.{field or "*"} -> {relation["model"].__name__}.{method}')
+
+        sykler = finnSykler(graf)
+        for sykel in sykler:
+            self.stdout.write(self.style.WARNING('Sykel: ' + ' -> '.join(m.__name__ for m in [*sykel, sykel[0]])))
+        if not sykler:
+            self.stdout.write(self.style.SUCCESS('Ingen sykler'))
+
+
+def finnSykler(graf):
+    'Finn alle elementære sykler i grafen ({node: set av noder}), hver sykel bare én gang.'
+    sykler = []
+
+    def dfs(start, node, sti):
+        for neste in graf.get(node, []):
+            if neste == start:
+                sykler.append(list(sti))
+            elif neste not in sti and neste.__name__ > start.__name__:
+                # Bare start sykler fra den minste noden, så vi ikke finn samme sykel fra flere startpunkt
+                dfs(start, neste, sti + [neste])
+
+    for start in graf:
+        dfs(start, start, [start])
+    return sykler
@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 
-from mytxs.models import Kor, Medlem
-from mytxs.utils.downloadUtils import getVeventFromHendelse
+from mytxs.models import GoogleHendelse, Kor, Medlem
+from mytxs.utils.downloadUtils import medlemVevents
 from mytxs.utils.googleCalendar import GoogleCalendarManager, getHendelseBody
 from mytxs.utils.modelUtils import stemmegruppeVerv, vervInnehavelseAktiv
 
@@ -13,11 +13,19 @@ class Command(BaseCommand):
 
 
 def fixGoogleCalendar(gCalManager=None):
-    'Denne sjekke alle mytxs sine google calendars, og fikser feil.'
+    '''
+    Denne sjekke alle mytxs sine google calendars, og fikser feil. GoogleKalender og GoogleHendelse synkroniseres 
+    med det som faktisk ligger hos Google, så resten av koden kan stole på dem. 
+    '''
     if not gCalManager:
         gCalManager = GoogleCalendarManager()
     
-    for calendar in gCalManager.getCalendarList():
+    calendarList = gCalManager.getCalendarList()
+
+    # Alle kalenderne registreres før vi begynner, så ingen blir hoppet over om requestCountDown går tom underveis
+    gCalManager.synkKalendere(calendarList)
+
+    for calendar in calendarList:
         if not calendar.get('description', ''):
             # Dette vil være tilfelle for google brukeren sin (uslettelige) personal calendar
             continue
@@ -39,7 +47,11 @@ def fixGoogleCalendar(gCalManager=None):
 
         remoteEvents = gCalManager.listEvents(calendar['id'])
 
-        localEvents = list(map(lambda h: getHendelseBody(getVeventFromHendelse(h, medlem)), medlem.getHendelser(kor.navn)))
+        remoteEventIds = {(calendar['id'], e['extendedProperties']['private']['UID']): e['id'] for e in remoteEvents}
+        GoogleHendelse.objects.filter(kalender_id=calendar['id']).exclude(UID__in=[UID for c, UID in remoteEventIds]).delete()
+        gCalManager.lagreEventIds(remoteEventIds)
+
+        localEvents = [getHendelseBody(vevent) for hendelse, vevent in medlemVevents(medlem, kor.navn)]
 
         onlyRemote = []
 
@@ -75,6 +87,8 @@ def fixGoogleCalendar(gCalManager=None):
                 event['extendedProperties']['private']['UID']
             )
 
+        gCalManager.sendBatch()
+
 
 def diffEvents(localEvent, gCalEvent):
     for key, value in localEvent.items():
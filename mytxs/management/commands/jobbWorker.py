@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+
+from mytxs.utils.jobbUtils import kjørJobber
+
+logger = logging.getLogger('mytxs.jobb')
+
+class Command(BaseCommand):
+    help = '''
+    Kjøre jobber fra jobbkøen (Jobb) i en loop. Flere workers kan kjøre samtidig, siden jobber claimes
+    med SELECT ... FOR UPDATE SKIP LOCKED. Uten denne plukker cron opp jobbene hvert minutt.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervall',
+            type=float,
+            default=1,
+            help='Sekund å vente mellom hver gang vi sjekke køen når den er tom.'
+        )
+
+        parser.add_argument(
+            '--engang',
+            action='store_true',
+            help='Kjør til køen er tom, og avslutt.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # Lukk connections som har timet ut eller mistet databasen (f.eks. ved restart), så loopen overlever
+            close_old_connections()
+            try:
+                if antall := kjørJobber():
+                    self.stdout.write(f'Kjørte {antall} jobber')
+            except OperationalError:
+                logger.exception('Mistet kontakten med databasen, prøver igjen')
+            if options['engang']:
+                return
+            time.sleep(options['intervall'])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from mytxs.models import Medlem
+from mytxs.utils.bildeUtils import lagBildeVarianter
+
+class Command(BaseCommand):
+    help = '''
+    Lag varianter av sjekkhefte bildene som ikke har det, altså de som ble lastet opp før variantene fantes, 
+    eller der jobben feilet. Med --alle lages de på nytt for alle, f.eks. etter at BILDE_STØRRELSER er endret. 
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--alle',
+            action='store_true',
+            help='Lag variantene på nytt også for de som allerede har dem.'
+        )
+
+    def handle(self, *args, **options):
+        medlemmer = Medlem.objects.exclude(bilde='').exclude(bilde=None)
+        if not options['alle']:
+            medlemmer = medlemmer.filter(bildeVersjon=None)
+
+        pks = list(medlemmer.values_list('pk', flat=True))
+        for i, pk in enumerate(pks):
+            lagBildeVarianter.direkte(pk)
+            if (i + 1) % 100 == 0:
+                self.stdout.write(f'{i + 1}/{len(pks)}')
+        self.stdout.write(f'Laget varianter for {len(pks)} bilder')
@@ -7,7 +7,9 @@ from django.db.models.signals import post_delete
 
 from mytxs import consts
 from mytxs.models import *
-from mytxs.signals.logSignals import log_post_delete
+from mytxs.signals.logSignals import log_post_delete, loggOppføring
+from mytxs.utils.loggUtils import lagreSamledeLogger, leggTilLogg, samleLogger
+from mytxs.utils.modelCacheUtils import propagateDbCache
 from mytxs.utils.modelUtils import randomDistinct, stemmegruppeVerv, strToModels, vervInnehavelseAktiv
 
 
@@ -57,6 +59,20 @@ class Command(BaseCommand):
             help='Create some testing data for development',
         )
 
+        parser.add_argument(
+            '--scale',
+            type=float,
+            help='Lag en stor database for å teste ytelse, scale=1.5 gir rundt en million logger',
+        )
+
+        parser.add_argument(
+            '--randomSeed',
+            type=int,
+            default=0,
+            help='Seed for --scale, samme seed gir samme data',
+        )
+
+    @samleLogger()
     def handle(self, *args, **options):
         if options['reMigrate']:
             print('Dropping tables and redoing migrations...')
@@ -86,6 +102,10 @@ class Command(BaseCommand):
             print('testData...')
             testData(self)
 
+        if options['scale']:
+            print('scaleData...')
+            scaleData(self, options['scale'], options['randomSeed'])
+
 
 def clearData(self):
     'Deletes all data from Models that are not the Logg models'
@@ -329,6 +349,235 @@ def testData(self):
             nesteØvelseDate += datetime.timedelta(weeks=1)
 
 
+SKALA_ÅR = 30
+'Antall år bakover seed --scale lage medlemmer, hendelser og repertoar for'
+
+SKALA_OPPTAK = {consts.Kor.TSS: 45, consts.Kor.TKS: 45}
+'Antall nye storkorister per kor per år med scale=1. Småkoristene og dirigentene kommer i tillegg.'
+
+SKALA_SMÅKOR = {consts.Kor.TSS: [consts.Kor.Pirum, consts.Kor.Knauskoret], consts.Kor.TKS: [consts.Kor.Candiss, consts.Kor.Knauskoret]}
+SKALA_STYREVERV = {
+    consts.Kor.TSS: ['Formann', 'Kasserer', 'Sekretær'], 
+    consts.Kor.TKS: ['Leder', 'Kasserer', 'Sekretær'], 
+    consts.Kor.Pirum: ['Pirumsjef'], 
+    consts.Kor.Knauskoret: ['Knausleder'], 
+    consts.Kor.Candiss: ['Toppcandisse']
+}
+SKALA_ØVINGSDAG = {consts.Kor.TSS: 1, consts.Kor.TKS: 1, consts.Kor.Pirum: 3, consts.Kor.Knauskoret: 2, consts.Kor.Candiss: 0}
+SKALA_KORTYPE = {consts.Kor.TSS: 'Mannskor', consts.Kor.TKS: 'Damekor', consts.Kor.Pirum: 'Mannskor', consts.Kor.Knauskoret: 'Blandakor', consts.Kor.Candiss: 'Damekor'}
+
+def scaleData(self, scale, randomSeed, antallÅr=SKALA_ÅR):
+    '''
+    Lag en database på størrelse med (eller større enn) prod, for å teste ytelse: antallÅr år med medlemmer i alle kor,
+    med stemmegrupper, permisjon, småkor, styreverv, dirigenter og dekorasjoner, ukentlige øvelser med oppmøter og
+    fravær, og et stort notearkiv. Alt opprettes med bulkCreate, så dbCache regnes ut og loggene lages i bulk, og
+    oppmøtene får en opprettelse og en endring i loggen slik de ville fått i prod. Med scale=1 blir det rundt 700 000
+    logger på et par minutter, og scale=1.5 gir en million. Samme randomSeed gir samme data (gitt samme år), så målinger
+    kan sammenlignes. 
+
+    Forutsetter at runSeed har kjørt, og at det ikke finnes data fra en tidligere kjøring (bruk --clear). 
+    '''
+    rng = random.Random(randomSeed)
+    setTop100Navn()
+
+    idag = datetime.date.today()
+    årene = range(idag.year - antallÅr, idag.year + 1)
+
+    alleKor = {kor.navn: kor for kor in Kor.objects.filter(navn__in=consts.bareKorNavn)}
+    alleVerv = {(verv.kor.navn, verv.navn): verv for verv in Verv.objects.filter(kor__navn__in=consts.bareKorNavn).select_related('kor')}
+
+    def verv(korNavn, navn):
+        if (korNavn, navn) not in alleVerv:
+            alleVerv[(korNavn, navn)] = Verv.objects.get_or_create(navn=navn, kor=alleKor[korNavn])[0]
+        return alleVerv[(korNavn, navn)]
+
+    def nyttMedlem(fornavn):
+        medlem = Medlem(fornavn=rng.choice(fornavn), etternavn=rng.choice(etternavn))
+        # Nye medlemmer har ingen verv, så vi slepp at bulkCreate annotate hvert medlem for å finn storkoret
+        medlem.dbCacheAnnotert, medlem.korNavn, medlem.karantenekor = True, None, None
+        medlemmer.append(medlem)
+        return medlem
+
+    def periode(start, slutt):
+        'Slutt som ikke har vært ennå blir None, altså at vervet fortsatt e aktivt'
+        return start, (slutt if slutt and slutt < idag else None)
+
+    medlemmer = []
+    vervInnehavelser = []
+    dekorasjonInnehavelser = []
+
+    # Stemmegruppeverv som (medlem, kor, start, slutt, permisjon), for å finn hvem som skal ha oppmøter og verv
+    stemmegrupper = []
+
+    for år in årene:
+        for korNavn, opptak in SKALA_OPPTAK.items():
+            for i in range(round(opptak * scale)):
+                medlem = nyttMedlem(guttenavn if korNavn == consts.Kor.TSS else jentenavn)
+                medlem.fødselsdato = datetime.date(år - 21, 1, 1) + datetime.timedelta(days=rng.randrange(3 * 365))
+
+                start, slutt = periode(datetime.date(år, 8, 20) + datetime.timedelta(days=rng.randrange(14)), datetime.date(år + rng.choice([1, 2, 3, 3, 4, 4, 5, 7]), 6, 30))
+                vervInnehavelser.append(VervInnehavelse(
+                    medlem=medlem, 
+                    verv=verv(korNavn, rng.choice(alleKor[korNavn].stemmegrupper(lengde=2 + rng.getrandbits(1)))), 
+                    start=start, 
+                    slutt=slutt
+                ))
+                stemmegruppe = [medlem, korNavn, start, slutt, None]
+                stemmegrupper.append(stemmegruppe)
+
+                lengeNok = not slutt or slutt.year >= år + 3
+                if lengeNok and rng.random() < 0.3:
+                    # Småkor fra andre til tredje året
+                    småkorNavn = rng.choice(SKALA_SMÅKOR[korNavn])
+                    start, slutt = periode(datetime.date(år + 1, 1, 10), datetime.date(år + rng.choice([2, 3]), 6, 30))
+                    vervInnehavelser.append(VervInnehavelse(
+                        medlem=medlem, 
+                        verv=verv(småkorNavn, rng.choice(alleKor[korNavn].stemmegrupper(lengde=2))), 
+                        start=start, 
+                        slutt=slutt
+                    ))
+                    stemmegrupper.append([medlem, småkorNavn, start, slutt, None])
+                elif lengeNok and rng.random() < 0.15:
+                    # Permisjon våren andre året
+                    stemmegruppe[4] = periode(datetime.date(år + 1, 1, 1), datetime.date(år + 1, 6, 30))
+                    vervInnehavelser.append(VervInnehavelse(medlem=medlem, verv=verv(korNavn, 'Permisjon'), start=stemmegruppe[4][0], slutt=stemmegruppe[4][1]))
+
+                if korNavn == consts.Kor.TSS and lengeNok and rng.random() < 0.4:
+                    # Vrangstrupe dekorasjonene, der hver er en forutsetning for den neste
+                    for j, dekorasjonNavn in enumerate(consts.vrangstrupeDekorasjoner):
+                        if j > 0 and rng.random() < 0.6 or datetime.date(år + 3 + 2 * j, 11, 15) > idag:
+                            break
+                        dekorasjonInnehavelser.append((medlem, korNavn, dekorasjonNavn, datetime.date(år + 3 + 2 * j, 11, 15)))
+                elif lengeNok and rng.random() < 0.4 and datetime.date(år + 3, 11, 15) <= idag:
+                    dekorasjonInnehavelser.append((medlem, korNavn, 'Sølvnål', datetime.date(år + 3, 11, 15)))
+
+    # Styreverv, ett år av gangen for noen som var aktive hele året
+    for korNavn, styreverv in SKALA_STYREVERV.items():
+        for år in årene:
+            aktive = [s[0] for s in stemmegrupper if s[1] == korNavn and s[2] <= datetime.date(år, 1, 1) and (not s[3] or s[3] >= datetime.date(år, 12, 31))]
+            for vervNavn, medlem in zip(styreverv, rng.sample(aktive, min(len(styreverv), len(aktive)))):
+                vervInnehavelser.append(VervInnehavelse(medlem=medlem, verv=verv(korNavn, vervNavn), start=datetime.date(år, 1, 1), slutt=datetime.date(år, 12, 31)))
+
+    # Dirigenter, eksterne som sitt noen år hver
+    for korNavn in consts.bareKorNavn:
+        år = årene[0]
+        while år <= årene[-1]:
+            lengde = rng.randrange(2, 9)
+            vervInnehavelser.append(VervInnehavelse(
+                medlem=nyttMedlem([*guttenavn, *jentenavn]), 
+                verv=verv(korNavn, 'Dirigent'), 
+                **dict(zip(['start', 'slutt'], periode(datetime.date(år, 1, 1), datetime.date(år + lengde - 1, 12, 31))))
+            ))
+            år += lengde
+
+    self.stdout.write(f'{len(medlemmer)} medlemmer og {len(vervInnehavelser)} vervinnehavelser...')
+    Medlem.bulkCreate(medlemmer)
+    lagreSamledeLogger()
+
+    # Dette propagere til medlemmene, så de får riktig storkor og karantenekor. Propageringen går ikke tilbake 
+    # til vervinnehavelsene som trigget den, så de regnes ut på nytt med de nye navnene til medlemmene. 
+    VervInnehavelse.bulkCreate(vervInnehavelser)
+    propagateDbCache({VervInnehavelse: {vervInnehavelse.pk for vervInnehavelse in vervInnehavelser}}, set())
+    lagreSamledeLogger()
+
+    # Hent medlemmene på nytt, med dbCache fra propageringen
+    oppdaterte = Medlem.objects.in_bulk([medlem.pk for medlem in medlemmer])
+    for stemmegruppe in stemmegrupper:
+        stemmegruppe[0] = oppdaterte[stemmegruppe[0].pk]
+
+    dekorasjoner = {}
+    for medlem, korNavn, dekorasjonNavn, start in dekorasjonInnehavelser:
+        if (korNavn, dekorasjonNavn) not in dekorasjoner:
+            dekorasjoner[(korNavn, dekorasjonNavn)] = Dekorasjon.objects.get_or_create(navn=dekorasjonNavn, kor=alleKor[korNavn])[0]
+    self.stdout.write(f'{len(dekorasjonInnehavelser)} dekorasjoninnehavelser...')
+    DekorasjonInnehavelse.bulkCreate([
+        DekorasjonInnehavelse(medlem=oppdaterte[medlem.pk], dekorasjon=dekorasjoner[(korNavn, dekorasjonNavn)], start=start)
+        for medlem, korNavn, dekorasjonNavn, start in dekorasjonInnehavelser
+    ])
+    lagreSamledeLogger()
+
+    # Ukentlige øvelser hvert semester, og to konserter og en frivillig hendelse i året
+    hendelser = []
+    for korNavn, kor in alleKor.items():
+        for år in årene:
+            for semesterStart, semesterSlutt in [(datetime.date(år, 1, 10), datetime.date(år, 5, 15)), (datetime.date(år, 8, 20), datetime.date(år, 12, 1))]:
+                dato = semesterStart + datetime.timedelta(days=(SKALA_ØVINGSDAG[korNavn] - semesterStart.weekday()) % 7)
+                while dato < semesterSlutt:
+                    hendelser.append(Hendelse(navn='Øvelse', kor=kor, startDate=dato, startTime=datetime.time(18, 30), sluttTime=datetime.time(21, 30)))
+                    dato += datetime.timedelta(weeks=1)
+
+            hendelser.append(Hendelse(navn='Vårkonsert', kor=kor, startDate=datetime.date(år, 5, 20), startTime=datetime.time(19), sluttTime=datetime.time(21)))
+            hendelser.append(Hendelse(navn='Julekonsert', kor=kor, startDate=datetime.date(år, 12, 5), startTime=datetime.time(19), sluttTime=datetime.time(21)))
+            hendelser.append(Hendelse(navn='Semesterstart', kor=kor, kategori=Hendelse.FRIVILLIG, startDate=datetime.date(år, 8, 25), startTime=datetime.time(20), sluttTime=datetime.time(23, 59)))
+
+    self.stdout.write(f'{len(hendelser)} hendelser...')
+    Hendelse.bulkCreate(hendelser)
+    lagreSamledeLogger()
+
+    # Oppmøter for de som har stemmegruppe og ikke permisjon, med fravær for hendelser som har vært. 
+    # Opprettes ett kor og år av gangen, så vi ikke har alt i minnet samtidig. 
+    oppmøteAntall = 0
+    for korNavn in alleKor.keys():
+        for år in årene:
+            aktive = [s for s in stemmegrupper if s[1] == korNavn and s[2] <= datetime.date(år, 12, 31) and (not s[3] or s[3] >= datetime.date(år, 1, 1))]
+
+            oppmøter = []
+            for hendelse in [h for h in hendelser if h.kor.navn == korNavn and h.startDate.year == år and h.kategori != Hendelse.FRIVILLIG]:
+                for medlem, _, start, slutt, permisjon in aktive:
+                    if start <= hendelse.startDate and (not slutt or hendelse.startDate <= slutt) and \
+                        not (permisjon and permisjon[0] <= hendelse.startDate and (not permisjon[1] or hendelse.startDate <= permisjon[1])):
+                        oppmøter.append(Oppmøte(medlem=medlem, hendelse=hendelse, ankomst=hendelse.defaultAnkomst))
+            Oppmøte.bulkCreate(oppmøter)
+
+            # Endringene grupperes etter verdi, så det blir én update per verdi heller enn bulk_update sin CASE per rad
+            endringer = {}
+            for oppmøte in oppmøter:
+                if oppmøte.hendelse.startDate >= idag:
+                    continue
+                if (tall := rng.random()) < 0.08:
+                    oppmøte.ankomst, oppmøte.melding = Oppmøte.KOMMER_IKKE, rng.choice(['Syk', 'Eksamen', 'Jobb', 'Reise'])
+                    oppmøte.gyldig = rng.choice([Oppmøte.GYLDIG, Oppmøte.UGYLDIG])
+                elif tall < 0.9:
+                    oppmøte.fravær = 0
+                elif tall < 0.97:
+                    oppmøte.fravær = rng.randrange(5, 60, 5)
+                endringer.setdefault((oppmøte.ankomst, oppmøte.melding, oppmøte.gyldig, oppmøte.fravær), []).append(oppmøte)
+
+            for (ankomst, melding, gyldig, fravær), endrede in endringer.items():
+                Oppmøte.objects.filter(pk__in=[oppmøte.pk for oppmøte in endrede]).update(ankomst=ankomst, melding=melding, gyldig=gyldig, fravær=fravær)
+                for oppmøte in endrede:
+                    leggTilLogg(loggOppføring(Oppmøte, oppmøte, Logg.UPDATE))
+            lagreSamledeLogger()
+            oppmøteAntall += len(oppmøter)
+        self.stdout.write(f'{oppmøteAntall} oppmøter...')
+
+    # Notearkivet, med et repertoar per semester
+    for korNavn, kor in alleKor.items():
+        sanger = Sang.bulkCreate([
+            Sang(navn=f'{rng.choice(etternavn)}s {rng.choice(["vise", "marsj", "hymne", "vals", "salme", "ballade"])} {i + 1}', kor=kor, kortype=SKALA_KORTYPE[korNavn]) 
+            for i in range(round(400 * scale))
+        ])
+
+        filer = []
+        for sang in sanger:
+            filer.append(SangFil(sang=sang, navn='Partitur', fil=f'notearkiv/skala{sang.pk}.pdf'))
+            for stemmegruppe in rng.sample(kor.stemmegrupper(lengde=2), rng.randrange(len(kor.stemmegrupper(lengde=2)) + 1)):
+                filer.append(SangFil(sang=sang, stemmegruppe=stemmegruppe, fil=f'notearkiv/skala{sang.pk}{stemmegruppe}.mp3'))
+        SangFil.bulkCreate(filer)
+
+        repertoar = Repertoar.bulkCreate([
+            Repertoar(navn=f'{semester} {år}', kor=kor, dato=datetime.date(år, måned, 1)) 
+            for år in årene for semester, måned in [('Vår', 1), ('Høst', 8)]
+        ])
+        Sang.repertoar.through.objects.bulk_create([
+            Sang.repertoar.through(sang=sang, repertoar=r) for r in repertoar for sang in rng.sample(sanger, min(15, len(sanger)))
+        ], batch_size=500)
+        lagreSamledeLogger()
+
+    MedlemTilgang.oppdater([medlem.pk for medlem in medlemmer])
+    self.stdout.write(f'{Logg.objects.count()} logger totalt')
+
+
 def runSeed(self):
     'Seed database based on mode'
 	
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mytxs.models import MedlemTilgang
+
+class Command(BaseCommand):
+    help = '''
+    Sammenlign MedlemTilgang tabellen med tilgangene regnet ut direkte fra vervInnehavelsene, og skriv ut avvik. 
+    Feiler om det finnes avvik, med mindre --fiks er gitt, da oppdateres tabellen istedet. 
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fiks', action='store_true', help='Oppdater tabellen om det finnes avvik')
+
+    def handle(self, *args, **options):
+        mangler, overflødige = MedlemTilgang.avvik()
+
+        for medlemPK, tilgangPK in sorted(mangler):
+            self.stdout.write(f'Mangler: medlem {medlemPK} -> tilgang {tilgangPK}')
+        for medlemTilgang in MedlemTilgang.objects.filter(pk__in=overflødige):
+            self.stdout.write(f'Overflødig: medlem {medlemTilgang.medlem_id} -> tilgang {medlemTilgang.tilgang_id}')
+
+        if not mangler and not overflødige:
+            self.stdout.write(self.style.SUCCESS('Ingen avvik'))
+        elif options['fiks']:
+            MedlemTilgang.oppdater()
+            self.stdout.write(self.style.SUCCESS(f'Fikset {len(mangler)} manglende og {len(overflødige)} overflødige rader'))
+        else:
+            raise CommandError(f'{len(mangler)} manglende og {len(overflødige)} overflødige rader i MedlemTilgang')
@@ -5,8 +5,9 @@ from mytxs.models import Medlem
 
 class Command(BaseCommand):
 
-    help = 'Command som clearer emnekoder-charfieldet til hvert medlem, ved semesterslutt.'
+    help = 'Command som clearer emnekodene til hvert medlem som har noen, ved semesterslutt.'
 
     def handle(self, *args, **options):
-        for medlem in objectsGenerator(Medlem.objects.all()):
+        # Lagringen fjerner også radene deres i MedlemEmne
+        for medlem in objectsGenerator(Medlem.objects.filter(emner__isnull=False).distinct()):
             medlem.emnekoder = ''
\ No newline at end of file
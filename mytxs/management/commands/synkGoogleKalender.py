@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from mytxs.models import GoogleKalender
+from mytxs.utils.googleCalendar import GoogleCalendarManager
+
+class Command(BaseCommand):
+    help = '''
+    Fyll GoogleKalender tabellen fra kalenderne hos Google, med ett getCalendarList kall. Kjøres én gang etter 
+    migrasjon 0033, men fixGoogleCalendar og getCalendarIDs gjør det samme om tabellen ikke er synkronisert. 
+    '''
+
+    def handle(self, *args, **options):
+        før = GoogleKalender.objects.count()
+        GoogleCalendarManager().synkKalendere()
+        self.stdout.write(self.style.SUCCESS(f'GoogleKalender har {GoogleKalender.objects.count()} kalendere, hadde {før}'))
@@ -1,7 +1,15 @@
+import random
 import threading
+import time
+
+from django.conf import settings
+from django.db import connection
 
 from mytxs.forms import addInnstillingerForm
-from mytxs.utils.threadUtils import THREAD_LOCAL
+from mytxs.utils.jobbUtils import kjørJobber, lagreJobber
+from mytxs.utils.loggUtils import samleLogger
+from mytxs.utils.sqlUtils import SqlMåling
+from mytxs.utils.threadUtils import THREAD_LOCAL, mailException
 
 
 def OptionFormMiddleware(get_response):
@@ -24,12 +32,26 @@ def runThreads(threadQueue):
 
 
 def ThreadingMiddleware(get_response):
-    'Legg til request og threadQueue i THREAD_LOCAL, og kjør threads i threadQueue en etter en etter responsen e klar.'
+    '''
+    Legg til request, threadQueue og jobber i THREAD_LOCAL, og kjør threads i threadQueue en etter en etter responsen e klar. 
+    Jobbene lagres i jobbkøen før vi svare, og kjøres så først i threadQueue i maks JOBB_TIDSGRENSE sekund. Det som 
+    ikke rekkes plukkes opp av jobbWorker. 
+    Loggene fra requesten samles og lagres samlet, se samleLogger. 
+    '''
     def middleware(request):
         THREAD_LOCAL.request = request
         THREAD_LOCAL.threadQueue = []
+        THREAD_LOCAL.jobber = []
+
+        with samleLogger():
+            response = get_response(request)
 
-        response = get_response(request)
+        if THREAD_LOCAL.jobber:
+            lagreJobber(THREAD_LOCAL.jobber)
+            target = mailException(lambda: kjørJobber(tidsgrense=settings.JOBB_TIDSGRENSE), request=request)
+            if måling := getattr(THREAD_LOCAL, 'sqlMåling', None):
+                target = måling.iThread(target)
+            THREAD_LOCAL.threadQueue.insert(0, threading.Thread(target=target, daemon=True))
 
         if THREAD_LOCAL.threadQueue:
             threading.Thread(
@@ -40,6 +62,33 @@ def ThreadingMiddleware(get_response):
 
         del THREAD_LOCAL.request
         del THREAD_LOCAL.threadQueue
+        del THREAD_LOCAL.jobber
+
+        return response
+    return middleware
+
+
+def SqlBudsjettMiddleware(get_response):
+    '''
+    Mål antall spørringer og tid i databasen for en andel (SQL_SAMPLING) av requests, og legg det i Server-Timing 
+    og X-Query-Count headerne. Requests over SQL_BUDSJETT_ANTALL spørringer eller SQL_BUDSJETT_TID sekund, eller med 
+    samme spørring SQL_N_PLUSS_1 ganger, logges. Threads fra requesten måles under samme requestId, se SqlMåling. 
+    '''
+    def middleware(request):
+        if random.random() >= settings.SQL_SAMPLING:
+            return get_response(request)
+
+        måling = THREAD_LOCAL.sqlMåling = SqlMåling(beskrivelse=f'{request.method} {request.get_full_path()}')
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(måling):
+                response = get_response(request)
+        finally:
+            del THREAD_LOCAL.sqlMåling
 
+        response['Server-Timing'] = måling.serverTiming(time.perf_counter() - start)
+        response['X-Query-Count'] = måling.antall
+        response['X-Request-Id'] = måling.requestId
+        måling.rapporter()
         return response
     return middleware
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0023_alter_sang_unique_together_sang_sang_unique_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Jobb',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('funksjon', models.CharField(max_length=200)),
+                ('argumenter', models.JSONField(default=dict)),
+                ('nøkkel', models.CharField(max_length=40)),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Venter'), (1, 'Kjører'), (2, 'Ferdig'), (3, 'Feilet')], default=0)),
+                ('forsøk', models.PositiveSmallIntegerField(default=0)),
+                ('opprettet', models.DateTimeField(auto_now_add=True)),
+                ('kjørEtter', models.DateTimeField(default=django.utils.timezone.now)),
+                ('startet', models.DateTimeField(null=True)),
+                ('kjøretid', models.DurationField(null=True)),
+                ('feilmelding', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'jobber',
+                'ordering': ['-opprettet'],
+                'indexes': [models.Index(fields=['status', 'kjørEtter'], name='mytxs_jobb_status_dfec7b_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 0)), fields=('nøkkel',), name='jobb_unik_ventende')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0024_jobb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobb',
+            name='sammenslått',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
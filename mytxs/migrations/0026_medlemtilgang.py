@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from mytxs.utils.modelUtils import vervInnehavelseAktiv
+
+
+def fyllMedlemTilgang(apps, schema_editor):
+    'Fyll tabellen fra vervInnehavelsene, tilsvarende MedlemTilgang.oppdater()'
+    Tilgang = apps.get_model('mytxs', 'Tilgang')
+    MedlemTilgang = apps.get_model('mytxs', 'MedlemTilgang')
+    MedlemTilgang.objects.bulk_create([
+        MedlemTilgang(medlem_id=medlemPK, tilgang_id=tilgangPK) for medlemPK, tilgangPK in Tilgang.objects.filter(
+            vervInnehavelseAktiv('verv__vervInnehavelser', utvidetStart=datetime.timedelta(days=60), utvidetSlutt=datetime.timedelta(days=30))
+        ).values_list('verv__vervInnehavelser__medlem', 'pk').distinct()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0025_jobb_sammenslått'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedlemTilgang',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('medlem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='medlemTilganger', to='mytxs.medlem')),
+                ('tilgang', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='medlemTilganger', to='mytxs.tilgang')),
+            ],
+            options={
+                'unique_together': {('medlem', 'tilgang')},
+            },
+        ),
+        migrations.RunPython(fyllMedlemTilgang, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0026_medlemtilgang'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoggHode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50)),
+                ('instancePK', models.PositiveIntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'logghoder',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='logg',
+            index=models.Index(fields=['model', 'instancePK', 'timeStamp'], name='mytxs_logg_model_fc57bb_idx'),
+        ),
+        migrations.AddField(
+            model_name='logghode',
+            name='logg',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hode', to='mytxs.logg'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='logghode',
+            unique_together={('model', 'instancePK')},
+        ),
+        # Fyll tabellen med nyeste logg for hvert objekt, samme sortering som getLoggForModelPK hadde før
+        migrations.RunSQL(
+            '''
+            INSERT INTO mytxs_logghode (model, "instancePK", logg_id)
+            SELECT DISTINCT ON (model, "instancePK") model, "instancePK", id FROM mytxs_logg
+            ORDER BY model, "instancePK", "timeStamp" DESC, id DESC
+            ''',
+            migrations.RunSQL.noop
+        ),
+    ]
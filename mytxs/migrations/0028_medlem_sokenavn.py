@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:46
+# Manuelt redigert for å legg inn TrigramExtension og mytxs_unaccent, som søkenavn og indeksen på den treng.
+
+from django.contrib.postgres.operations import TrigramExtension
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+import mytxs.utils.modelUtils
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0027_logghode'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # unaccent e bare STABLE, siden ordboka kan endres, men vi bruke alltid den samme
+        migrations.RunSQL(
+            '''
+            CREATE OR REPLACE FUNCTION mytxs_unaccent(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+            ''',
+            'DROP FUNCTION mytxs_unaccent(text)'
+        ),
+        migrations.AddField(
+            model_name='medlem',
+            name='søkenavn',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower(mytxs.utils.modelUtils.ImmutableUnaccent(django.db.models.functions.text.Concat('fornavn', models.Value(' '), 'mellomnavn', models.Value(' '), 'etternavn'))), output_field=models.TextField()),
+        ),
+        migrations.AddIndex(
+            model_name='medlem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['søkenavn'], name='medlem_sokenavn_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+from mytxs.utils.geokoding import normaliserAdresse
+
+
+def fyllGeokode(apps, schema_editor):
+    'Fyll cachen med koordinatene medlemmene allerede har i dbCache, så de slipper å slås opp på nytt'
+    Medlem = apps.get_model('mytxs', 'Medlem')
+    Geokode = apps.get_model('mytxs', 'Geokode')
+
+    geokoder = {}
+    for medlem in Medlem.objects.exclude(boAdresse='', foreldreAdresse=''):
+        for adresse, cord in [
+            (medlem.boAdresse, medlem.dbCacheField.get('boAdresseCord')),
+            (medlem.foreldreAdresse, medlem.dbCacheField.get('foreldreAdresseCord'))
+        ]:
+            if adresse and cord:
+                geokoder[normaliserAdresse(adresse)] = Geokode(adresse=normaliserAdresse(adresse), cord=cord)
+    Geokode.objects.bulk_create(geokoder.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0028_medlem_sokenavn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geokode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('adresse', models.CharField(max_length=100, unique=True)),
+                ('cord', models.JSONField(null=True)),
+                ('oppdatert', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'geokoder',
+            },
+        ),
+        migrations.RunPython(fyllGeokode, migrations.RunPython.noop),
+    ]
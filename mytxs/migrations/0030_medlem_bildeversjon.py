@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0029_geokode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medlem',
+            name='bildeVersjon',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:04
+
+import django.db.models.expressions
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0030_medlem_bildeversjon'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medlem',
+            name='fødselsdag',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.datetime.ExtractMonth('fødselsdato'), '*', models.Value(100)), '+', django.db.models.functions.datetime.ExtractDay('fødselsdato')), output_field=models.PositiveSmallIntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='medlem',
+            index=models.Index(fields=['fødselsdag'], name='medlem_fodselsdag'),
+        ),
+    ]
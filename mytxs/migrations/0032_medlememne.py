@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fyllMedlemEmne(apps, schema_editor):
+    'Fyll tabellen fra emnekoder feltet, normalisert som Medlem.emnekodeListe'
+    Medlem = apps.get_model('mytxs', 'Medlem')
+    MedlemEmne = apps.get_model('mytxs', 'MedlemEmne')
+
+    MedlemEmne.objects.bulk_create([
+        MedlemEmne(medlem=medlem, emnekode=emne)
+        for medlem in Medlem.objects.exclude(emnekoder='')
+        for emne in {emne.strip(',').replace('-', '').upper() for emne in medlem.emnekoder.split()} - {''}
+        if len(emne) <= 10
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0031_medlem_fodselsdag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedlemEmne',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emnekode', models.CharField(max_length=10)),
+                ('medlem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emner', to='mytxs.medlem')),
+            ],
+            options={
+                'verbose_name_plural': 'medlem emner',
+                'indexes': [models.Index(fields=['emnekode'], name='medlememne_emnekode')],
+                'constraints': [models.UniqueConstraint(fields=('medlem', 'emnekode'), name='unique_medlem_emnekode')],
+            },
+        ),
+        migrations.RunPython(fyllMedlemEmne, migrations.RunPython.noop),
+    ]
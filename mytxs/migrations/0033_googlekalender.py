@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0032_medlememne'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoogleKalender',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendarId', models.CharField(max_length=255, unique=True)),
+                ('kor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='googleKalendere', to='mytxs.kor')),
+                ('medlem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='googleKalendere', to='mytxs.medlem')),
+            ],
+            options={
+                'verbose_name_plural': 'google kalendere',
+            },
+        ),
+        migrations.CreateModel(
+            name='GoogleHendelse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('UID', models.CharField(max_length=100)),
+                ('eventId', models.CharField(max_length=1024)),
+                ('kalender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hendelser', to='mytxs.googlekalender', to_field='calendarId')),
+            ],
+            options={
+                'verbose_name_plural': 'google hendelser',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='googlekalender',
+            constraint=models.UniqueConstraint(fields=('kor', 'medlem'), name='unique_googlekalender_kor_medlem'),
+        ),
+        migrations.AddConstraint(
+            model_name='googlehendelse',
+            constraint=models.UniqueConstraint(fields=('kalender', 'UID'), name='unique_googlehendelse_kalender_uid'),
+        ),
+    ]
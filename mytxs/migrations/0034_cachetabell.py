@@ -0,0 +1,18 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def lagCacheTabell(apps, schema_editor):
+    'Opprett tabellen til DatabaseCache, så publiseringen ikke må kjør createcachetable. Gjør ingenting for andre backends.'
+    call_command('createcachetable', database=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mytxs', '0033_googlekalender'),
+    ]
+
+    operations = [
+        migrations.RunPython(lagCacheTabell, migrations.RunPython.noop),
+    ]
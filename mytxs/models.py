@@ -5,13 +5,16 @@ import json
 from django import forms
 from django.apps import apps
 from django.conf import settings as djangoSettings
+from django.contrib.postgres.indexes import GinIndex
 from django.core import mail
-from django.db import IntegrityError, models
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
 from django.db.models import Value as V, Q, Case, When, Max, Sum, ExpressionWrapper, F, OuterRef, Subquery, Prefetch, Exists
 from django.db.models.fields import BLANK_CHOICE_DASH
-from django.db.models.functions import Concat, ExtractMinute, ExtractHour, Right, Coalesce, Cast, Substr, StrIndex, Lower, Substr, StrIndex
+from django.db.models.functions import Concat, ExtractDay, ExtractMonth, ExtractMinute, ExtractHour, Right, Coalesce, Cast, Substr, StrIndex, Lower, Substr, StrIndex
 from django.forms import ValidationError
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.utils.safestring import mark_safe
 from django.utils.functional import cached_property
@@ -19,25 +22,40 @@ from django.utils.functional import cached_property
 from mytxs import consts
 from mytxs import settings as mytxsSettings
 from mytxs.fields import BitmapMultipleChoiceField, MyDateField, MyManyToManyField, MyTimeField
+from mytxs.utils.bildeUtils import BILDE_FORMATER, lagBildeVarianter, slettBildeVarianter, variantSrcset
 from mytxs.utils.formUtils import toolTip
+from mytxs.utils.geokoding import hentCord
 from mytxs.utils.googleCalendar import updateGoogleCalendar
+from mytxs.utils.loggUtils import samleLogger
 from mytxs.utils.modelCacheUtils import DbCacheModel, cacheQS, dbCache
-from mytxs.utils.modelUtils import annotateInstance, bareAktiveDecorator, gjettStemmegruppe, orderKor, qBool, groupBy, getInstancesForKor, isStemmegruppeVervNavn, korLookup, stemmegruppeOrdering, strToModels, validateBruktIKode, validateM2MFieldEmpty, validateStartSlutt, vervInnehavelseAktiv, stemmegruppeVerv
-from mytxs.utils.navBar import navBarNode
-from mytxs.utils.utils import cropImage, getCord, getHalvårStart, getStemmegrupper
+from mytxs.utils.modelUtils import annotateInstance, bareAktiveDecorator, tilgangMemoDecorator, gjettStemmegruppe, orderKor, qBool, groupBy, getInstancesForKor, isStemmegruppeVervNavn, korLookup, stemmegruppeOrdering, strToModels, søkeform, validateBruktIKode, validateM2MFieldEmpty, validateStartSlutt, vervInnehavelseAktiv, stemmegruppeVerv
+from mytxs.utils.navBar import bumpNavBarVersjoner, navBarCacheKey, navBarNode
+from mytxs.utils.utils import cropImage, getHalvårStart, getStemmegrupper
 
 
 class LoggQuerySet(models.QuerySet):
     def getLoggForModelPK(self, model, pk):
-        'Gets the most recent logg given a model (which may be a string or an actual model) and a pk'
+        'Gets the most recent logg given a model (which may be a string or an actual model) and a pk, via LoggHode'
         if type(model) == str:
             model = apps.get_model('mytxs', model)
-        return Logg.objects.filter(model=model.__name__, instancePK=pk).order_by('-timeStamp').first()
+        if hode := LoggHode.objects.filter(model=model.__name__, instancePK=pk).select_related('logg').first():
+            return hode.logg
     
     def getLoggFor(self, instance):
         'Gets the most recent logg corresponding to the instance'
         return self.getLoggForModelPK(type(instance), instance.pk)
 
+    def getNyesteLogger(self, nøkler):
+        '''
+        Gets the most recent logg for many (model name, pk) pairs in one query, via LoggHode. 
+        Returns {(model name, pk): logg}. 
+        '''
+        q = qBool(False)
+        for modelNavn in {modelNavn for modelNavn, pk in nøkler}:
+            q |= Q(model=modelNavn, instancePK__in=[pk for m, pk in nøkler if m == modelNavn and pk != None])
+
+        return {(hode.model, hode.instancePK): hode.logg for hode in LoggHode.objects.filter(q).select_related('logg')}
+
     def getLoggLinkFor(self, instance):
         'get_absolute_url for the most recent logg correpsonding to the instance'
         if logg := self.getLoggFor(instance):
@@ -163,6 +181,37 @@ class Logg(models.Model):
     class Meta:
         ordering = ['-timeStamp', '-pk']
         verbose_name_plural = 'logger'
+        # For historikken til ett objekt, altså nextLogg og lastLogg
+        indexes = [models.Index(fields=['model', 'instancePK', 'timeStamp'])]
+
+
+class LoggHode(models.Model):
+    '''
+    Peker til nyeste logg for hvert objekt, slik at getLoggFor blir ett oppslag på en unik nøkkel heller enn 
+    å sortere alle loggene til objektet. Logg tabellen bare vokse, men denne har én rad per objekt. 
+    Oppdateres av lagreLogger i samme transaksjon som loggene lages. 
+    '''
+    model = models.CharField(
+        max_length=50
+    )
+    'Dette er model.__name__'
+
+    instancePK = models.PositiveIntegerField(
+        null=False
+    )
+
+    logg = models.OneToOneField(
+        Logg,
+        on_delete=models.CASCADE,
+        related_name='hode'
+    )
+
+    def __str__(self):
+        return f'{self.model} {self.instancePK} -> {self.logg}'
+
+    class Meta:
+        unique_together = ['model', 'instancePK']
+        verbose_name_plural = 'logghoder'
 
 
 class LoggM2M(models.Model):
@@ -312,6 +361,26 @@ class MedlemQuerySet(models.QuerySet):
         
         return self.annotate(**conditionDict).annotate(**valueDict)
 
+    def kommendeBursdager(self, limit, offset=0, dato=None):
+        '''
+        Liste med medlemmene sortert etter neste bursdag fra og med dato, med limit og offset. Gjøres som to
+        range scans på fødselsdag indeksen, først fra dato ut året, og så fra starten av året fram til dato. 
+        '''
+        if dato == None:
+            dato = datetime.date.today()
+        idag = dato.month * 100 + dato.day
+
+        resten = self.filter(fødselsdag__gte=idag).order_by('fødselsdag', *Medlem._meta.ordering)
+        medlemmer = list(resten[offset:offset+limit])
+        if len(medlemmer) == limit:
+            return medlemmer
+
+        # Hvor mange som har bursdag resten av året, for å vite hvor langt inn i neste år vi skal
+        antallResten = offset + len(medlemmer) if medlemmer else resten.count()
+        nesteÅr = self.filter(fødselsdag__lt=idag).order_by('fødselsdag', *Medlem._meta.ordering)
+        start = max(0, offset - antallResten)
+        return medlemmer + list(nesteÅr[start:start + limit - len(medlemmer)])
+
     def sjekkheftePrefetch(self, kor, dato=None):
         'Prefetch all dataen vi skal ha i det koret. Om Kor er None prefetches ingenting.'
         if dato == None:
@@ -407,6 +476,13 @@ class Medlem(DbCacheModel):
     mellomnavn = models.CharField(max_length = 50, default='', blank=True)
     etternavn = models.CharField(max_length = 50, default='Testbruker')
 
+    søkenavn = models.GeneratedField(
+        expression=søkeform(Concat('fornavn', V(' '), 'mellomnavn', V(' '), 'etternavn')),
+        output_field=models.TextField(),
+        db_persist=True
+    )
+    'Fullt navn uten diakritiske tegn og med små bokstaver, med en trigram indeks, for søk på medlemmer'
+
     @property
     def navn(self):
         'Returne navnet med korrekt mellomrom'
@@ -420,6 +496,12 @@ class Medlem(DbCacheModel):
 
     # Følgende fields er bundet av GDPR, vi må ha godkjennelse fra medlemmet for å lagre de. 
     fødselsdato = MyDateField(null=True, blank=True)
+    fødselsdag = models.GeneratedField(
+        expression=ExtractMonth('fødselsdato') * 100 + ExtractDay('fødselsdato'),
+        output_field=models.PositiveSmallIntegerField(),
+        db_persist=True
+    )
+    'Dagen i året de har bursdag på formen MMDD (f.eks. 1224 for julaften), med en indeks for sortering etter neste bursdag'
     epost = models.EmailField(max_length=100, blank=True)
     tlf = models.CharField(max_length=20, default='', blank=True)
     studieEllerJobb = models.CharField(max_length=100, blank=True, verbose_name='Studie eller jobb')
@@ -429,13 +511,11 @@ class Medlem(DbCacheModel):
 
     @dbCache(paths=['.boAdresse'])
     def boAdresseCord(self):
-        if self.boAdresse:
-            return getCord(self.boAdresse)
+        return hentCord(self.boAdresse)
 
     @dbCache(paths=['.foreldreAdresse'])
     def foreldreAdresseCord(self):
-        if self.foreldreAdresse:
-            return getCord(self.foreldreAdresse)
+        return hentCord(self.foreldreAdresse)
 
     sjekkhefteSynlig = BitmapMultipleChoiceField(choicesList=consts.sjekkhefteSynligOptions, verbose_name='Synlig i sjekkheftet', editable=False)
     matpreferanse = BitmapMultipleChoiceField(choicesList=consts.matpreferanseOptions)
@@ -445,6 +525,14 @@ class Medlem(DbCacheModel):
 
     bilde = models.ImageField(upload_to=bildeUploadTo, null=True, blank=True)
 
+    bildeVersjon = models.BigIntegerField(null=True, editable=False)
+    'Settes når variantene av bildet er laget, se mytxs/utils/bildeUtils.py. None betyr at de ikke er klare.'
+
+    def bildeSrcset(self):
+        'srcset for hvert format til variantene av bildet, eller None om de ikke er klare'
+        if self.bilde and self.bildeVersjon:
+            return {endelse: variantSrcset(self, endelse) for endelse in BILDE_FORMATER}
+
     VÅRBREV_FYSISK, VÅRBREV_DIGITALT, VÅRBREV_IKKE = True, None, False
     VÅRBREV_CHOICES = ((VÅRBREV_FYSISK, 'Ønsker fysisk vårbrev'), (VÅRBREV_DIGITALT, 'Ønsker digitalt vårbrev'), (VÅRBREV_IKKE, 'Ønsker ikke vårbrev'))
     ønskerVårbrev = models.BooleanField(null=True, blank=True, verbose_name='Ønsker vårbrev', choices=VÅRBREV_CHOICES, default=VÅRBREV_IKKE)
@@ -456,9 +544,14 @@ class Medlem(DbCacheModel):
 
     overførtData = models.BooleanField(default=False, editable=False)
 
+    @classmethod
+    def dbCacheQueryset(cls, queryset):
+        return queryset.annotateKor().annotateKarantenekor(storkor=True)
+
     @dbCache(paths=['vervInnehavelser.'])
     def storkorNavn(self):
-        annotateInstance(self, lambda qs: qs.annotateKor())
+        if not getattr(self, 'dbCacheAnnotert', False):
+            annotateInstance(self, lambda qs: qs.annotateKor())
         return self.korNavn
 
     @cached_property
@@ -487,8 +580,11 @@ class Medlem(DbCacheModel):
 
     @property
     def faktiskeTilganger(self):
-        'Returne aktive bruktIKode tilganger, til bruk i addOptionForm som trenger å vite hvilke tilganger du har før innstillinger filtrering'
-        return Tilgang.objects.filter(vervInnehavelseAktiv('verv__vervInnehavelser', utvidetStart=datetime.timedelta(days=60), utvidetSlutt=datetime.timedelta(days=30)), verv__vervInnehavelser__medlem=self, bruktIKode=True).distinct()
+        '''
+        Returne aktive bruktIKode tilganger, til bruk i addOptionForm som trenger å vite hvilke tilganger du har før innstillinger filtrering. 
+        Leses fra MedlemTilgang tabellen, så dette e ett oppslag på et indeksert felt. 
+        '''
+        return Tilgang.objects.filter(medlemTilganger__medlem=self, bruktIKode=True)
 
     @cached_property
     def tilganger(self):
@@ -507,6 +603,15 @@ class Medlem(DbCacheModel):
         if not self.innstillinger.get('tversAvKor', False):
             tilganger = tilganger.exclude(navn=consts.Tilgang.tversAvKor)
         return cacheQS(tilganger.select_related('kor'), props=['navn', 'kor', 'kor__navn'])
+
+    @cached_property
+    def tilgangMemo(self):
+        'Memo for tilgangsstyringen, se tilgangMemoDecorator og harRedigerTilgang. Lever like lenge som instansen, altså ett request.'
+        return {}
+
+    def korForTilgang(self, *tilgangNavn):
+        'Returne pks til korene der medlemmet har en av tilgangene, som et set. Bruke de cachede tilgangene, så dette koste ingen databaseoppslag.'
+        return {tilgang.kor_id for tilgang in self.tilganger if tilgang.navn in tilgangNavn}
     
     @cached_property
     def navBar(self):
@@ -520,8 +625,13 @@ class Medlem(DbCacheModel):
         
         Veldig viktig at dette ikke returne noko som inneheld querysets, for da vil vi hitte databasen veldig mange ganger!
         Dette e også en av få deler av kodebasen som faktisk kjører på alle sider, så fint å optimaliser denne koden 
-        så my som mulig mtp databaseoppslag. 
+        så my som mulig mtp databaseoppslag. Derfor caches treet på tvers av requests, se navBarCacheKey 
+        for hva som invaliderer det. 
         '''
+        return cache.get_or_set(navBarCacheKey(self.pk), self.lagNavBar, 60 * 60 * 24)
+
+    def lagNavBar(self):
+        'Bygg navBar treet uten å gå via cachen'
         sider = navBarNode(inURL=False, isPage=False)
 
         # Sjekkheftet
@@ -567,7 +677,7 @@ class Medlem(DbCacheModel):
             ).values_list('navn', flat=True),
         ):
             navBarNode(sider['notearkiv'], kor, isPage=False)
-            navBarNode(sider['notearkiv'][kor], 'repertoar', defaultParameters=f'?år={datetime.date.today().year}')
+            navBarNode(sider['notearkiv'][kor], 'repertoar', defaultParameters='?år={år}')
             navBarNode(sider['notearkiv'][kor], 'søk')
             for synligRepertoar in Repertoar.objects.filter(kor__navn=kor, synlig=True).values_list('navn', flat=True):
                 navBarNode(sider['notearkiv'][kor], synligRepertoar)
@@ -589,7 +699,7 @@ class Medlem(DbCacheModel):
             navBarNode(admin, 'medlem')
 
         if self.tilganger.filter(navn__in=[consts.Tilgang.tversAvKor, consts.Tilgang.semesterplan, consts.Tilgang.fravær]).exists():
-            navBarNode(admin, 'hendelse', defaultParameters=f'?start={datetime.date.today()}')
+            navBarNode(admin, 'hendelse', defaultParameters='?start={iDag}')
 
         if self.tilganger.filter(navn__in=[consts.Tilgang.tversAvKor, consts.Tilgang.fravær]).exists():
             fravær = navBarNode(admin, 'fravær', isPage=False)
@@ -597,7 +707,7 @@ class Medlem(DbCacheModel):
 
             fraværOversikt = navBarNode(fravær, 'oversikt', isPage=False)
             fraværStatistikk = navBarNode(fravær, 'statistikk', isPage=False)
-            if korMedFraværTilgang := Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.Tilgang.fravær)).values_list('navn', flat=True):
+            if korMedFraværTilgang := self.tilganger.filter(navn=consts.Tilgang.fravær).values_list('kor__navn', flat=True):
                 fraværOversikt.addChildren(*korMedFraværTilgang)
                 fraværStatistikk.addChildren(*korMedFraværTilgang)
 
@@ -639,17 +749,31 @@ class Medlem(DbCacheModel):
         Ikke i databasen e f.eks. når vi har et inlineformset som allerede har satt kor på objektet vi kan create. 
         '''
         if instance.pk:
-            # Dersom instansen finnes i databasen
-            return self.redigerTilgangQueryset(type(instance)).contains(instance)
+            # Dersom instansen finnes i databasen, sjekk memoet først (se hentRedigerTilganger)
+            sjekket = self.tilgangMemo.setdefault(('harRedigerTilgang', type(instance)), {})
+            if instance.pk not in sjekket:
+                sjekket[instance.pk] = self.redigerTilgangQueryset(type(instance)).contains(instance)
+            return sjekket[instance.pk]
         
         if kor := instance.kor:
             # Dersom den ikke finnes, men den vet hvilket kor den havner i
-            return Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.modelTilTilgangNavn[type(instance).__name__])).contains(kor)
+            return kor.pk in self.korForTilgang(consts.modelTilTilgangNavn[type(instance).__name__])
 
         # Ellers, return om vi har noen tilgang til den typen objekt
         return self.tilganger.filter(navn=consts.modelTilTilgangNavn[type(instance).__name__]).exists()
 
+    def hentRedigerTilganger(self, instances):
+        '''
+        Sjekk redigertilgang til mange lagrede instanser med ett oppslag per modell, og legg svaret i memoet 
+        til harRedigerTilgang. Brukes av disableFormMedlem, så et formset ikke koste et oppslag per form. 
+        '''
+        for model in {type(instance) for instance in instances if instance.pk}:
+            pks = {instance.pk for instance in instances if type(instance) == model and instance.pk}
+            tilgangPKs = set(self.redigerTilgangQueryset(model).filter(pk__in=pks).values_list('pk', flat=True))
+            self.tilgangMemo.setdefault(('harRedigerTilgang', model), {}).update({pk: pk in tilgangPKs for pk in pks})
+
     @bareAktiveDecorator
+    @tilgangMemoDecorator
     def redigerTilgangQueryset(self, model, resModel=None, fieldType=None):
         '''
         Returne et queryset av objekter vi har tilgang til å redigere. 
@@ -682,7 +806,7 @@ class Medlem(DbCacheModel):
         # Medlem er komplisert fordi medlem ikke har et enkelt forhold til kor. 
         if model == Medlem:
             # Skaff medlemmer i koret du har tilgangen
-            medlemmer = getInstancesForKor(resModel, Kor.objects.filter(tilganger__in=self.tilganger.filter(navn=consts.Tilgang.medlemsdata)))
+            medlemmer = getInstancesForKor(resModel, self.korForTilgang(consts.Tilgang.medlemsdata))
             
             # Dersom du har tversAvKor, hiv på alle medlemmer uten kor
             if resModel == Medlem and self.tilganger.filter(navn=consts.Tilgang.tversAvKor).exists():
@@ -693,13 +817,14 @@ class Medlem(DbCacheModel):
             return medlemmer
 
         # For alle andre modeller, bare skaff objektene for modellen og koret du evt har tilgangen. 
-        korForTilganger = Kor.objects.filter(Q(tilganger__in=self.tilganger.filter(navn=consts.modelTilTilgangNavn[model.__name__])))
+        # Korene hentes som et set av pks fra de cachede tilgangene, så de havne i sql som kor_id IN (...) 
+        korForTilganger = self.korForTilgang(consts.modelTilTilgangNavn[model.__name__])
 
         # Håndter objekt på tvers av storkor, dersom dette er en TXS model
         # TODO: Sjå meir på dette, e må forstå det!
         if (resModel.__name__ in consts.TXSModelNames or \
             (resModel == Kor and model.__name__ in consts.TXSModelNames)) and \
-                korForTilganger.filter(navn__in=consts.bareStorkorNavn).exists():
+                self.tilganger.filter(navn=consts.modelTilTilgangNavn[model.__name__], kor__navn__in=consts.bareStorkorNavn).exists():
             korForTilganger = Kor.objects.filter(
                 Q(navn=consts.Kor.TXS) | Q(
                     ~Q(navn__in=consts.bareStorkorNavn),
@@ -716,13 +841,13 @@ class Medlem(DbCacheModel):
         if model in [Verv, VervInnehavelse] and resModel in [Verv, VervInnehavelse]:
             if resModel == Verv:
                 return returnQueryset.exclude(
-                    ~Q(kor__tilganger__in=self.tilganger.filter(navn=consts.Tilgang.tilgang)),
-                    tilganger__in=Tilgang.objects.exclude(pk__in=self.tilganger).filter(bruktIKode=True),
+                    ~Q(kor__in=self.korForTilgang(consts.Tilgang.tilgang)),
+                    tilganger__in=Tilgang.objects.exclude(pk__in=[tilgang.pk for tilgang in self.tilganger]).filter(bruktIKode=True),
                 )
             if resModel == VervInnehavelse:
                 return returnQueryset.exclude(
-                    ~Q(verv__kor__tilganger__in=self.tilganger.filter(navn=consts.Tilgang.tilgang)),
-                    verv__tilganger__in=Tilgang.objects.exclude(pk__in=self.tilganger).filter(bruktIKode=True), 
+                    ~Q(verv__kor__in=self.korForTilgang(consts.Tilgang.tilgang)),
+                    verv__tilganger__in=Tilgang.objects.exclude(pk__in=[tilgang.pk for tilgang in self.tilganger]).filter(bruktIKode=True), 
                 )
 
         return returnQueryset
@@ -732,6 +857,7 @@ class Medlem(DbCacheModel):
         return self.sideTilgangQueryset(type(instance)).contains(instance)
 
     @bareAktiveDecorator
+    @tilgangMemoDecorator
     def sideTilgangQueryset(self, model):
         '''
         Returne queryset av objekt der vi har tilgang til noe på den tilsvarende siden.
@@ -768,9 +894,9 @@ class Medlem(DbCacheModel):
             if (
                 (model.__name__ == sourceModel) and \
                 (relatedTilgang := [consts.modelTilTilgangNavn[m] for m in relatedModel]) and \
-                (relaterteTilganger := self.tilganger.filter(navn__in=relatedTilgang))
+                (relaterteKor := self.korForTilgang(*relatedTilgang))
             ):
-                return getInstancesForKor(model, Kor.objects.filter(tilganger__in=relaterteTilganger)) | self.redigerTilgangQueryset(model)
+                return getInstancesForKor(model, relaterteKor) | self.redigerTilgangQueryset(model)
 
         # Forøverig, return de sidene der du kan redigere sidens instans
         return self.redigerTilgangQueryset(model)
@@ -786,9 +912,10 @@ class Medlem(DbCacheModel):
     @dbCache(paths=['vervInnehavelser.'])
     def __str__(self):
         if self.pk:
-            # Det som allerede e annotata kan vær feil no, så gjør det på nytt!
-            annotateInstance(self, MedlemQuerySet.annotateKor)
-            annotateInstance(self, MedlemQuerySet.annotateKarantenekor, storkor=True)
+            # Det som allerede e annotata kan vær feil no, så gjør det på nytt! Med mindre propagateDbCache nettopp gjorde det. 
+            if not getattr(self, 'dbCacheAnnotert', False):
+                annotateInstance(self, MedlemQuerySet.annotateKor)
+                annotateInstance(self, MedlemQuerySet.annotateKarantenekor, storkor=True)
             if self.korNavn:
                 return f'{self.navn} {self.korNavn} ' + 'K' + (str(self.karantenekor)[-2:] if self.karantenekor >= 2000 else str(self.karantenekor))
         return self.navn
@@ -796,6 +923,10 @@ class Medlem(DbCacheModel):
     class Meta:
         ordering = ['fornavn', 'mellomnavn', 'etternavn', '-pk']
         verbose_name_plural = 'medlemmer'
+        indexes = [
+            GinIndex(fields=['søkenavn'], opclasses=['gin_trgm_ops'], name='medlem_sokenavn_trgm'),
+            models.Index(fields=['fødselsdag'], name='medlem_fodselsdag')
+        ]
 
     def clean(self, *args, **kwargs): 
         for emne in self.emnekoder.split():
@@ -806,17 +937,72 @@ class Medlem(DbCacheModel):
                     code='ugyldigEmnekode'
                 )
     
+    def emnekodeListe(self):
+        'Emnekodene i emnekoder normalisert med store bokstaver og uten bindestrek, uten duplikater'
+        return sorted({emne.strip(',').replace('-', '').upper() for emne in self.emnekoder.split()} - {''})
+
+    def oppdaterEmner(self):
+        'Synkroniser MedlemEmne tabellen med emnekoder feltet'
+        gamle = set(self.emner.values_list('emnekode', flat=True))
+        nye = set(self.emnekodeListe())
+        if gamle - nye:
+            self.emner.filter(emnekode__in=gamle - nye).delete()
+        if nye - gamle:
+            MedlemEmne.objects.bulk_create([MedlemEmne(medlem=self, emnekode=emne) for emne in nye - gamle], ignore_conflicts=True)
+
     def save(self, *args, **kwargs):
         self.clean()
 
-        # Crop bildet om det har endret seg
-        if self.pk and self.bilde and self.bilde != Medlem.objects.get(pk=self.pk).bilde:
+        oppdaterEmner = kwargs.get('update_fields') is None or 'emnekoder' in kwargs['update_fields']
+
+        # Den lagrede raden hentes én gang, for å sjekke både bildet og emnekodene
+        gammel = None
+        if self.pk and (self.bilde or oppdaterEmner):
+            gammel = Medlem.objects.filter(pk=self.pk).only('bilde', 'emnekoder').first()
+
+        # Crop bildet om det har endret seg, og lag nye varianter av det etter lagring
+        nyttBilde = False
+        if gammel and self.bilde and self.bilde != gammel.bilde:
             self.bilde = cropImage(self.bilde, self.bilde.name, 270, 330)
+            self.bildeVersjon = None
+            nyttBilde = True
+        elif self.bildeVersjon and not self.bilde:
+            slettBildeVarianter(self.pk)
+            self.bildeVersjon = None
         super().save(*args, **kwargs)
 
+        # MedlemEmne synkroniseres bare når emnekodene faktisk har endret seg
+        if oppdaterEmner and self.emnekoder != (gammel.emnekoder if gammel else ''):
+            self.oppdaterEmner()
+
+        if nyttBilde:
+            lagBildeVarianter(self.pk)
+
     def delete(self, *args, **kwargs):
         validateM2MFieldEmpty(self, 'turneer')
+        pk = self.pk
         super().delete(*args, **kwargs)
+        slettBildeVarianter(pk)
+
+
+class MedlemEmne(models.Model):
+    'Emnekodene til et medlem, én rad per emne, holdt i synk med Medlem.emnekoder når medlemmet lagres'
+    medlem = models.ForeignKey(
+        Medlem,
+        on_delete=models.CASCADE,
+        related_name='emner'
+    )
+
+    emnekode = models.CharField(max_length=10)
+    'Normalisert av Medlem.emnekodeListe'
+
+    def __str__(self):
+        return f'{self.emnekode} for {self.medlem}'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['medlem', 'emnekode'], name='unique_medlem_emnekode')]
+        indexes = [models.Index(fields=['emnekode'], name='medlememne_emnekode')]
+        verbose_name_plural = 'medlem emner'
 
 
 class KorQuerySet(models.QuerySet):
@@ -1056,6 +1242,66 @@ class Tilgang(DbCacheModel):
         super().delete(*args, **kwargs)
 
 
+class MedlemTilgang(models.Model):
+    '''
+    Materialisert tabell over hvilke tilganger hvert medlem har (og dermed i hvilket kor), slik at vi slepp å 
+    gå via VervInnehavelse og datoene dems hver gang vi sjekke tilganger. Oppdateres for berørte medlemmer fra 
+    signals (se tilgangSignals.py), og for alle hver natt fra cron siden vervInnehavelser går ut på dato. 
+    Endringer på selve Tilgang treng ingen oppdatering, siden navn og kor leses via fremmednøkkelen. 
+    '''
+    medlem = models.ForeignKey(
+        Medlem,
+        on_delete=models.CASCADE,
+        related_name='medlemTilganger'
+    )
+    tilgang = models.ForeignKey(
+        Tilgang,
+        on_delete=models.CASCADE,
+        related_name='medlemTilganger'
+    )
+
+    UTVIDET_START = datetime.timedelta(days=60)
+    UTVIDET_SLUTT = datetime.timedelta(days=30)
+    'Man har tilgangene fra 60 dager før vervInnehavelsen starte til 30 dager etter den slutte'
+
+    @classmethod
+    def levende(cls, medlemPKs=None):
+        'Regne ut (medlem pk, tilgang pk) parene direkte fra vervInnehavelsene, eventuelt bare for medlemPKs.'
+        return set(Tilgang.objects.filter(
+            vervInnehavelseAktiv('verv__vervInnehavelser', utvidetStart=cls.UTVIDET_START, utvidetSlutt=cls.UTVIDET_SLUTT),
+            qBool(True) if medlemPKs == None else Q(verv__vervInnehavelser__medlem__in=medlemPKs)
+        ).values_list('verv__vervInnehavelser__medlem', 'pk').distinct())
+
+    @classmethod
+    def avvik(cls, medlemPKs=None):
+        'Sammenligne tabellen med levende, og returne (par som mangle, rader som ikke skulle vært der).'
+        levende = cls.levende(medlemPKs)
+        eksisterende = cls.objects.all() if medlemPKs == None else cls.objects.filter(medlem__in=medlemPKs)
+        eksisterende = {(medlemPK, tilgangPK): pk for pk, medlemPK, tilgangPK in eksisterende.values_list('pk', 'medlem', 'tilgang')}
+        return levende - eksisterende.keys(), [pk for par, pk in eksisterende.items() if par not in levende]
+
+    @classmethod
+    def oppdater(cls, medlemPKs=None):
+        '''
+        Oppdater tabellen for medlemPKs, eller alle medlemmer. Returne antall rader som ble lagt til og slettet. 
+        navBar til medlemmene som fikk endret tilganger invalideres, både nå og etter commit, som i navBarSignals.py. 
+        '''
+        mangler, overflødige = cls.avvik(medlemPKs)
+        endret = {medlemPK for medlemPK, tilgangPK in mangler} | set(cls.objects.filter(pk__in=overflødige).values_list('medlem', flat=True))
+        cls.objects.filter(pk__in=overflødige).delete()
+        cls.objects.bulk_create([cls(medlem_id=medlemPK, tilgang_id=tilgangPK) for medlemPK, tilgangPK in mangler], ignore_conflicts=True)
+        if endret:
+            bumpNavBarVersjoner(endret)
+            transaction.on_commit(lambda: bumpNavBarVersjoner(endret))
+        return len(mangler), len(overflødige)
+
+    def __str__(self):
+        return f'{self.medlem_id} -> {self.tilgang_id}'
+
+    class Meta:
+        unique_together = ('medlem', 'tilgang')
+
+
 class Dekorasjon(DbCacheModel):
     navn = models.CharField(max_length=30)
     kor = models.ForeignKey(
@@ -1273,14 +1519,72 @@ class Turne(DbCacheModel):
         super().delete(*args, **kwargs)
 
 
+def oppmøteVervInnehavelser(medlem, kor, dato, permisjon=False):
+    '''
+    Returne vervInnehavelser som gir medlem oppmøte i kor på dato, eller med permisjon=True de som tar det bort. 
+    Tilsvarer Hendelse.oppmøteMedlemmer, og argumentene er typisk OuterRefs. 
+    '''
+    return VervInnehavelse.objects.filter(
+        Q(verv__navn='Permisjon') if permisjon else stemmegruppeVerv(includeDirr=True),
+        Q(slutt=None) | Q(slutt__gte=dato),
+        medlem=medlem,
+        verv__kor=kor,
+        start__lte=dato
+    )
+
+
 class HendelseQuerySet(models.QuerySet):
     def genererHendelseOppmøter(self, *dates):
-        'Call genererOppmøter på hendelser mellom minste og støste Date i dates. None skal tolkes som date.max'
-        for hendelse in self.filter(
+        '''
+        Tilsvarer genererOppmøter på hendelser mellom minste og støste Date i dates. None skal tolkes som date.max. 
+        Hendelser som ikke er undergrupper håndteres samlet med et fast antall spørringer, uansett hvor mange det er. 
+        '''
+        hendelser = self.filter(
             qBool(True) if None in dates else Q(startDate__lte=max(dates)), 
-            startDate__gte=min([d for d in dates if d != None]), 
-        ):
-            hendelse.genererOppmøter()
+            startDate__gte=max(min([d for d in dates if d != None]), getHalvårStart()), 
+        )
+
+        with samleLogger():
+            hendelser.exclude(kategori=Hendelse.UNDERGRUPPE).leggTilOppmøter()
+            hendelser.exclude(kategori=Hendelse.UNDERGRUPPE).fjernOppmøter()
+
+            for hendelse in hendelser.filter(kategori=Hendelse.UNDERGRUPPE):
+                hendelse.genererOppmøter()
+
+    def manglendeOppmøter(self):
+        '''
+        Returne set av (hendelse pk, medlem pk) for oppmøtene som mangle på hendelsene, altså oppmøteMedlemmer 
+        minus de som allerede har oppmøte, med én spørring. Alle betingelsene på kor__verv__vervInnehavelser 
+        må stå i samme filter, slik at de gjelder samme vervInnehavelse. 
+        '''
+        return set(self.filter(kategori__in=[Hendelse.OBLIG, Hendelse.PÅMELDING]).filter(
+            stemmegruppeVerv('kor__verv', includeDirr=True),
+            Q(kor__verv__vervInnehavelser__slutt=None) | Q(kor__verv__vervInnehavelser__slutt__gte=F('startDate')),
+            ~Exists(oppmøteVervInnehavelser(OuterRef('kor__verv__vervInnehavelser__medlem'), OuterRef('kor'), OuterRef('startDate'), permisjon=True)),
+            ~Exists(Oppmøte.objects.filter(hendelse=OuterRef('pk'), medlem=OuterRef('kor__verv__vervInnehavelser__medlem'))),
+            kor__verv__vervInnehavelser__start__lte=F('startDate')
+        ).values_list('pk', 'kor__verv__vervInnehavelser__medlem').distinct())
+
+    def leggTilOppmøter(self):
+        'Opprett manglende oppmøter på hendelsene, se manglendeOppmøter.'
+        return Oppmøte.opprettFor(self.manglendeOppmøter())
+
+    def fjernOppmøter(self):
+        '''
+        Fjerne oppmøter for medlemmer som ikke lenger skal ha oppmøte på hendelsene, som ikke har noe 
+        informasjon assosiert med seg. Tilsvarer removeOppmøter med softDelete, men for hendelser som ikke er undergrupper. 
+        '''
+        Oppmøte.objects.filter(
+            Q(hendelse__kategori=Hendelse.OBLIG, ankomst=Oppmøte.KOMMER) | 
+            Q(hendelse__kategori__in=[Hendelse.PÅMELDING, Hendelse.FRIVILLIG], ankomst=Oppmøte.KOMMER_KANSKJE),
+            hendelse__in=self.exclude(kategori=Hendelse.UNDERGRUPPE),
+            fravær__isnull=True,
+            melding=''
+        ).exclude(
+            Exists(oppmøteVervInnehavelser(OuterRef('medlem'), OuterRef('hendelse__kor'), OuterRef('hendelse__startDate'))),
+            ~Exists(oppmøteVervInnehavelser(OuterRef('medlem'), OuterRef('hendelse__kor'), OuterRef('hendelse__startDate'), permisjon=True)),
+            hendelse__kategori__in=[Hendelse.OBLIG, Hendelse.PÅMELDING]
+        ).delete()
 
     def annotateDirigentTilstede(self):
         return self.annotate(
@@ -1403,8 +1707,7 @@ class Hendelse(DbCacheModel):
 
     def addOppmøter(self, medlemmer):
         'Legg til oppmøtan til disse medlemman'
-        for medlem in medlemmer.filter(~Q(oppmøter__hendelse=self)):
-            self.oppmøter.create(medlem=medlem, hendelse=self, ankomst=self.defaultAnkomst)
+        Oppmøte.opprettFor({(self.pk, medlemPK) for medlemPK in medlemmer.filter(~Q(oppmøter__hendelse=self)).values_list('pk', flat=True)})
 
     def removeOppmøter(self, medlemmer, oldSelf=None, softDelete=True):
         'Fjerne oppmøter til medlemman som ikkje e i medlemmer lista.'
@@ -1642,6 +1945,21 @@ class Oppmøte(DbCacheModel):
         else:
             return f'Oppmøte {self.medlem} -> {self.hendelse}'
 
+    @classmethod
+    def opprettFor(cls, par):
+        '''
+        Opprett oppmøter for (hendelse pk, medlem pk) parene med bulkCreate, altså uten save per oppmøte. 
+        Det går fint fordi save bare gjør noe for eksisterende oppmøter. 
+        '''
+        if not par:
+            return []
+        hendelser = Hendelse.objects.select_related('kor').in_bulk({hendelsePK for hendelsePK, medlemPK in par})
+        medlemmer = Medlem.objects.in_bulk({medlemPK for hendelsePK, medlemPK in par})
+        return cls.bulkCreate([
+            cls(hendelse=hendelser[hendelsePK], medlem=medlemmer[medlemPK], ankomst=hendelser[hendelsePK].defaultAnkomst)
+            for hendelsePK, medlemPK in sorted(par)
+        ])
+
     class Meta:
         unique_together = ('medlem', 'hendelse')
         ordering = ['-hendelse', 'medlem']
@@ -1895,3 +2213,102 @@ class SangFil(DbCacheModel):
             self.stemmegruppe = gjettStemmegruppe(self.navn)
 
         super().save(*args, **kwargs)
+
+
+class Jobb(models.Model):
+    'En jobb i bakgrunnskøen, se mytxs/utils/jobbUtils.py'
+    funksjon = models.CharField(max_length=200)
+    'Import path til funksjonen, f.eks. "mytxs.utils.googleCalendar.updateGoogleCalendar"'
+
+    argumenter = models.JSONField(default=dict)
+    'Argumentene serialisert av jobbUtils.serialiser, på formen {"args": [...], "kwargs": {...}}'
+
+    nøkkel = models.CharField(max_length=40)
+    'Hash av funksjon og argumenter, for å unngå at identiske jobber venter i køen samtidig'
+
+    VENTER, KJØRER, FERDIG, FEILET = 0, 1, 2, 3
+    STATUS_CHOICES = ((VENTER, 'Venter'), (KJØRER, 'Kjører'), (FERDIG, 'Ferdig'), (FEILET, 'Feilet'))
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=VENTER)
+
+    forsøk = models.PositiveSmallIntegerField(default=0)
+
+    sammenslått = models.PositiveIntegerField(default=0)
+    'Antall andre jobber som er slått sammen inn i denne, enten duplikater eller via slåSammen'
+
+    opprettet = models.DateTimeField(auto_now_add=True)
+    kjørEtter = models.DateTimeField(default=timezone.now)
+    startet = models.DateTimeField(null=True)
+    kjøretid = models.DurationField(null=True)
+    feilmelding = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.funksjon}({self.get_status_display()}, {self.forsøk} forsøk)'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['nøkkel'], condition=Q(status=0), name='jobb_unik_ventende')]
+        indexes = [models.Index(fields=['status', 'kjørEtter'])]
+        ordering = ['-opprettet']
+        verbose_name_plural = 'jobber'
+
+
+class Geokode(models.Model):
+    'Cache av koordinatene til adresser, se mytxs/utils/geokoding.py'
+    adresse = models.CharField(max_length=100, unique=True)
+    'Normalisert av normaliserAdresse'
+
+    cord = models.JSONField(null=True)
+    'På formen {"lat": ..., "lon": ...}, eller None om adressen ikke finnes'
+
+    oppdatert = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.adresse
+
+    class Meta:
+        verbose_name_plural = 'geokoder'
+
+
+class GoogleKalender(models.Model):
+    'Google Calendar kalenderen til et medlem i et kor, så vi slipper å liste alle kalenderne, se mytxs/utils/googleCalendar.py'
+    kor = models.ForeignKey(
+        Kor,
+        on_delete=models.CASCADE,
+        related_name='googleKalendere'
+    )
+
+    medlem = models.ForeignKey(
+        Medlem,
+        on_delete=models.CASCADE,
+        related_name='googleKalendere'
+    )
+
+    calendarId = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return f'{self.kor}-kalender for {self.medlem}'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kor', 'medlem'], name='unique_googlekalender_kor_medlem')]
+        verbose_name_plural = 'google kalendere'
+
+
+class GoogleHendelse(models.Model):
+    'Event iden til en hendelse i en Google Calendar kalender, så vi slipper å søke etter den ved oppdatering og sletting'
+    kalender = models.ForeignKey(
+        GoogleKalender,
+        to_field='calendarId',
+        on_delete=models.CASCADE,
+        related_name='hendelser'
+    )
+
+    UID = models.CharField(max_length=100)
+    'UID fra iCal eksporten, som også ligger i extendedProperties på eventen'
+
+    eventId = models.CharField(max_length=1024)
+
+    def __str__(self):
+        return f'{self.UID} i {self.kalender}'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kalender', 'UID'], name='unique_googlehendelse_kalender_uid')]
+        verbose_name_plural = 'google hendelser'
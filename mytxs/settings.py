@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 '''
 
 import os
+import sys
 from pathlib import Path
 
 # Denne setter os.environ
@@ -66,6 +67,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mytxs.middleware.SqlBudsjettMiddleware',
     'mytxs.middleware.ThreadingMiddleware',
     'mytxs.middleware.OptionFormMiddleware'
 ]
@@ -98,6 +100,11 @@ WSGI_APPLICATION = 'mytxs.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Hvor lik (trigram word similarity) et ord i et søk må være et ord i søkefeltet for å telle som treff, se søk i 
+# modelUtils.py. Settes som pg_trgm.word_similarity_threshold på connectionen, så %> operatoren kan bruke indeksen. 
+
+SØK_TERSKEL = 0.4
+
 if 'DATABASE_ENGINE' in os.environ:
     DATABASES = {
         'default': {
@@ -107,6 +114,7 @@ if 'DATABASE_ENGINE' in os.environ:
             'PASSWORD': os.environ['DATABASE_PASSWORD'],
             'HOST': os.environ['DATABASE_HOST'],
             'PORT': os.environ['DATABASE_PORT'],
+            'OPTIONS': {'options': f'-c pg_trgm.word_similarity_threshold={SØK_TERSKEL}'},
         }
     }
 else:
@@ -117,10 +125,45 @@ else:
             'USER': 'postgres',
             'PASSWORD': 'postgrespassword',
             'HOST': 'localhost',
-            'PORT': '5432'
+            'PORT': '5432',
+            'OPTIONS': {'options': f'-c pg_trgm.word_similarity_threshold={SØK_TERSKEL}'},
         }
     }
 
+# Cache, brukes bl.a. til navBar, iCal og kartet. Invalideringen av disse må nå alle uWSGI workers, så cachen 
+# må vær delt mellom prosessene. Default e derfor databasen (tabellen opprettes av migrasjon 0034), og CACHE_BACKEND 
+# kan settes til f.eks. django.core.cache.backends.redis.RedisCache. Ikke bruk LocMemCache med flere workers. 
+# I produksjon e det meninga å bruk en delt cache i minnet (Redis eller Memcached, via CACHE_BACKEND og CACHE_LOCATION), 
+# databasecachen e bare et trygt default, der hvert cache oppslag fortsatt e en spørring. 
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'mytxs_cache'),
+    }
+}
+
+if 'test' in sys.argv:
+    # Testene kjøre i én prosess, og teller spørringer, så der bruke vi LocMemCache
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+# SQL budsjett, se SqlBudsjettMiddleware. Andelen requests som måles, og grensene for når de logges. 
+
+SQL_SAMPLING = float(os.environ.get('SQL_SAMPLING', 1))
+SQL_BUDSJETT_ANTALL = int(os.environ.get('SQL_BUDSJETT_ANTALL', 100))
+SQL_BUDSJETT_TID = float(os.environ.get('SQL_BUDSJETT_TID', 0.5))
+SQL_N_PLUSS_1 = int(os.environ.get('SQL_N_PLUSS_1', 10))
+
+# Jobbkøen, se mytxs/utils/jobbUtils.py. Hvor mange sekund threaden etter et request kan bruke på å kjøre jobber, 
+# så den ikke tømmer hele køen og holder på workeren. Resten tar jobbWorker eller cron. 
+
+JOBB_TIDSGRENSE = float(os.environ.get('JOBB_TIDSGRENSE', 5))
+
+# Geokoding av adresser til kartet, se mytxs/utils/geokoding.py. Klassen som slår opp, og minste antall sekund mellom oppslag. 
+
+GEOKODER = os.environ.get('GEOKODER', 'mytxs.utils.geokoding.GeonorgeGeokoder')
+GEOKODER_INTERVALL = float(os.environ.get('GEOKODER_INTERVALL', 0.2))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -242,5 +285,9 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        "mytxs": { # Forskjell, se SqlBudsjettMiddleware
+            "handlers": ["django.server"],
+            "level": "INFO",
+        },
     },
 }
@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mytxs.models import Hendelse, Oppmøte, VervInnehavelse
+from mytxs.utils.downloadUtils import slettBaseVevents
+from mytxs.utils.iCalCache import bumpICalVersjoner
+from mytxs.utils.modelUtils import post_bulk_create
+
+# Her invaliderer vi de cachede iCal kalenderne, se mytxs/utils/iCalCache.py. Versjonene bumpes etter commit, så
+# en request som kjøre samtidig ikke cacher data fra før endringen under den nye versjonen, og uten spørringer.
+# Når en hendelse eller oppmøtene dens endres slettes også den cachede basen til VEVENTen (som har de inviterte
+# til undergruppe hendelser), se mytxs/utils/downloadUtils.py.
+
+@receiver(post_save, sender=Hendelse)
+@receiver(post_delete, sender=Hendelse)
+def iCalHendelseEndring(sender, instance, **kwargs):
+    'Alle i koret kan ha hendelsen, og for undergruppe hendelser endres lista over de inviterte'
+    korPK, hendelsePK = instance.kor_id, instance.pk
+    transaction.on_commit(lambda: (slettBaseVevents([hendelsePK]), bumpICalVersjoner(korPKs=[korPK])))
+
+
+@receiver(post_save, sender=Oppmøte)
+@receiver(post_delete, sender=Oppmøte)
+def iCalOppmøteEndring(sender, instance, created=False, **kwargs):
+    'Oppmøtene gir fraværteksten og hvilke undergruppe hendelser de har, og nye eller slettede endrer de inviterte'
+    medlemPK, hendelsePK = instance.medlem_id, instance.hendelse_id
+    if created or kwargs['signal'] == post_delete:
+        transaction.on_commit(lambda: (slettBaseVevents([hendelsePK]), bumpICalVersjoner(medlemPKs=[medlemPK])))
+    else:
+        transaction.on_commit(lambda: bumpICalVersjoner(medlemPKs=[medlemPK]))
+
+
+@receiver(post_save, sender=VervInnehavelse)
+@receiver(post_delete, sender=VervInnehavelse)
+def iCalMedlemEndring(sender, instance, **kwargs):
+    'Vervene gir hvilke hendelser de får'
+    medlemPK = instance.medlem_id
+    transaction.on_commit(lambda: bumpICalVersjoner(medlemPKs=[medlemPK]))
+
+
+@receiver(post_bulk_create, sender=Oppmøte)
+def iCalOppmøterOpprettet(sender, instances, **kwargs):
+    medlemPKs = {instance.medlem_id for instance in instances}
+    hendelsePKs = {instance.hendelse_id for instance in instances}
+    transaction.on_commit(lambda: (slettBaseVevents(hendelsePKs), bumpICalVersjoner(medlemPKs=medlemPKs)))
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mytxs.models import Medlem, VervInnehavelse
+from mytxs.utils.kart import bumpKartVersjon, oppdaterKartPunkter, slettKartPunkt
+
+# Her holder vi datasettet til sjekkheftekartet oppdatert, se mytxs/utils/kart.py. Cachen oppdateres etter commit,
+# så vi ikke cacher data fra en transaksjon som rulles tilbake, og uten spørringer.
+
+@receiver(post_save, sender=Medlem)
+def kartMedlemEndring(sender, instance, **kwargs):
+    'Fange opp adresser, koordinater, navn, storkorNavn og sjekkhefteSynlig. Versjonen bumpes bare om punktet endret seg.'
+    transaction.on_commit(lambda: oppdaterKartPunkter([instance]))
+
+
+@receiver(post_delete, sender=Medlem)
+def kartMedlemSlettet(sender, instance, **kwargs):
+    transaction.on_commit(bumpKartVersjon)
+
+
+@receiver(post_save, sender=VervInnehavelse)
+@receiver(post_delete, sender=VervInnehavelse)
+def kartInnehavelseEndring(sender, instance, **kwargs):
+    '''
+    Hvem som er aktive kan ha endret seg, og storkorNavn til medlemmet (propageres med bulk_update, 
+    så kartMedlemEndring ser det ikke). Punktet slettes, så det regnes ut på nytt neste gang datasettet lages. 
+    '''
+    def invalider():
+        slettKartPunkt(instance.medlem_id)
+        bumpKartVersjon()
+    transaction.on_commit(invalider)
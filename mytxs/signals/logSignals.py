@@ -6,7 +6,8 @@ from django.db.models.signals import post_delete, post_save, m2m_changed
 
 from mytxs import consts
 from mytxs.models import Logg, LoggM2M, Medlem
-from mytxs.utils.modelUtils import strToModels
+from mytxs.utils.loggUtils import RelatertLogg, leggTilLogg, samleLogger
+from mytxs.utils.modelUtils import post_bulk_create, strToModels
 from mytxs.utils.threadUtils import THREAD_LOCAL
 
 from itertools import chain
@@ -15,7 +16,8 @@ from itertools import chain
 # https://stackoverflow.com/a/29088221/6709450 (#5)
 # Forskjellen er at denne serialiserer ikke manyToMany relations, den tar med editable=False fields,
 # og den erstatter foreign keys med pk av tilsvarende logg instance, eller str representasjon av objektet
-# når loggen ikke finens (som for User loggs)
+# når loggen ikke finens (som for User loggs). Relasjonene blir RelatertLogg plassholdere, som lagreLogger 
+# erstatter med pk av nyeste logg, slik at vi slepp å slå opp loggen for hver relasjon når vi logge. 
 def to_dict(instance, fields=None, exclude=None):
     opts = instance._meta
     data = {}
@@ -29,12 +31,13 @@ def to_dict(instance, fields=None, exclude=None):
             continue
 
         if isinstance(field, RelatedField):
-            if getattr(instance, field.name) and (logg := Logg.objects.getLoggFor(getattr(instance, field.name))):
-                # Om det er en relasjon, lagre pk av den nyeste relaterte loggen (ikke av instansen)
-                data[field.name] = logg.pk
-            else:
-                # Om vi ikke finn den relevante loggen, lagre string representasjon av objektet
-                data[field.name] = str(getattr(instance, field.name))
+            # Om det er en relasjon, lagre pk av den nyeste relaterte loggen (ikke av instansen), 
+            # eller string representasjon av objektet om vi ikke finn den relevante loggen
+            data[field.name] = RelatertLogg(
+                field.related_model, 
+                getattr(instance, field.attname), 
+                getattr(instance, field.name) if field.is_cached(instance) else None
+            )
         elif type(instance) == Medlem:
             # Om det e et medlem skal vi bare lagre relasjoner + fornavn, mellomnavn og etternavn
             if field.name in ['fornavn', 'mellomnavn', 'etternavn']:
@@ -51,46 +54,17 @@ def to_dict(instance, fields=None, exclude=None):
     return data
 
 
-def didChange(instance):
-    'Gitt en instance sjekker denne om noe er endret siden nyeste logg. Dette er vanskelig for related fields.'
-    lastLogg = Logg.objects.getLoggFor(instance)
-
-    if not lastLogg:
-        return True
-
-    newDict = to_dict(instance)
-
-    if newDict == lastLogg.value:
-        # Om de er like er det garantert samme logg
-        return False
-
-    model = type(instance)
-    
-    if set(newDict.keys()) != set(lastLogg.value.keys()):
-        # Om de har ulike keys e det garantert ulike loggs
-        # Denne codepathen er sansynligvis feil bruk av funksjonen, men viktig for korrekthet
-        return True
-
-    # Ellers, gå over alle keys i logg.value
-    for key, value in newDict.items():
-        if isinstance(model._meta.get_field(key), RelatedField):
-            # For related fields: Sjekk om loggen den peker på har ulik pk
-            if not isinstance(value, int) or not isinstance(lastLogg.value.get(key), int):
-                # Om det e te en modell vi ikke logge lagres det istedet en str representasjon av objektet
-                # Om enten av disse ikkje er en int, så sammenlign de direkte istedet. Slik blir det lagret
-                # om str representasjonen av det andre objektet endrer seg (fordi det andre objektet endret seg)
-                # eller om vi bytta fra str representasjon til faktisk objekt, eller omvendt. 
-                if value != lastLogg.value.get(key):
-                    return True
-                continue
-            if Logg.objects.get(pk=value).instancePK != Logg.objects.get(pk=lastLogg.value.get(key)).instancePK:
-                return True
-        else:
-            # Sjekk om verdien er ulik
-            if value != lastLogg.value.get(key):
-                return True
-    
-    return False
+def loggOppføring(sender, instance, change):
+    'Lag en oppføring til leggTilLogg. Om det er en endring sjekke lagreLogger om noe faktisk er endret siden nyeste logg.'
+    return {
+        'model': sender,
+        'instancePK': instance.pk,
+        'change': change,
+        'value': to_dict(instance),
+        'strRep': str(instance),
+        'author': getattr(getattr(getattr(THREAD_LOCAL, 'request', None), 'user', None), 'medlem', None),
+        'kor': instance.kor
+    }
 
 
 def recieverWithModels(signal, senders=strToModels(consts.loggedModelNames)):
@@ -113,50 +87,20 @@ def recieverWithModels(signal, senders=strToModels(consts.loggedModelNames)):
 
 @recieverWithModels(post_save)
 def log_post_save(sender, instance, created, **kwargs):
-    author = getattr(getattr(getattr(THREAD_LOCAL, 'request', None), 'user', None), 'medlem', None)
-
-    if created:
-        # This is creation
-        Logg.objects.create(
-            model=sender.__name__,
-            instancePK=instance.pk,
-            change=Logg.CREATE,
-            value=to_dict(instance),
-            strRep=str(instance),
-            author=author,
-            kor=instance.kor
-        )
-    else:
-        # This is change
-        if not didChange(instance):
-            # Dersom ingenting endra seg, ikkje lag en ny logg
-            return
-
-        Logg.objects.create(
-            model=sender.__name__,
-            instancePK=instance.pk,
-            change=Logg.UPDATE,
-            value=to_dict(instance),
-            strRep=str(instance),
-            author=author,
-            kor=instance.kor
-        )
+    leggTilLogg(loggOppføring(sender, instance, Logg.CREATE if created else Logg.UPDATE))
+
+
+@recieverWithModels(post_bulk_create)
+def log_post_bulk_create(sender, instances, **kwargs):
+    'Som log_post_save for opprettelse. Loggene lagres samlet, med et fast antall spørringer uansett hvor mange instanser det er'
+    with samleLogger():
+        for instance in instances:
+            leggTilLogg(loggOppføring(sender, instance, Logg.CREATE))
 
 
 @recieverWithModels(post_delete)
 def log_post_delete(sender, instance, **kwargs):
-    author = getattr(getattr(getattr(THREAD_LOCAL, 'request', None), 'user', None), 'medlem', None)
-
-    # This is deletion
-    Logg.objects.create(
-        model=sender.__name__,
-        instancePK=instance.pk,
-        change=Logg.DELETE,
-        value=to_dict(instance),
-        strRep=str(instance),
-        author=author,
-        kor=instance.kor
-    )
+    leggTilLogg(loggOppføring(sender, instance, Logg.DELETE))
 
 
 def makeM2MLogg(sender, action, fromPK, toPK):
@@ -167,20 +111,20 @@ def makeM2MLogg(sender, action, fromPK, toPK):
     - fromPK: The pk of the source model
     - toPK: The pk of the target model
     '''
-    author = getattr(getattr(getattr(THREAD_LOCAL, 'request', None), 'user', None), 'medlem', None)
-
     [fromModelName, fieldName] = sender._meta.object_name.split('_')
 
     fromModel = apps.get_model('mytxs', fromModelName)
     toModel = getattr(fromModel, fieldName).rel.model
 
-    LoggM2M.objects.create(
-        m2mName=sender._meta.object_name,
-        fromLogg=Logg.objects.getLoggForModelPK(fromModel, fromPK),
-        toLogg=Logg.objects.getLoggForModelPK(toModel, toPK),
-        change=LoggM2M.CREATE if action == 'post_add' else LoggM2M.DELETE,
-        author=author
-    )
+    leggTilLogg({
+        'm2mName': sender._meta.object_name,
+        'fromModel': fromModel,
+        'fromPK': fromPK,
+        'toModel': toModel,
+        'toPK': toPK,
+        'change': LoggM2M.CREATE if action == 'post_add' else LoggM2M.DELETE,
+        'author': getattr(getattr(getattr(THREAD_LOCAL, 'request', None), 'user', None), 'medlem', None)
+    })
 
 
 # Skaff en liste av alle m2m fields .through, der vi logge både kilde og target modell
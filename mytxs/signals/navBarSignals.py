@@ -0,0 +1,54 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from mytxs.models import Dekorasjon, DekorasjonInnehavelse, Medlem, Repertoar, Tilgang, Verv, VervInnehavelse
+from mytxs.signals.logSignals import recieverWithModels
+from mytxs.utils.navBar import bumpNavBarVersjon
+
+# Her invalidere vi cachede navBars. Vi bumpe både med en gang og etter commit, slik at et request som
+# bygge navBar mens transaksjonen pågår ikke kan cache et utdatert tre under den nye versjonen.
+
+def bumpNavBar(medlemPK=None):
+    bumpNavBarVersjon(medlemPK)
+    transaction.on_commit(lambda: bumpNavBarVersjon(medlemPK))
+
+
+@recieverWithModels(post_save, senders=[Verv, Tilgang, Dekorasjon, Repertoar])
+@recieverWithModels(post_delete, senders=[Verv, Tilgang, Dekorasjon, Repertoar])
+def navBarGlobalEndring(sender, instance, **kwargs):
+    'Endringer på disse kan påvirke navBar til mange medlemmer, så bump den globale versjonen'
+    bumpNavBar()
+
+
+@receiver(m2m_changed, sender=Tilgang.verv.through)
+def navBarTilgangVervEndring(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        bumpNavBar()
+
+
+@recieverWithModels(pre_save, senders=[VervInnehavelse, DekorasjonInnehavelse])
+def navBarInnehavelseFlyttet(sender, instance, **kwargs):
+    'Om medlem endres på en innehavelse må også det gamle medlemmet sin navBar invalideres'
+    if instance.pk and (gammeltMedlemPK := sender.objects.filter(pk=instance.pk).values_list('medlem_id', flat=True).first()) != instance.medlem_id:
+        bumpNavBar(gammeltMedlemPK)
+
+
+@recieverWithModels(post_save, senders=[VervInnehavelse, DekorasjonInnehavelse])
+@recieverWithModels(post_delete, senders=[VervInnehavelse, DekorasjonInnehavelse])
+def navBarInnehavelseEndring(sender, instance, **kwargs):
+    bumpNavBar(instance.medlem_id)
+
+
+@receiver(post_save, sender=Medlem)
+def navBarMedlemEndring(sender, instance, **kwargs):
+    'Fange opp innstillinger, samt storkorNavn som bestemme rekkefølgen i sjekkheftet'
+    bumpNavBar(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def navBarUserEndring(sender, instance, **kwargs):
+    'Fange opp endringer i is_superuser'
+    if medlemPK := Medlem.objects.filter(user=instance).values_list('pk', flat=True).first():
+        bumpNavBar(medlemPK)
@@ -0,0 +1,37 @@
+from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from mytxs.models import MedlemTilgang, Tilgang, Verv, VervInnehavelse
+
+# Her holder vi MedlemTilgang tabellen oppdatert for medlemmene som blir berørt av en endring.
+
+@receiver(pre_save, sender=VervInnehavelse)
+def medlemTilgangInnehavelseFlyttet(sender, instance, **kwargs):
+    'Om medlem endres på en vervInnehavelse må også det gamle medlemmet oppdateres'
+    if instance.pk:
+        instance.gammeltMedlemPK = sender.objects.filter(pk=instance.pk).values_list('medlem_id', flat=True).first()
+
+
+@receiver(post_save, sender=VervInnehavelse)
+@receiver(post_delete, sender=VervInnehavelse)
+def medlemTilgangInnehavelseEndring(sender, instance, **kwargs):
+    MedlemTilgang.oppdater({instance.medlem_id, getattr(instance, 'gammeltMedlemPK', None)} - {None})
+
+
+@receiver(m2m_changed, sender=Tilgang.verv.through)
+def medlemTilgangVervEndring(sender, instance, action, pk_set, **kwargs):
+    'Oppdater alle som har hatt et verv som fikk eller mistet tilganger'
+    if not action.startswith('post_'):
+        return
+
+    if isinstance(instance, Verv):
+        vervPKs = {instance.pk}
+    else:
+        vervPKs = (pk_set or set()) | set(instance.verv.values_list('pk', flat=True))
+
+    medlemPKs = set(VervInnehavelse.objects.filter(verv__in=vervPKs).values_list('medlem_id', flat=True))
+    if isinstance(instance, Tilgang):
+        # Etter clear vet vi ikke hvilke verv tilgangen hadde, men vi vet hvem som hadde den
+        medlemPKs |= set(instance.medlemTilganger.values_list('medlem_id', flat=True))
+
+    MedlemTilgang.oppdater(medlemPKs)
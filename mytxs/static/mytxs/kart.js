@@ -1,5 +1,5 @@
-if(document.currentScript.dataset.json){
-    const medlemMapData = JSON.parse(document.currentScript.dataset.json);
+// Datasettet hentes separat, og nettleseren sende If-None-Match så det bare lastes ned på nytt om det har endret seg
+fetch(document.currentScript.dataset.url, {cache: 'no-cache'}).then(response => response.json()).then(medlemMapData => {
     const markerMapping = {};
 
     const map = L.map('map').setView([63.42256257910649, 10.395544839649341], 13);
@@ -31,4 +31,4 @@ if(document.currentScript.dataset.json){
             addAdressToMap(medlem, medlem.foreldreCord, suffix=' (hjemme)');
         }
     }
-}
\ No newline at end of file
+});
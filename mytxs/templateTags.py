@@ -5,10 +5,12 @@ from django import template
 from django.core.paginator import Paginator
 from django.forms import BaseForm, BaseFormSet, FileField
 from django.template import TemplateSyntaxError, defaultfilters
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.urls import reverse
 
 from mytxs.models import Logg, Repertoar, Sang, SangFil
+from mytxs.utils.bildeUtils import BILDE_FORMATER
 from mytxs.utils.formAccess import formIsEnabled, formIsVisible
 
 # Her legg vi til custom template tags and filters
@@ -184,6 +186,22 @@ def linkTo(instance, label=''):
     return mark_safe(f'<a href="{instance.get_absolute_url()}">{label if label else instance}</a>')
 
 
+@register.simple_tag
+def sjekkhefteBilde(medlem, klasser=''):
+    '''
+    Sjekkhefte bildet til medlemmet, som et picture element med srcset for variantene om de er klare. 
+    Lastes lazy, siden sjekkheftet kan ha mange medlemmer under skjermkanten. 
+    '''
+    sources = img = ''
+    if srcset := medlem.bildeSrcset():
+        sources = ''.join(f'<source type="image/{endelse}" srcset="{srcset[endelse]}" sizes="145px">' for endelse in BILDE_FORMATER if endelse != 'jpg')
+        img = f'srcset="{srcset["jpg"]}" sizes="145px"'
+    return format_html(
+        '<picture>{}<img src="{}" {} loading="lazy" decoding="async" alt="" class="{}"></picture>',
+        mark_safe(sources), medlem.bilde.url, mark_safe(img), klasser
+    )
+
+
 @register.filter
 def tilgangExists(medlem, tilgangNavn):
     return medlem.tilganger.filter(navn__in=tilgangNavn.split(',')).exists()
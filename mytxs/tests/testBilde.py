@@ -0,0 +1,74 @@
+from io import BytesIO
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from mytxs.models import Medlem
+from mytxs.utils.bildeUtils import BILDE_FORMATER, BILDE_STØRRELSER, variantMedlemPK, variantNavn
+from mytxs.utils.viewUtils import harFilTilgang
+
+
+def lagBilde(farge='red'):
+    bildeBytes = BytesIO()
+    Image.new('RGB', (800, 600), farge).save(bildeBytes, 'PNG')
+    return SimpleUploadedFile('bilde.png', bildeBytes.getvalue(), content_type='image/png')
+
+
+class BildeTestCase(TestCase):
+    def setUp(self):
+        mediaRoot = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, mediaRoot)
+        settings = override_settings(MEDIA_ROOT=mediaRoot)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.medlem = Medlem.objects.create()
+        self.medlem.bilde = lagBilde()
+        self.medlem.save()
+        self.medlem.refresh_from_db()
+
+    def testVarianter(self):
+        'Variantene lages i alle størrelser og formater etter opplasting, og bildeVersjon settes'
+        self.assertIsNotNone(self.medlem.bildeVersjon)
+        for bredde, høyde in BILDE_STØRRELSER:
+            for endelse in BILDE_FORMATER:
+                with default_storage.open(variantNavn(self.medlem.pk, bredde, endelse)) as fil:
+                    self.assertEqual(Image.open(fil).size, (bredde, høyde))
+
+        # Et nytt bilde gir ny versjon, og sletting av bildet fjerner variantene
+        versjon = self.medlem.bildeVersjon
+        self.medlem.bilde = lagBilde('blue')
+        self.medlem.save()
+        self.medlem.refresh_from_db()
+        self.assertNotEqual(self.medlem.bildeVersjon, versjon)
+
+        self.medlem.bilde = None
+        self.medlem.save()
+        self.assertIsNone(self.medlem.bildeVersjon)
+        self.assertFalse(default_storage.exists(variantNavn(self.medlem.pk, BILDE_STØRRELSER[0][0], 'jpg')))
+
+    def testSjekkhefteBilde(self):
+        'Templaten bruker srcset og lazy loading, og variantene gir tilgang som bildet'
+        html = Template('{% load mytxsTags %}{% sjekkhefteBilde medlem "h-44" %}').render(Context({'medlem': self.medlem}))
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn(f'{variantNavn(self.medlem.pk, 139, "jpg")}?v={self.medlem.bildeVersjon} 139w', html)
+
+        navn = variantNavn(self.medlem.pk, 139, 'webp')
+        self.assertEqual(variantMedlemPK(navn), self.medlem.pk)
+        self.assertEqual(harFilTilgang(self.medlem, navn), self.medlem)
+        self.assertIsNone(variantMedlemPK(self.medlem.bilde.name))
+
+    def testUtenVarianter(self):
+        'Før variantene er klare vises bare bildet'
+        Medlem.objects.filter(pk=self.medlem.pk).update(bildeVersjon=None)
+        self.medlem.refresh_from_db()
+        html = Template('{% load mytxsTags %}{% sjekkhefteBilde medlem %}').render(Context({'medlem': self.medlem}))
+        self.assertNotIn('srcset', html)
+        self.assertIn(self.medlem.bilde.url, html)
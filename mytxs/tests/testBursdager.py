@@ -0,0 +1,55 @@
+import datetime
+from io import StringIO
+from unittest.mock import Mock
+
+from django.test import TestCase
+
+from mytxs.management.commands.seed import adminAdmin, runSeed
+from mytxs.models import Medlem
+
+
+class BursdagerTestCase(TestCase):
+    'Sortering etter neste bursdag via fødselsdag feltet, og kommendeBursdager APIet'
+
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        adminAdmin(mock_self)
+
+        Medlem.objects.update(fødselsdato=None)
+        cls.medlemmer = [Medlem.objects.create(fornavn=str(i), fødselsdato=datetime.date(2000, måned, dag)) for i, (måned, dag) in enumerate([
+            (1, 1), (2, 29), (6, 1), (6, 2), (12, 31)
+        ])]
+
+    def kommende(self, limit, offset=0):
+        return [m.fornavn for m in Medlem.objects.filter(pk__in=[m.pk for m in self.medlemmer]).kommendeBursdager(limit, offset, dato=datetime.date(2026, 6, 2))]
+
+    def testFødselsdag(self):
+        self.assertEqual(Medlem.objects.get(pk=self.medlemmer[1].pk).fødselsdag, 229)
+        self.assertEqual(Medlem.objects.get(pk=self.medlemmer[4].pk).fødselsdag, 1231)
+
+    def testKommendeBursdager(self):
+        'Fra og med dagens dato ut året, og så fra starten av året, også når limit og offset går over årsskiftet'
+        self.assertEqual(self.kommende(10), ['3', '4', '0', '1', '2'])
+        self.assertEqual(self.kommende(2), ['3', '4'])
+        self.assertEqual(self.kommende(2, 1), ['4', '0'])
+        self.assertEqual(self.kommende(2, 3), ['1', '2'])
+        self.assertEqual(self.kommende(2, 4), ['2'])
+        self.assertEqual(self.kommende(2, 5), [])
+
+    def testAPI(self):
+        admin = Medlem.objects.get(fornavn='admin')
+        admin.fødselsdato = datetime.date(2000, 5, 17)
+        admin.innstillinger = {**admin.innstillinger, 'sjekkhefteSynlig': 2**0}
+        admin.save()
+        self.client.force_login(admin.user)
+
+        res = self.client.get('/sjekkheftet/jubileum/data?limit=5')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), [{'pk': admin.pk, 'navn': admin.navn, 'fødselsdato': '2000-05-17', 'karantenekor': admin.karantenekor}])
+        self.assertEqual(self.client.get('/sjekkheftet/jubileum/data?offset=1').json(), [])
+        self.assertEqual(self.client.get('/sjekkheftet/jubileum/data?limit=x').status_code, 400)
+
+        self.assertEqual(self.client.get('/sjekkheftet/jubileum').status_code, 200)
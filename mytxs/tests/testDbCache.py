@@ -1,9 +1,16 @@
 from contextlib import contextmanager
+import datetime
+from io import StringIO
 import re
+from unittest.mock import Mock
 
 from django.db import connection, models, reset_queries
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
+from mytxs import consts
+from mytxs.management.commands.seed import makeMedlem, runSeed, setTop100Navn
+from mytxs.models import Dekorasjon, DekorasjonInnehavelse, Kor, Verv
 from mytxs.utils.modelCacheUtils import DbCacheModel, dbCache
 from django.conf import settings
 settings.DEBUG = True # Må til for å kunne logge queries
@@ -374,3 +381,34 @@ class DbCacheTestCase(TestCase):
                 self.doesDelete(ivar, dos=[symra], donts=[andersen, mbob])
             with self.litterature(specific=specific, grouped=True) as (ivar, symra, andersen, mbob):
                 self.doesDelete(ivar, dos=[symra, mbob], donts=[andersen])
+
+
+class DbCachePropagationTestCase(TestCase):
+    'Test at propagering via ekte modeller gjør like mange spørringer uansett hvor mange rader som avhenge av oss.'
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        setTop100Navn()
+
+        kor = Kor.objects.get(navn=consts.Kor.TSS)
+        stemmegruppe = Verv.objects.get(kor=kor, navn='1T')
+        dekorasjoner = [Dekorasjon.objects.create(navn=f'Pins{i}', kor=kor) for i in range(8)]
+
+        cls.få = makeMedlem(kor, datetime.date(2020, 1, 1), None, stemmegruppe)
+        cls.mange = makeMedlem(kor, datetime.date(2020, 1, 1), None, stemmegruppe)
+        for medlem, antall in [(cls.få, 1), (cls.mange, 8)]:
+            for dekorasjon in dekorasjoner[:antall]:
+                DekorasjonInnehavelse.objects.create(medlem=medlem, dekorasjon=dekorasjon, start=datetime.date(2021, 1, 1))
+
+    def renameQueries(self, medlem):
+        medlem.fornavn = 'Omdøpt'
+        with CaptureQueriesContext(connection) as queries:
+            medlem.save()
+        for dekorasjonInnehavelse in medlem.dekorasjonInnehavelser.all():
+            self.assertTrue(str(dekorasjonInnehavelse).startswith(f'{medlem.navn} '), str(dekorasjonInnehavelse))
+        return len(queries)
+
+    def testRenamePropagation(self):
+        self.assertEqual(self.renameQueries(self.få), self.renameQueries(self.mange))
@@ -0,0 +1,67 @@
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import Mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from mytxs.management.commands.seed import adminAdmin, runSeed
+from mytxs.models import Medlem, MedlemEmne
+
+
+class FellesEmnerTestCase(TestCase):
+    'MedlemEmne tabellen, og fellesEmner siden i sjekkheftet som bruke den'
+
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        adminAdmin(mock_self)
+
+        cls.admin = Medlem.objects.get(fornavn='admin')
+        cls.admin.emnekoder = 'tdt4100, TMA-4100'
+        cls.admin.save()
+
+        cls.kari = Medlem.objects.create(fornavn='Kari', emnekoder='TDT4100 EXPH0300')
+        cls.ola = Medlem.objects.create(fornavn='Ola', emnekoder='TDT41000 TMA4100')
+
+    def emner(self, medlem):
+        return list(medlem.emner.order_by('emnekode').values_list('emnekode', flat=True))
+
+    def testSynkronisering(self):
+        'Tabellen holdes i synk med emnekoder feltet når medlemmet lagres'
+        self.assertEqual(self.emner(self.admin), ['TDT4100', 'TMA4100'])
+
+        self.kari.emnekoder = 'exph0300 TMA4100 tma4100'
+        self.kari.save()
+        self.assertEqual(self.emner(self.kari), ['EXPH0300', 'TMA4100'])
+
+        # Lagring uten endring av emnekodene skal ikke røre tabellen
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            self.kari.fornavn = 'Karianne'
+            self.kari.save()
+        self.assertFalse([sql for sql in queries if 'mytxs_medlememne' in sql])
+
+    def testFellesEmner(self):
+        'Alle emnene hentes i én spørring, og TDT4100 treffer ikke TDT41000'
+        self.client.force_login(self.admin.user)
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            res = self.client.get('/sjekkheftet/fellesEmner')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len([sql for sql in queries if 'mytxs_medlememne' in sql]), 1)
+
+        grupperinger = {emne: {m.fornavn for m in medlemmer} for emne, medlemmer in res.context['grupperinger'].items()}
+        self.assertEqual(grupperinger, {
+            'TDT4100': {'admin', 'Kari'},
+            'TMA4100': {'admin', 'Ola'}
+        })
+
+    def testSlettGamleEmner(self):
+        with redirect_stdout(StringIO()):
+            call_command('slettGamleEmner')
+        self.assertFalse(MedlemEmne.objects.exists())
+        self.assertFalse(Medlem.objects.exclude(emnekoder='').exists())
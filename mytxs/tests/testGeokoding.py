@@ -0,0 +1,59 @@
+from django.test import TestCase, override_settings
+
+from mytxs.models import Geokode, Jobb, Medlem
+from mytxs.utils.geokoding import Geokoder, OfflineGeokoder, geokod
+from mytxs.utils.jobbUtils import kjørJobber, lagJobb, lagreJobber
+
+
+class NedeGeokoder(Geokoder):
+    'Geokoder uten nettverk'
+    def slåOpp(self, adresser):
+        raise Exception('Nettverket er nede')
+
+
+class UstabilGeokoder(Geokoder):
+    'Geokoder som finn den første adressen, og så mister nettverket'
+    def slåOpp(self, adresser):
+        yield from OfflineGeokoder().slåOpp(adresser[:1])
+        raise Exception('Nettverket er nede')
+
+
+@override_settings(GEOKODER='mytxs.utils.geokoding.OfflineGeokoder')
+class GeokodingTestCase(TestCase):
+    def setUp(self):
+        OfflineGeokoder.oppslag.clear()
+
+    def testCache(self):
+        'Adresser slås opp én gang, uavhengig av store bokstaver og mellomrom'
+        medlem = Medlem.objects.create(boAdresse='Elgeseter gate 1', foreldreAdresse='Ukjent vei 2')
+        self.assertEqual(set(medlem.boAdresseCord().keys()), {'lat', 'lon'})
+        self.assertIsNone(medlem.foreldreAdresseCord())
+
+        annet = Medlem.objects.create(boAdresse=' elgeseter  GATE 1', foreldreAdresse='ukjent vei 2')
+        self.assertEqual(annet.boAdresseCord(), medlem.boAdresseCord())
+        self.assertEqual(sorted(OfflineGeokoder.oppslag), ['elgeseter gate 1', 'ukjent vei 2'])
+        self.assertEqual(Geokode.objects.count(), 2)
+
+    def testOppdatereMedlemmer(self):
+        'Når en adresse slås opp i bakgrunnen skal medlemmene med adressen få koordinatene'
+        with override_settings(GEOKODER='mytxs.tests.testGeokoding.NedeGeokoder'):
+            medlemmer = [
+                Medlem.objects.create(boAdresse='Klæbuveien 2'),
+                Medlem.objects.create(foreldreAdresse='KLÆBUVEIEN 2')
+            ]
+        self.assertFalse(Geokode.objects.exists())
+
+        geokod.direkte(['klæbuveien 2'])
+        for medlem in medlemmer:
+            medlem.refresh_from_db()
+        self.assertIsNotNone(medlemmer[0].boAdresseCord())
+        self.assertEqual(medlemmer[0].boAdresseCord(), medlemmer[1].foreldreAdresseCord())
+
+    @override_settings(GEOKODER='mytxs.tests.testGeokoding.UstabilGeokoder')
+    def testFeil(self):
+        'Det som ble slått opp før en feil lagres, og jobben prøves igjen for resten'
+        lagreJobber([lagJobb(geokod, ['a gate 1', 'b gate 2'])])
+        self.assertEqual(kjørJobber(), 1)
+
+        self.assertEqual(list(Geokode.objects.values_list('adresse', flat=True)), ['a gate 1'])
+        self.assertEqual(Jobb.objects.get().status, Jobb.VENTER)
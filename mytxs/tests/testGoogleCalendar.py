@@ -0,0 +1,208 @@
+import datetime
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import httplib2
+from django.core.cache import cache
+from django.test import TestCase
+from googleapiclient.errors import HttpError
+
+from mytxs import consts
+from mytxs.management.commands.fixGoogleCalendar import fixGoogleCalendar
+from mytxs.management.commands.seed import makeMedlem, runSeed, setTop100Navn
+from mytxs.models import GoogleHendelse, GoogleKalender, Hendelse, Kor, Verv
+from mytxs.utils.googleCalendar import BATCH_STØRRELSE, GoogleCalendarManager, updateGoogleCalendar
+
+
+class FakeRequest:
+    def __init__(self, service, funksjon):
+        self.service = service
+        self.funksjon = funksjon
+
+    def execute(self):
+        self.service.httpRequests.append('request')
+        return self.funksjon()
+
+
+class FakeBatch:
+    def __init__(self, service):
+        self.service = service
+        self.requests = []
+
+    def add(self, request, callback, request_id):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self):
+        assert len(self.requests) <= BATCH_STØRRELSE
+        self.service.httpRequests.append('batch')
+        for request, callback, requestId in self.requests:
+            try:
+                callback(requestId, request.funksjon(), None)
+            except HttpError as exception:
+                callback(requestId, None, exception)
+
+
+class FakeEndpoint:
+    'Et endepunkt i FakeService, der hver metode returne en FakeRequest'
+    def __init__(self, service, **metoder):
+        for navn, metode in metoder.items():
+            setattr(self, navn, lambda *args, metode=metode, **kwargs: FakeRequest(service, lambda: metode(*args, **kwargs)))
+
+    def list_next(self, request, res):
+        return None
+
+
+class FakeService:
+    'Google Calendar API i minnet, som teller HTTP requestene'
+    def __init__(self):
+        self.kalendere = {}
+        'calendarId til {"description": str, "events": {eventId: body}}'
+        self.httpRequests = []
+        self.eventTeller = 0
+
+    def ikkeFunnet(self):
+        return HttpError(httplib2.Response({'status': 404}), b'Not Found')
+
+    def events(self):
+        def insert(calendarId, body):
+            self.eventTeller += 1
+            event = {**body, 'id': f'event{self.eventTeller}'}
+            self.kalendere[calendarId]['events'][event['id']] = event
+            return event
+
+        def update(calendarId, eventId, body):
+            if eventId not in self.kalendere[calendarId]['events']:
+                raise self.ikkeFunnet()
+            self.kalendere[calendarId]['events'][eventId] = {**body, 'id': eventId}
+            return self.kalendere[calendarId]['events'][eventId]
+
+        def delete(calendarId, eventId):
+            if not self.kalendere[calendarId]['events'].pop(eventId, None):
+                raise self.ikkeFunnet()
+
+        def list(calendarId, privateExtendedProperty=[], maxResults=None):
+            return {'items': [
+                event for event in self.kalendere[calendarId]['events'].values()
+                if all(f'UID={event["extendedProperties"]["private"]["UID"]}' == p for p in privateExtendedProperty)
+            ]}
+
+        return FakeEndpoint(self, insert=insert, update=update, delete=delete, list=list)
+
+    def calendarList(self):
+        return FakeEndpoint(self, list=lambda maxResults=None: {'items': [
+            {'id': calendarId, 'description': kalender['description']} for calendarId, kalender in self.kalendere.items()
+        ]})
+
+    def calendars(self):
+        return FakeEndpoint(self, delete=lambda calendarId: self.kalendere.pop(calendarId))
+
+    def new_batch_http_request(self):
+        return FakeBatch(self)
+
+
+class GoogleCalendarTestCase(TestCase):
+    'GoogleKalender og GoogleHendelse tabellene, og at endringer sendes gjennom batch endepunktet'
+
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        setTop100Navn()
+
+        cls.kor = Kor.objects.get(navn=consts.Kor.TSS)
+        start = datetime.date.today() - datetime.timedelta(days=7)
+        stemmegruppe = Verv.objects.get(kor=cls.kor, navn='1T')
+        cls.medlemmer = [makeMedlem(cls.kor, start, None, stemmegruppe) for i in range(BATCH_STØRRELSE + 10)]
+        cls.hendelse = Hendelse.objects.create(navn='Øvelse', kor=cls.kor, startDate=datetime.date.today() + datetime.timedelta(days=1))
+
+    def setUp(self):
+        cache.clear()
+        self.service = FakeService()
+        for medlem in self.medlemmer:
+            self.service.kalendere[f'kalender{medlem.pk}'] = {'description': f'{self.kor.navn}-{medlem.pk}', 'events': {}}
+        GoogleKalender.objects.bulk_create([
+            GoogleKalender(kor=self.kor, medlem=medlem, calendarId=f'kalender{medlem.pk}') for medlem in self.medlemmer
+        ])
+
+        patcher = patch('mytxs.utils.googleCalendar.GoogleCalendarManager', lambda requestCountDown=None: GoogleCalendarManager(requestCountDown, service=self.service))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def events(self):
+        return [event for kalender in self.service.kalendere.values() for event in kalender['events'].values()]
+
+    def testBatch(self):
+        'En endring for hele koret tar to batch requests, uten å liste kalendere eller søke etter events'
+        updateGoogleCalendar(self.hendelse, newMedlemmer=self.medlemmer)
+        self.assertEqual(self.service.httpRequests, ['batch', 'batch'])
+        self.assertEqual(len(self.events()), len(self.medlemmer))
+        self.assertEqual(
+            set(GoogleHendelse.objects.values_list('eventId', flat=True)),
+            {event['id'] for event in self.events()}
+        )
+
+        self.service.httpRequests.clear()
+        self.hendelse.sted = 'Rundhallen'
+        updateGoogleCalendar(self.hendelse, changed=True, oldMedlemmer=self.medlemmer, newMedlemmer=self.medlemmer)
+        self.assertEqual(self.service.httpRequests, ['batch', 'batch'])
+        self.assertTrue(all(event['location'] == 'Rundhallen' for event in self.events()))
+
+        self.service.httpRequests.clear()
+        updateGoogleCalendar(self.hendelse, oldMedlemmer=self.medlemmer, hendelsePK=self.hendelse.pk)
+        self.assertEqual(self.service.httpRequests, ['batch', 'batch'])
+        self.assertFalse(self.events())
+        self.assertFalse(GoogleHendelse.objects.exists())
+
+    def testManglendeEventId(self):
+        'Events som ikke er i GoogleHendelse søkes etter én gang, og events som er slettet hos Google opprettes på nytt'
+        medlem, annet = self.medlemmer[:2]
+        updateGoogleCalendar(self.hendelse, newMedlemmer=[medlem, annet])
+        GoogleHendelse.objects.filter(kalender_id=f'kalender{medlem.pk}').delete()
+        self.service.kalendere[f'kalender{annet.pk}']['events'].clear()
+
+        self.service.httpRequests.clear()
+        updateGoogleCalendar(self.hendelse, changed=True, oldMedlemmer=[medlem, annet], newMedlemmer=[medlem, annet])
+        self.assertEqual(self.service.httpRequests, ['request', 'batch', 'batch'])
+        self.assertEqual(len(self.events()), 2)
+        self.assertEqual(GoogleHendelse.objects.count(), 2)
+
+        self.service.httpRequests.clear()
+        updateGoogleCalendar(self.hendelse, changed=True, oldMedlemmer=[medlem, annet], newMedlemmer=[medlem, annet])
+        self.assertEqual(self.service.httpRequests, ['batch'])
+
+    def testUkjentKalender(self):
+        'Kalendere som ikke er i GoogleKalender finnes med ett kall til kalenderlista, og så stoler vi på tabellen'
+        medlem, utenKalender = self.medlemmer[:2]
+        GoogleKalender.objects.filter(medlem=medlem).delete()
+        self.service.kalendere.pop(f'kalender{utenKalender.pk}')
+
+        updateGoogleCalendar(self.hendelse, newMedlemmer=[medlem, utenKalender])
+        self.assertEqual(self.service.httpRequests, ['request', 'batch'])
+        self.assertTrue(GoogleKalender.objects.filter(medlem=medlem, calendarId=f'kalender{medlem.pk}').exists())
+        self.assertEqual(len(self.service.kalendere[f'kalender{medlem.pk}']['events']), 1)
+
+        # Tabellen er nettopp synkronisert, så medlemmer uten kalender gir ikke nye kall til kalenderlista
+        self.service.httpRequests.clear()
+        updateGoogleCalendar(self.hendelse, changed=True, oldMedlemmer=[medlem, utenKalender], newMedlemmer=[medlem, utenKalender])
+        self.assertEqual(self.service.httpRequests, ['batch'])
+
+    def testFixGoogleCalendar(self):
+        'fixGoogleCalendar synkroniserer tabellene med det som ligger hos Google'
+        medlem = self.medlemmer[0]
+        GoogleKalender.objects.filter(medlem=medlem).delete()
+        self.service.kalendere.pop(f'kalender{self.medlemmer[1].pk}')
+        self.service.kalendere[f'kalender{medlem.pk}']['events']['gammel'] = {
+            'id': 'gammel', 'summary': 'Gammel', 'extendedProperties': {'private': {'UID': 'TSS-0@mytxs.samfundet.no'}}
+        }
+
+        fixGoogleCalendar(gCalManager=GoogleCalendarManager(service=self.service))
+
+        self.assertTrue(GoogleKalender.objects.filter(medlem=medlem, calendarId=f'kalender{medlem.pk}').exists())
+        self.assertFalse(GoogleKalender.objects.filter(medlem=self.medlemmer[1]).exists())
+        self.assertEqual(
+            set(GoogleHendelse.objects.values_list('kalender_id', 'eventId')),
+            {(calendarId, eventId) for calendarId, kalender in self.service.kalendere.items() for eventId in kalender['events']}
+        )
+        self.assertNotIn('gammel', self.service.kalendere[f'kalender{medlem.pk}']['events'])
+        self.assertEqual(len(self.events()), len(self.medlemmer) - 1)
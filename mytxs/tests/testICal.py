@@ -0,0 +1,142 @@
+import datetime
+from io import StringIO
+from unittest.mock import Mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from mytxs import consts
+from mytxs.management.commands.seed import makeMedlem, runSeed, setTop100Navn
+from mytxs.models import Hendelse, Kor, Medlem, Verv
+from mytxs.utils.downloadUtils import foldICalLinje, getBaseVevents, lagICal, veventKey
+from mytxs.utils.hashUtils import addHash
+from mytxs.utils.iCalCache import iCalMedlemKey
+
+
+class ICalTestCase(TestCase):
+    'Caching av iCal kalenderen per medlem og kor, med ETag og Last-Modified'
+
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        setTop100Navn()
+
+        cls.kor = Kor.objects.get(navn=consts.Kor.TSS)
+        start = datetime.date.today() - datetime.timedelta(days=7)
+        stemmegruppe = Verv.objects.get(kor=cls.kor, navn='1T')
+        cls.medlem = makeMedlem(cls.kor, start, None, stemmegruppe)
+        cls.annet = makeMedlem(cls.kor, start, None, stemmegruppe)
+        cls.hendelse = Hendelse.objects.create(navn='Øvelse', kor=cls.kor, startDate=datetime.date.today() + datetime.timedelta(days=1))
+
+    def setUp(self):
+        cache.clear()
+
+    def hentICal(self, medlem=None, **headers):
+        return self.client.get(addHash(reverse('iCal', args=[self.kor.navn, (medlem or self.medlem).pk])), headers=headers)
+
+    def lagre(self, instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+
+    def testConditionalGet(self):
+        'Første henting streames og caches, og uendrede kalendere gir deretter 304 uten spørringer mot Hendelse'
+        res = self.hentICal()
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        self.assertIn('SUMMARY:[OBLIG] Øvelse', b''.join(res.streaming_content).decode())
+
+        res = self.hentICal()
+        self.assertFalse(res.streaming)
+        spørringer = []
+        with connection.execute_wrapper(lambda execute, sql, *args: spørringer.append(sql) or execute(sql, *args)):
+            self.assertEqual(self.hentICal(**{'If-None-Match': res.headers['ETag']}).status_code, 304)
+            self.assertEqual(self.hentICal(**{'If-Modified-Since': res.headers['Last-Modified']}).status_code, 304)
+        self.assertFalse([sql for sql in spørringer if 'mytxs_hendelse' in sql])
+
+    def testInvalidering(self):
+        'Endringer i koret og medlemmet sine oppmøter gir ny ETag, men ikke endringer som ikke vises'
+        etag = self.hentICal(**{'If-None-Match': '"ingen"'}).headers['ETag']
+
+        # Andre sitt oppmøte invaliderer ikke kalenderen, og en lagring uten endring gir samme innhold
+        oppmøte = self.annet.oppmøter.get()
+        oppmøte.melding = 'Kommer sent'
+        self.lagre(oppmøte)
+        self.lagre(self.hendelse)
+        self.assertEqual(self.hentICal(**{'If-None-Match': etag}).status_code, 304)
+
+        oppmøte = self.medlem.oppmøter.get()
+        oppmøte.melding = 'Kommer sent'
+        self.lagre(oppmøte)
+        res = self.hentICal(**{'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Se melding', res.content)
+
+        etag = res.headers['ETag']
+        self.hendelse.sted = 'Rundhallen'
+        self.lagre(self.hendelse)
+        res = self.hentICal(**{'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'LOCATION:Rundhallen', res.content)
+
+    def testFolding(self):
+        'Lange linjer deles på maks 75 oktetter uten å dele tegn, og kan settes sammen igjen'
+        linje = 'DESCRIPTION:' + 'æøå' * 40
+        foldet = foldICalLinje(linje)
+        self.assertTrue(foldet.endswith('\r\n'))
+        self.assertTrue(all(len(del_.encode()) <= 75 for del_ in foldet[:-2].split('\r\n')))
+        self.assertEqual(foldet[:-2].replace('\r\n ', ''), linje)
+        self.assertEqual(foldICalLinje('END:VEVENT'), 'END:VEVENT\r\n')
+
+    def testSpørringer(self):
+        'Antall spørringer avhenger ikke av antall hendelser, heller ikke for undergruppe hendelser'
+        def antallSpørringer():
+            spørringer = []
+            with connection.execute_wrapper(lambda execute, sql, *args: spørringer.append(sql) or execute(sql, *args)):
+                lagICal(self.medlem, self.kor.navn)
+            return len(spørringer)
+
+        før = antallSpørringer()
+        for i in range(2, 6):
+            hendelse = Hendelse.objects.create(navn=f'Øvelse {i}', kor=self.kor, startDate=datetime.date.today() + datetime.timedelta(days=i))
+        hendelse.kategori = Hendelse.UNDERGRUPPE
+        hendelse.save()
+        hendelse.genererOppmøter(undergruppeMedlemmer=Medlem.objects.filter(pk__in=[self.medlem.pk, self.annet.pk]))
+
+        self.assertIn(f'- {self.annet}', lagICal(self.medlem, self.kor.navn).replace('\r\n ', ''))
+        self.assertEqual(antallSpørringer(), før)
+
+    def testBaseVevent(self):
+        'Basen til hendelsen caches og deles av medlemmene, og slettes når hendelsen eller de inviterte endres'
+        lagICal(self.medlem, self.kor.navn)
+        self.assertIsNotNone(cache.get(veventKey(self.hendelse.pk)))
+
+        oppmøte = self.medlem.oppmøter.get()
+        oppmøte.melding = 'Kommer sent'
+        self.lagre(oppmøte)
+        self.assertIsNotNone(cache.get(veventKey(self.hendelse.pk)))
+
+        # Fraværlenka er unik for hvert medlem, basen er lik
+        self.assertIn('Se melding', lagICal(self.medlem, self.kor.navn).replace('\r\n ', ''))
+        self.assertIn(f'meldFravær/{self.annet.pk}/', lagICal(self.annet, self.kor.navn).replace('\r\n ', ''))
+        self.assertNotIn('meldFrav', cache.get(veventKey(self.hendelse.pk))['DESCRIPTION'])
+
+        self.hendelse.sted = 'Rundhallen'
+        self.lagre(self.hendelse)
+        self.assertIsNone(cache.get(veventKey(self.hendelse.pk)))
+        self.assertEqual(getBaseVevents([self.hendelse])[self.hendelse.pk]['LOCATION'], 'Rundhallen')
+
+        self.hendelse.kategori = Hendelse.UNDERGRUPPE
+        self.lagre(self.hendelse)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hendelse.genererOppmøter(undergruppeMedlemmer=Medlem.objects.filter(pk=self.medlem.pk))
+        self.assertNotIn(str(self.annet), getBaseVevents([self.hendelse])[self.hendelse.pk]['DESCRIPTION'])
+
+    def testUtløptVersjon(self):
+        'Når versjonene går ut genereres kalenderen på nytt, men uendret innhold gir fortsatt 304'
+        etag = self.hentICal(**{'If-None-Match': '"ingen"'}).headers['ETag']
+        cache.delete(iCalMedlemKey(self.medlem.pk))
+        self.assertEqual(self.hentICal(**{'If-None-Match': etag}).status_code, 304)
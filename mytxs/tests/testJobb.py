@@ -0,0 +1,99 @@
+import datetime
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase
+from django.utils import timezone
+
+from mytxs.models import Jobb, Kor
+from mytxs.utils.jobbUtils import MAKS_FORSØK, jobb, kjørJobber, lagJobb, lagreJobber
+
+kjørt = []
+
+def leggTilKjørt(verdi, kor=None):
+    kjørt.append((verdi, kor))
+
+def feiler():
+    raise Exception('Denne feiler alltid')
+
+@jobb(slåSammen=lambda argumenterListe: {'args': [sorted({v for a in argumenterListe for v in a['args'][0]})], 'kwargs': {}})
+def leggTilAlle(verdier):
+    kjørt.extend(verdier)
+
+
+class JobbTestCase(TestCase):
+    def setUp(self):
+        kjørt.clear()
+
+    def testDuplikater(self):
+        'Identiske ventende jobber skal bare lagres én gang, men en jobb som har kjørt skal kunne legges til igjen'
+        self.assertEqual(lagreJobber([lagJobb(leggTilKjørt, 1), lagJobb(leggTilKjørt, 1), lagJobb(leggTilKjørt, 2)]), 1)
+        self.assertEqual(lagreJobber([lagJobb(leggTilKjørt, 1)]), 1)
+        self.assertEqual(Jobb.objects.count(), 2)
+
+        self.assertEqual(kjørJobber(), 2)
+        self.assertEqual(lagreJobber([lagJobb(leggTilKjørt, 1)]), 0)
+        self.assertEqual(Jobb.objects.filter(status=Jobb.VENTER).count(), 1)
+
+    def testKjør(self):
+        'Jobber kjøres med argumentene sine, instanser som øyeblikksbilder, og kjøretiden lagres'
+        kor = Kor.objects.create(navn='Testkor', tittel='Testkoret')
+        lagreJobber([lagJobb(leggTilKjørt, 'a', kor=kor)])
+        kor.navn = 'Endret'
+        kor.save()
+
+        self.assertEqual(kjørJobber(), 1)
+        self.assertEqual(kjørt, [('a', kor)])
+        self.assertEqual(kjørt[0][1].navn, 'Testkor')
+
+        jobb = Jobb.objects.get()
+        self.assertEqual(jobb.status, Jobb.FERDIG)
+        self.assertEqual(jobb.forsøk, 1)
+        self.assertIsNotNone(jobb.kjøretid)
+
+    def testBackoff(self):
+        'En jobb som feiler skal prøves igjen seinar, og markeres som feilet etter MAKS_FORSØK'
+        lagreJobber([lagJobb(feiler)])
+
+        self.assertEqual(kjørJobber(), 1)
+        jobb = Jobb.objects.get()
+        self.assertEqual(jobb.status, Jobb.VENTER)
+        self.assertGreater(jobb.kjørEtter, timezone.now())
+        self.assertIn('Denne feiler alltid', jobb.feilmelding)
+
+        # Skal ikke kjøres igjen før backoffen er over
+        self.assertEqual(kjørJobber(), 0)
+
+        for i in range(MAKS_FORSØK - 1):
+            Jobb.objects.update(kjørEtter=timezone.now() - datetime.timedelta(seconds=1))
+            self.assertEqual(kjørJobber(), 1)
+
+        jobb.refresh_from_db()
+        self.assertEqual(jobb.status, Jobb.FEILET)
+        self.assertEqual(jobb.forsøk, MAKS_FORSØK)
+
+    def testSlåSammen(self):
+        'Jobber med slåSammen fra samme request skal bli én jobb, og antallet som ble slått sammen telles'
+        self.assertEqual(lagreJobber([
+            lagJobb(leggTilAlle, [1, 2]), 
+            lagJobb(leggTilKjørt, 1), 
+            lagJobb(leggTilAlle, [2, 3]), 
+            lagJobb(leggTilAlle, [3])
+        ]), 2)
+        self.assertEqual(Jobb.objects.count(), 2)
+        self.assertEqual(Jobb.objects.get(funksjon__endswith='leggTilAlle').sammenslått, 2)
+
+        # En identisk ventende jobb telles opp heller enn å legges til
+        self.assertEqual(lagreJobber([lagJobb(leggTilAlle, [1, 2, 3])]), 1)
+        self.assertEqual(Jobb.objects.get(funksjon__endswith='leggTilAlle').sammenslått, 3)
+
+        self.assertEqual(kjørJobber(), 2)
+        self.assertCountEqual(kjørt, [1, 2, 3, (1, None)])
+
+    def testWorkerOverleverDatabasefeil(self):
+        'jobbWorker skal logge og fortsette om databasen forsvinner, heller enn å dø'
+        with patch('mytxs.management.commands.jobbWorker.kjørJobber', side_effect=OperationalError('server closed the connection')):
+            with self.assertLogs('mytxs.jobb', 'ERROR'):
+                call_command('jobbWorker', engang=True, stdout=StringIO())
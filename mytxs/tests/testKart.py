@@ -0,0 +1,68 @@
+import gzip
+from io import StringIO
+import json
+from unittest.mock import Mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from mytxs.management.commands.seed import adminAdmin, runSeed
+from mytxs.models import Medlem
+
+
+@override_settings(GEOKODER='mytxs.utils.geokoding.OfflineGeokoder')
+class KartTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        adminAdmin(mock_self)
+
+    def setUp(self):
+        cache.clear()
+        self.medlem = Medlem.objects.get(fornavn='admin')
+        self.client.force_login(self.medlem.user)
+
+    def hentKart(self, **headers):
+        return self.client.get('/sjekkheftet/kart/data', headers=headers)
+
+    def endreMedlem(self, **felter):
+        with self.captureOnCommitCallbacks(execute=True):
+            for felt, verdi in felter.items():
+                setattr(self.medlem, felt, verdi)
+            self.medlem.save()
+
+    def testKartData(self):
+        'Datasettet serves gzippet om klienten støtte det, og med en ETag som gir 304 ved neste besøk'
+        res = self.hentKart(**{'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(res.content)), [])
+
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(self.hentKart(**{'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']}).status_code, 304)
+
+        # Den ukomprimerte kroppen har en annen ETag, så den gzippede ETagen gir den ikke 304
+        ukomprimert = self.hentKart(**{'If-None-Match': res.headers['ETag']})
+        self.assertEqual(ukomprimert.status_code, 200)
+        self.assertNotIn('Content-Encoding', ukomprimert.headers)
+        self.assertNotEqual(ukomprimert.headers['ETag'], res.headers['ETag'])
+        self.assertEqual(self.hentKart(**{'If-None-Match': ukomprimert.headers['ETag']}).status_code, 304)
+
+    def testOppdatering(self):
+        'Datasettet endres bare når et punkt endres'
+        etag = self.hentKart().headers['ETag']
+
+        self.endreMedlem(boAdresse='Elgeseter gate 1')
+        self.assertEqual(self.hentKart().headers['ETag'], etag, msg='Adressen er ikke synlig i sjekkheftet')
+
+        self.endreMedlem(innstillinger={**self.medlem.innstillinger, 'sjekkhefteSynlig': 2**4})
+        res = self.hentKart()
+        self.assertNotEqual(res.headers['ETag'], etag)
+        punkt, = json.loads(res.content)
+        self.assertEqual((punkt['pk'], punkt['boCord'], punkt['foreldreCord']), (self.medlem.pk, self.medlem.boAdresseCord(), None))
+
+        etag = res.headers['ETag']
+        self.endreMedlem(notis='Endrer ikke kartet')
+        self.assertEqual(self.hentKart(**{'If-None-Match': etag}).status_code, 304)
@@ -0,0 +1,117 @@
+from io import StringIO
+from unittest.mock import Mock
+
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from mytxs import consts
+from mytxs.management.commands.seed import makeMedlem, runSeed, scaleData, setTop100Navn
+from mytxs.models import Kor, Logg, LoggHode, LoggM2M, Medlem, Oppmøte, Tilgang, Verv, VervInnehavelse
+from mytxs.utils.loggUtils import samleLogger
+
+class LoggTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        setTop100Navn()
+
+        cls.kor = Kor.objects.get(navn=consts.Kor.TSS)
+
+    def testSamleLogger(self):
+        'Logger samlet i en batch skal lagres etter commit, med relasjoner til logger fra samme batch'
+        with self.captureOnCommitCallbacks() as callbacks:
+            with samleLogger():
+                verv = Verv.objects.create(navn='Kasserer', kor=self.kor)
+                medlem = makeMedlem()
+                vervInnehavelse = VervInnehavelse.objects.create(medlem=medlem, verv=verv, start='2020-01-01')
+                verv.tilganger.add(Tilgang.objects.get(kor=self.kor, navn=consts.Tilgang.semesterplan))
+
+                # Lagring uten endring gir ingen logg, men en endring gjør
+                vervInnehavelse.save()
+                vervInnehavelse.slutt = '2020-12-31'
+                vervInnehavelse.save()
+
+        self.assertIsNone(Logg.objects.getLoggFor(verv))
+
+        # Lagringen av loggene skal ta et fast antall spørringer
+        with self.assertNumQueries(5):
+            for callback in callbacks:
+                callback()
+
+        vervLogg = Logg.objects.getLoggFor(verv)
+        vervInnehavelseLogger = Logg.objects.filter(model='VervInnehavelse', instancePK=vervInnehavelse.pk)
+        self.assertEqual(vervInnehavelseLogger.count(), 2)
+        self.assertEqual(vervInnehavelseLogger.first().value['verv'], vervLogg.pk)
+        self.assertEqual(vervInnehavelseLogger.first().value['medlem'], Logg.objects.getLoggFor(medlem).pk)
+        self.assertEqual(vervInnehavelseLogger.first().value['slutt'], '2020-12-31')
+        self.assertTrue(LoggM2M.objects.filter(toLogg=vervLogg, change=LoggM2M.CREATE).exists())
+
+    def testSamleLoggerRollback(self):
+        'Logger fra noe som rulles tilbake skal ikke lagres'
+        with self.captureOnCommitCallbacks(execute=True):
+            with samleLogger():
+                try:
+                    with transaction.atomic():
+                        Verv.objects.create(navn='Rullet tilbake', kor=self.kor)
+                        raise IntegrityError
+                except IntegrityError:
+                    pass
+                verv = Verv.objects.create(navn='Lagret', kor=self.kor)
+
+        self.assertFalse(Logg.objects.filter(model='Verv', strRep__contains='Rullet tilbake').exists())
+        self.assertIsNotNone(Logg.objects.getLoggFor(verv))
+
+    def testUendretRelasjon(self):
+        'Lagring uten endring av et objekt med relasjoner skal ikke gi en ny logg'
+        verv = Verv.objects.create(navn='Kasserer', kor=self.kor)
+        vervInnehavelse = VervInnehavelse.objects.create(medlem=makeMedlem(), verv=verv, start='2020-01-01')
+
+        vervInnehavelse.save()
+        vervInnehavelse.save()
+
+        self.assertEqual(Logg.objects.filter(model='VervInnehavelse', instancePK=vervInnehavelse.pk).count(), 1)
+
+    def testLoggHode(self):
+        'LoggHode skal peke på nyeste logg for objektet, og getLoggFor skal bare bruke én spørring'
+        verv = Verv.objects.create(navn='Kasserer', kor=self.kor)
+        førsteLogg = Logg.objects.filter(model='Verv', instancePK=verv.pk).get()
+
+        verv.navn = 'Kassererske'
+        verv.save()
+        nyesteLogg = Logg.objects.filter(model='Verv', instancePK=verv.pk).exclude(pk=førsteLogg.pk).get()
+
+        self.assertEqual(LoggHode.objects.get(model='Verv', instancePK=verv.pk).logg, nyesteLogg)
+        with self.assertNumQueries(1):
+            self.assertEqual(Logg.objects.getLoggFor(verv), nyesteLogg)
+        self.assertEqual(nyesteLogg.lastLogg(), førsteLogg)
+        self.assertEqual(førsteLogg.nextLogg(), nyesteLogg)
+
+    def testScaleData(self):
+        'seed --scale skal gi samme data for samme randomSeed, med riktig dbCache og logger for opprettelse og endring'
+        førstePK = (Medlem.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+
+        def lagData():
+            with samleLogger():
+                scaleData(Mock(), scale=0.05, randomSeed=3, antallÅr=1)
+            return list(Medlem.objects.filter(pk__gte=førstePK).order_by('pk').values_list('fornavn', 'etternavn', 'fødselsdato'))
+
+        with transaction.atomic():
+            første = lagData()
+            transaction.set_rollback(True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            andre = lagData()
+
+        self.assertTrue(første)
+        self.assertEqual(første, andre)
+
+        for vervInnehavelse in VervInnehavelse.objects.filter(medlem__pk__gte=førstePK).select_related('medlem', 'verv'):
+            self.assertEqual(str(vervInnehavelse), f'{vervInnehavelse.medlem} -> {vervInnehavelse.verv}')
+
+        oppmøter = Oppmøte.objects.all()
+        self.assertTrue(oppmøter.filter(fravær__isnull=False).exists())
+        self.assertEqual(LoggHode.objects.filter(model='Oppmøte').count(), oppmøter.count())
+        # Oppmøter uten fravær eller melding er ikke endret, og får ingen logg for endringen
+        self.assertEqual(Logg.objects.filter(model='Oppmøte', change=Logg.UPDATE).count(), oppmøter.exclude(fravær=None, melding='').count())
@@ -0,0 +1,52 @@
+from django.db import connection
+from django.test import TestCase
+
+from mytxs.forms import MedlemFilterForm
+from mytxs.models import Medlem
+
+
+class MedlemSøkTestCase(TestCase):
+    'Navnesøket på medlemmer, via søkenavn feltet og MedlemFilterForm'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.øystein = Medlem.objects.create(fornavn='Øystein', mellomnavn='Åsmund', etternavn='Bjørnæs')
+        cls.øyvind = Medlem.objects.create(fornavn='Øyvind', etternavn='Hansen')
+        cls.kari = Medlem.objects.create(fornavn='Kari', etternavn='Nordmann')
+
+    def søk(self, navn):
+        return list(MedlemFilterForm({'navn': navn}).applyFilter(Medlem.objects.all()))
+
+    def testSøkenavn(self):
+        self.assertEqual(Medlem.objects.get(pk=self.øystein.pk).søkenavn, 'oystein asmund bjornaes')
+        self.assertEqual(Medlem.objects.get(pk=self.øyvind.pk).søkenavn, 'oyvind  hansen')
+
+        self.øyvind.etternavn = 'Ås'
+        self.øyvind.save()
+        self.øyvind.refresh_from_db()
+        self.assertEqual(self.øyvind.søkenavn, 'oyvind  as')
+
+    def testUtenAksenter(self):
+        self.assertEqual(self.søk('oy'), [self.øystein, self.øyvind])
+        self.assertEqual(self.søk('ØYSTEIN bjørnæs'), [self.øystein])
+        self.assertEqual(self.søk('Nordmann Kari'), [self.kari])
+
+    def testSkrivefeil(self):
+        self.assertEqual(self.søk('oystien bjornes'), [self.øystein])
+        self.assertEqual(self.søk('hansne'), [self.øyvind])
+        self.assertEqual(self.søk('xyz'), [])
+
+    def testRangering(self):
+        # Øyvind treffe bedre enn Øystein, selv om Øystein kommer først alfabetisk
+        self.assertEqual(self.søk('oyvin')[0], self.øyvind)
+
+    def testIndeks(self):
+        'Både substringsøket og skrivefeilsøket skal kunne bruke trigram indeksen på søkenavn'
+        with connection.cursor() as cursor:
+            # Med tre medlemmer er seq scan alltid billigst, så tving planleggeren til å vise om indeksen kan brukes
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = MedlemFilterForm({'navn': 'oystien'}).applyFilter(Medlem.objects.all()).explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertIn('Bitmap Index Scan on medlem_sokenavn_trgm', plan)
+        self.assertIn('Index Cond: ("søkenavn" ~~', plan)
+        self.assertIn('Index Cond: ("søkenavn" %> ', plan)
@@ -0,0 +1,78 @@
+import datetime
+from io import StringIO
+from unittest.mock import Mock
+
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+
+from mytxs import consts
+from mytxs.management.commands.seed import makeMedlem, runSeed, setTop100Navn
+from mytxs.models import Hendelse, Kor, Logg, Medlem, Oppmøte, Verv, VervInnehavelse
+
+class OppmøterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        setTop100Navn()
+
+        cls.kor = Kor.objects.get(navn=consts.Kor.TSS)
+        cls.stemmegruppe = Verv.objects.get(kor=cls.kor, navn='1T')
+        cls.start = datetime.date.today() - datetime.timedelta(days=7)
+
+        for i in range(5):
+            makeMedlem(cls.kor, cls.start, None, cls.stemmegruppe)
+
+    def lagHendelser(self, antall, fra=1):
+        # Loggene for oppmøtene lagres etter commit
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(fra, fra + antall):
+                Hendelse.objects.create(navn=f'Øvelse {i}', kor=self.kor, startDate=datetime.date.today() + datetime.timedelta(days=i))
+
+    def assertRiktigeOppmøter(self):
+        for hendelse in Hendelse.objects.filter(kor=self.kor):
+            self.assertEqual(
+                set(hendelse.oppmøter.values_list('medlem', flat=True)),
+                set(hendelse.oppmøteMedlemmer.values_list('pk', flat=True))
+            )
+
+    def testGenererOppmøter(self):
+        'Oppmøtene som lages i bulk skal vær de samme som før, med dbCache og logg'
+        self.lagHendelser(3)
+        self.assertRiktigeOppmøter()
+        self.assertEqual(Oppmøte.objects.count(), 15)
+
+        oppmøte = Oppmøte.objects.first()
+        self.assertEqual(str(oppmøte), f'Fraværssøknad {oppmøte.medlem} -> {oppmøte.hendelse}')
+        self.assertEqual(oppmøte.get_absolute_url(), oppmøte.dbCacheField['get_absolute_url'])
+
+        logg = Logg.objects.getLoggFor(oppmøte)
+        self.assertEqual(logg.change, Logg.CREATE)
+        self.assertEqual(logg.value['medlem'], Logg.objects.getLoggFor(oppmøte.medlem).pk)
+        self.assertEqual(logg.kor, self.kor)
+
+        # Permisjon fjerne oppmøtene, og de kommer tilbake når permisjonen slettes
+        medlem = oppmøte.medlem
+        permisjon = VervInnehavelse.objects.create(medlem=medlem, verv=Verv.objects.get(kor=self.kor, navn='Permisjon'), start=self.start)
+        self.assertFalse(medlem.oppmøter.exists())
+        self.assertRiktigeOppmøter()
+
+        permisjon.delete()
+        self.assertEqual(medlem.oppmøter.count(), 3)
+        self.assertRiktigeOppmøter()
+
+    def testOppmøterAntallSpørringer(self):
+        'Antall spørringer for å endre en vervInnehavelse skal ikke avhenge av antall hendelser'
+        def spørringerForNyttMedlem():
+            medlem = makeMedlem()
+            with CaptureQueriesContext(connection) as context:
+                VervInnehavelse.objects.create(medlem=medlem, verv=self.stemmegruppe, start=self.start)
+            return len(context.captured_queries)
+
+        self.lagHendelser(2)
+        færre = spørringerForNyttMedlem()
+        self.lagHendelser(8, fra=3)
+        self.assertEqual(spørringerForNyttMedlem(), færre)
+        self.assertRiktigeOppmøter()
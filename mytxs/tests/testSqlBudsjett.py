@@ -0,0 +1,99 @@
+from io import StringIO
+from unittest.mock import Mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from mytxs.management.commands.benchmarkQueries import lagUrler, sammenlign, sammenlignPlaner
+from mytxs.management.commands.seed import adminAdmin, runSeed
+from mytxs.models import Medlem
+from mytxs.utils.sqlUtils import STOR_TABELL, SqlMåling, analyserPlan, explain, sqlForm
+
+class SqlBudsjettTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        mock_self = Mock()
+        mock_self.stdout = StringIO()
+        runSeed(mock_self)
+        adminAdmin(mock_self)
+
+    def setUp(self):
+        self.client.force_login(Medlem.objects.get(fornavn='admin').user)
+
+    def testSqlForm(self):
+        'Spørringer som bare skille seg på antall parametre skal få samme form'
+        self.assertEqual(
+            sqlForm('SELECT * FROM a WHERE id IN (%s, %s, %s) AND b = %s'),
+            sqlForm('SELECT * FROM a WHERE id IN (%s) AND b = %s')
+        )
+        self.assertEqual(
+            sqlForm('INSERT INTO a (x, y) VALUES (%s, %s), (%s, %s)'),
+            sqlForm('INSERT INTO a (x, y) VALUES (%s, %s)')
+        )
+
+    @override_settings(SQL_N_PLUSS_1=5)
+    def testNPluss1(self):
+        'Samme spørring i en løkke skal flagges som N+1, med antallet'
+        måling = SqlMåling()
+        with connection.execute_wrapper(måling):
+            for pk in range(5):
+                Medlem.objects.filter(pk=pk).first()
+            Medlem.objects.count()
+
+        self.assertEqual(måling.antall, 6)
+        self.assertEqual(len(måling.nPluss1()), 1)
+        self.assertEqual(måling.nPluss1()[0][1], 5)
+
+    @override_settings(DEBUG=False) # Ellers overskriv django-debug-toolbar Server-Timing
+    def testHeaders(self):
+        'Målte requests skal få antall spørringer og tid i headerne, og de over budsjettet skal logges'
+        res = self.client.get('/sjekkheftet/TSS')
+        self.assertGreater(int(res['X-Query-Count']), 0)
+        self.assertIn('db;dur=', res['Server-Timing'])
+
+        with self.settings(SQL_BUDSJETT_ANTALL=0), self.assertLogs('mytxs.sql', level='WARNING') as logs:
+            res = self.client.get('/sjekkheftet/TSS')
+        self.assertIn(res['X-Request-Id'], logs.output[0])
+        self.assertIn(f'{res["X-Query-Count"]} spørringer', logs.output[0])
+
+    @override_settings(SQL_SAMPLING=0)
+    def testSampling(self):
+        'Requests som ikke samples skal ikke måles'
+        res = self.client.get('/sjekkheftet/TSS')
+        self.assertNotIn('X-Query-Count', res)
+
+    def testBenchmarkQueries(self):
+        'Benchmarken skal finn sider for alle url patterns vi har rader til, og bare flagge regresjoner over terskelen'
+        urler = lagUrler(Medlem.objects.get(fornavn='admin'))
+        self.assertIn('/medlem', urler)
+        self.assertIn('/sjekkheftet/TSS', urler)
+        self.assertNotIn('/logout', urler)
+
+        baseline = {'admin /medlem': {'spørringer': 10, 'dbTid': 0.01, 'pythonTid': 0.1, 'minne': 1_000_000}}
+        self.assertEqual(sammenlign(baseline, {'admin /medlem': {'spørringer': 11, 'dbTid': 0.012, 'pythonTid': 0.1, 'minne': 1_000_000}}, 0.2), [])
+        self.assertEqual(len(sammenlign(baseline, {'admin /medlem': {'spørringer': 20, 'dbTid': 0.01, 'pythonTid': 0.2, 'minne': 1_000_000}}, 0.2)), 2)
+
+    def testExplain(self):
+        'Planene fra EXPLAIN ANALYZE skal flagge seq scans på store tabeller, feilestimerte nested loops, og endrede planer'
+        sql, params = Medlem.objects.filter(fornavn='admin').query.sql_with_params()
+        analyse = analyserPlan(explain(sql, params), {'mytxs_medlem': STOR_TABELL + 1})
+        self.assertIn('mytxs_medlem', analyse['form'])
+        # Det finnes ingen indeks på fornavn, så det blir en seq scan
+        self.assertEqual([s['tabell'] for s in analyse['seqScans']], ['mytxs_medlem'])
+        self.assertLessEqual(len(analyse['dyresteNoder']), 3)
+
+        def node(nodeType, planRows, actualRows, plans=[], **kwargs):
+            return {'Node Type': nodeType, 'Plan Rows': planRows, 'Actual Rows': actualRows, 'Actual Loops': 1, 
+                'Actual Total Time': 1, 'Total Cost': 1, 'Plans': plans, **kwargs}
+
+        analyse = analyserPlan({'Execution Time': 2, 'Plan': node('Nested Loop', 1, 500, [
+            node('Seq Scan', 1, 500, **{'Relation Name': 'mytxs_oppmøte'}), 
+            node('Index Scan', 1, 1, **{'Relation Name': 'mytxs_medlem', 'Index Name': 'mytxs_medlem_pkey'})
+        ])}, {})
+        self.assertEqual(analyse['form'], 'Nested Loop(Seq Scan mytxs_oppmøte, Index Scan mytxs_medlem mytxs_medlem_pkey)')
+        self.assertEqual([f['node'] for f in analyse['feilestimater']], ['Nested Loop', 'Seq Scan mytxs_oppmøte'])
+        self.assertEqual(analyse['seqScans'], [])
+
+        planer = {'admin /medlem': {'SELECT 1': {'form': 'Index Scan'}, 'SELECT 2': {'form': 'Seq Scan'}}}
+        self.assertEqual(len(sammenlignPlaner({'admin /medlem': {'SELECT 1': {'form': 'Seq Scan'}, 'SELECT 2': {'form': 'Seq Scan'}}}, planer)), 1)
+        self.assertEqual(planer['admin /medlem']['SELECT 1']['endretFra'], 'Seq Scan')
@@ -3,15 +3,18 @@ from io import StringIO
 from unittest.mock import Mock
 import random
 
+from django import forms
 from django.contrib.auth.models import User
 from django.db.models import Q
 from django.test import TestCase
 
 from mytxs import consts
 from mytxs.management.commands.seed import adminAdmin, makeMedlem, runSeed, setTop100Navn
-from mytxs.models import Kor, Medlem, Tilgang, Verv, VervInnehavelse
+from mytxs.models import Kor, Medlem, MedlemTilgang, Tilgang, Verv, VervInnehavelse
 from mytxs.utils.formAccess import fieldIsVisible
+from mytxs.utils.modelCacheUtils import cacheQSTeller
 from mytxs.utils.modelUtils import stemmegruppeVerv
+from mytxs.utils.navBar import getNavBarVersjon
 from mytxs.utils.utils import getHalvårStart
 
 start = getHalvårStart()
@@ -297,3 +300,111 @@ class TilgangerTestCase(TestCase):
         self.assertFieldDisabled(vervForm.fields['navn'], disabled=False)
         self.assertFieldDisabled(vervForm.fields['DELETE'], disabled=False)
         self.assertNotIn('bruktIKode', vervForm.fields)
+
+    def testNavBarCache(self):
+        'Sjekk at navBar caches på tvers av requests, og invalideres når tilgangene endres'
+        self.setTilganger(tilgangNavn=[consts.Tilgang.semesterplan])
+
+        self.assertIsNone(Medlem.objects.get(pk=self.medlem.pk).navBar['tilgang'])
+
+        # Et nytt medlem objekt (som i et nytt request) skal ikke gjøre noen spørringer for navBar
+        medlem = Medlem.objects.get(pk=self.medlem.pk)
+        with self.assertNumQueries(0):
+            medlem.navBar
+
+        # Dato-avhengige parametre fylles inn når urlen leses
+        self.assertEqual(medlem.navBar['hendelse'].url.split('?start=')[1], str(datetime.date.today()))
+
+        self.setTilganger(tilgangNavn=[consts.Tilgang.semesterplan, consts.Tilgang.tilgang])
+        self.assertIsNotNone(Medlem.objects.get(pk=self.medlem.pk).navBar['tilgang'])
+
+    def testTilgangMemo(self):
+        'Sjekk at tilgangsquerysettene memoiseres per medlem instans, og at harRedigerTilgang kan sjekkes for mange med ett oppslag'
+        medlem = Medlem.objects.get(pk=self.medlem.pk)
+        medlem.tilganger
+
+        with self.assertNumQueries(0):
+            for i in range(3):
+                medlem.redigerTilgangQueryset(VervInnehavelse, Medlem, fieldType=forms.ModelChoiceField)
+            self.assertEqual(len(medlem.tilgangMemo), 1)
+            self.assertIn(f'IN ({self.kor.pk})', str(medlem.redigerTilgangQueryset(VervInnehavelse).query))
+
+        vervInnehavelser = list(VervInnehavelse.objects.all())
+        with self.assertNumQueries(1):
+            medlem.hentRedigerTilganger(vervInnehavelser)
+
+        with self.assertNumQueries(0):
+            harTilgang = [medlem.harRedigerTilgang(vervInnehavelse) for vervInnehavelse in vervInnehavelser]
+
+        self.assertEqual(
+            harTilgang,
+            [Medlem.objects.get(pk=self.medlem.pk).redigerTilgangQueryset(VervInnehavelse).contains(v) for v in vervInnehavelser]
+        )
+        self.assertIn(True, harTilgang)
+        self.assertIn(False, harTilgang)
+
+    def testMedlemTilgangTabell(self):
+        'Sjekk at MedlemTilgang holdes oppdatert av signals, og at oppdater fange opp vervInnehavelser som går ut på dato'
+        self.assertEqual(MedlemTilgang.avvik(), (set(), []))
+
+        tilgang = Tilgang.objects.get(kor__navn=consts.Kor.TSS, navn=consts.Tilgang.semesterplan)
+        lokfører = Verv.objects.get(navn='Lokfører', kor__navn=consts.Kor.TSS)
+        medlem = makeMedlem()
+
+        vervInnehavelse = VervInnehavelse.objects.create(medlem=medlem, verv=lokfører, start=datetime.date.today())
+        self.assertFalse(medlem.medlemTilganger.exists())
+
+        lokfører.tilganger.add(tilgang)
+        self.assertTrue(medlem.medlemTilganger.filter(tilgang=tilgang).exists())
+        self.assertIn(tilgang, Medlem.objects.get(pk=medlem.pk).faktiskeTilganger)
+
+        tilgang.verv.clear()
+        self.assertFalse(medlem.medlemTilganger.exists())
+
+        lokfører.tilganger.add(tilgang)
+        vervInnehavelse.delete()
+        self.assertFalse(medlem.medlemTilganger.exists())
+
+        # Oppdateringer som ikke går via save må fanges opp av oppdater
+        vervInnehavelse = VervInnehavelse.objects.create(medlem=medlem, verv=lokfører, start=datetime.date.today())
+        VervInnehavelse.objects.filter(pk=vervInnehavelse.pk).update(slutt=datetime.date.today() - datetime.timedelta(days=31))
+        self.assertEqual(len(MedlemTilgang.avvik()[1]), 1)
+        versjon, annenVersjon = getNavBarVersjon(medlem.pk), getNavBarVersjon(self.medlem.pk)
+        self.assertEqual(MedlemTilgang.oppdater(), (0, 1))
+        self.assertEqual(MedlemTilgang.avvik(), (set(), []))
+
+        # navBar til medlemmet invalideres, men ikke til andre
+        self.assertNotEqual(getNavBarVersjon(medlem.pk), versjon)
+        self.assertEqual(getNavBarVersjon(self.medlem.pk), annenVersjon)
+
+    def testCacheQS(self):
+        'Sjekk at cacheQS svare likt som databasen på vanlige oppslag, uten å gjør spørringer'
+        self.setTilganger(tilgangKorNavn=[consts.Kor.TSS, consts.Kor.Pirum], tilgangNavn=[consts.Tilgang.semesterplan, consts.Tilgang.fravær, consts.Tilgang.vervInnehavelse])
+        medlem = Medlem.objects.get(pk=self.medlem.pk)
+        tilganger = medlem.tilganger
+        pirum = Kor.objects.get(navn=consts.Kor.Pirum)
+
+        oppslag = [
+            lambda qs: qs.filter(navn=consts.Tilgang.fravær).exists(),
+            lambda qs: qs.filter(navn__in=[consts.Tilgang.fravær, consts.Tilgang.semesterplan]).filter(kor=pirum).count(),
+            lambda qs: qs.exclude(kor__navn=consts.Kor.TSS).count(),
+            lambda qs: qs.filter(Q(navn=consts.Tilgang.fravær) | ~Q(kor__navn=consts.Kor.TSS)).count(),
+            lambda qs: qs.filter(navn__contains='plan', kor__isnull=False).count(),
+            lambda qs: qs.get(navn=consts.Tilgang.fravær, kor=pirum.pk),
+            lambda qs: qs.order_by('-kor__navn', 'navn').first(),
+            lambda qs: qs.last(),
+            lambda qs: list(qs.values('navn', 'kor__navn')),
+            lambda qs: list(qs.values_list('kor__navn', flat=True)),
+            lambda qs: list(qs.filter(navn=consts.Tilgang.medlemsdata)),
+            lambda qs: list(qs.all().distinct()),
+        ]
+
+        forventet = [o(Tilgang.objects.filter(pk__in=[t.pk for t in tilganger]).select_related('kor')) for o in oppslag]
+        with self.assertNumQueries(0):
+            self.assertEqual([o(tilganger) for o in oppslag], forventet)
+
+        # Det vi ikke støtte skal fortsatt gi rett svar, via databasen, og telles som bom
+        bom = cacheQSTeller['filter', 'bom']
+        with self.assertNumQueries(1):
+            self.assertEqual(tilganger.filter(verv__navn='Sekretær').count(), 6)
+        self.assertEqual(cacheQSTeller['filter', 'bom'], bom + 1)
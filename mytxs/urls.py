@@ -34,6 +34,8 @@ urlpatterns = [
     path('medlem', views.medlemListe, name='medlem'),
     path('medlem/<int:medlemPK>', views.medlem, name='medlem'),
 
+    path('sjekkheftet/kart/data', views.sjekkhefteKartData, name='sjekkhefteKartData'),
+    path('sjekkheftet/jubileum/data', views.kommendeBursdager, name='kommendeBursdager'),
     path('sjekkheftet/<str:side>', views.sjekkheftet, name='sjekkheftet'),
     path('sjekkheftet/<str:side>/<str:underside>', views.sjekkheftet, name='sjekkheftet'),
 
@@ -0,0 +1,65 @@
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from mytxs.utils.jobbUtils import jobb
+from mytxs.utils.utils import cropImage
+
+# Varianter av sjekkhefte bildene i flere størrelser og formater, så sjekkheftet kan bruke srcset og nettleseren
+# bare laster ned det den treng. Varianter lages av en jobb etter at bildet er lastet opp, og serves av serve med
+# lange cache headers, siden urlen inneholder bildeVersjon og dermed endres når bildet gjør det.
+
+BILDE_STØRRELSER = [(139, 169), (270, 330)]
+'Bredde og høyde på variantene. Bildene vises 176px høye, så dette dekker vanlige og høyoppløste skjermer.'
+
+BILDE_FORMATER = {'webp': 'WEBP', 'jpg': 'JPEG'}
+'Filendelse og PIL format for variantene, i den rekkefølgen nettleseren skal foretrekke dem'
+
+VARIANT_MAPPE = 'sjekkhefteBilder/varianter'
+
+def variantNavn(medlemPK, bredde, endelse):
+    return f'{VARIANT_MAPPE}/{medlemPK}-{bredde}.{endelse}'
+
+
+def variantMedlemPK(filePath):
+    'pk til medlemmet om filePath er en variant, ellers None'
+    if match := re.fullmatch(rf'{VARIANT_MAPPE}/(\d+)-\d+\.\w+', filePath):
+        return int(match[1])
+
+
+def variantSrcset(medlem, endelse):
+    'srcset med variantene til medlemmet i formatet'
+    return ', '.join(
+        f'{settings.MEDIA_URL}{variantNavn(medlem.pk, bredde, endelse)}?v={medlem.bildeVersjon} {bredde}w'
+        for bredde, høyde in BILDE_STØRRELSER
+    )
+
+
+def slettBildeVarianter(medlemPK):
+    for bredde, høyde in BILDE_STØRRELSER:
+        for endelse in BILDE_FORMATER:
+            default_storage.delete(variantNavn(medlemPK, bredde, endelse))
+
+
+@jobb
+def lagBildeVarianter(medlemPK):
+    '''
+    Lag variantene til bildet til medlemmet, og sett bildeVersjon så sjekkheftet begynner å bruke dem. Bruker 
+    update så det ikke blir en ny logg eller lagring, og sjekker at bildet ikke har endret seg underveis. 
+    '''
+    Medlem = apps.get_model('mytxs', 'Medlem')
+    medlem = Medlem.objects.filter(pk=medlemPK).first()
+    if not medlem or not medlem.bilde or not os.path.isfile(medlem.bilde.path):
+        return
+
+    for bredde, høyde in BILDE_STØRRELSER:
+        for endelse, format in BILDE_FORMATER.items():
+            navn = variantNavn(medlemPK, bredde, endelse)
+            default_storage.delete(navn)
+            with medlem.bilde.open('rb') as bilde:
+                default_storage.save(navn, cropImage(bilde, navn, bredde, høyde, format=format))
+
+    Medlem.objects.filter(pk=medlemPK, bilde=medlem.bilde.name).update(bildeVersjon=os.stat(medlem.bilde.path).st_mtime_ns)
@@ -2,15 +2,17 @@ import datetime
 from urllib.parse import unquote
 
 from django.apps import apps
-from django.db.models import Q
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db.models import Prefetch, Q
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import reverse
 
 from mytxs import settings as mytxsSettings
 
 def downloadFile(fileName, content='', content_type='text/plain'):
-    'I en view, return returnverdien av denne funksjonen'
-    return HttpResponse(content, content_type=f'{content_type}; charset=utf-8', headers={"Content-Disposition": f'attachment; filename="{fileName}"'})
+    'I en view, return returnverdien av denne funksjonen. Om content er en generator streames den.'
+    Response = HttpResponse if isinstance(content, (str, bytes)) else StreamingHttpResponse
+    return Response(content, content_type=f'{content_type}; charset=utf-8', headers={"Content-Disposition": f'attachment; filename="{fileName}"'})
 
 
 def downloadVCard(queryset):
@@ -36,8 +38,25 @@ def dateToICal(date):
     return date.strftime('%Y%m%d')
 
 
-def getVeventFromHendelse(hendelse, medlem, hendelsePK=None):
-    'Genererer en dictionary med keys og values tilsvarende en iCal hendelse'
+# Det meste av en VEVENT er likt for alle i koret, bortsett fra fraværlenka og DTSTAMP. Den delen som er lik
+# (basen) caches per hendelse, og slettes av iCalSignals.py når hendelsen eller oppmøtene lagres. Kalenderen til hvert medlem,
+# både iCal og Google Calendar, settes så sammen av basene og et lite overlegg per medlem med medlemVevent.
+
+VEVENT_TIMEOUT = 60 * 60 * 24 * 7
+
+def veventKey(hendelsePK):
+    return f'vevent-{hendelsePK}'
+
+
+def slettBaseVevents(hendelsePKs):
+    cache.delete_many([veventKey(pk) for pk in hendelsePKs])
+
+
+def lagBaseVevent(hendelse, hendelsePK=None, inviterte=None):
+    '''
+    Genererer en dictionary med keys og values tilsvarende en iCal hendelse, med det som er likt for alle medlemmer. 
+    inviterte er medlemmene som er invitert til en undergruppe hendelse, og hentes om de ikke er gitt. 
+    '''
     # Må unngå en circular imports ved at Hendelse.save calle updateGoogleCalendar, som bruke getVeventFromHendelse. 
     Hendelse = apps.get_model('mytxs', 'Hendelse')
     Medlem = apps.get_model('mytxs', 'Medlem')
@@ -51,9 +70,9 @@ def getVeventFromHendelse(hendelse, medlem, hendelsePK=None):
 
     veventDict['DESCRIPTION'] = [hendelse.beskrivelse.replace('\r\n', '\\n')] if hendelse.beskrivelse else []
     if hendelse.kategori == Hendelse.UNDERGRUPPE:
-        veventDict['DESCRIPTION'].append('De inviterte:\\n- ' + '\\n- '.join([str(m) for m in Medlem.objects.filter(oppmøter__hendelse=hendelse)]))
-    elif hendelse.pk and (oppmøte := hendelse.oppmøter.filter(medlem=medlem).first()) and oppmøte.fraværTekst:
-        veventDict['DESCRIPTION'].append(oppmøte.fraværTekst + ': ' + mytxsSettings.ALLOWED_HOSTS[0] + unquote(reverse('meldFravær', args=[medlem.pk, hendelse.pk])))
+        if inviterte == None:
+            inviterte = Medlem.objects.filter(oppmøter__hendelse=hendelse)
+        veventDict['DESCRIPTION'].append('De inviterte:\\n- ' + '\\n- '.join([str(m) for m in inviterte]))
     veventDict['DESCRIPTION'] = '\\n\\n'.join(veventDict['DESCRIPTION'])
 
     veventDict['LOCATION'] = hendelse.sted
@@ -72,64 +91,162 @@ def getVeventFromHendelse(hendelse, medlem, hendelsePK=None):
             # i kalenderapplikasjonene. Derfor hive vi på en dag her, så det vises rett:)
             veventDict['DTEND;VALUE=DATE'] = dateToICal(hendelse.slutt + datetime.timedelta(days=1))
     
-    veventDict['DTSTAMP'] = dateToICal(datetime.datetime.now(datetime.timezone.utc)) + 'Z'
+    # Settes av medlemVevent
+    veventDict['DTSTAMP'] = None
 
     veventDict['END'] = 'VEVENT'
 
     return veventDict
 
 
-def downloadICal(medlem, korNavn):
+def getBaseVevents(hendelser):
     '''
-    Denne funksjonen returne basert på hendelseQueryset og medlem, en ical download response. 
-    Den håndterer generering av gyldig ical content, med hjelp fra getVeventFromHendelse
+    Basene til hendelsene som {hendelse pk: dict}, fra cachen. De som mangler lages og caches, 
+    med de inviterte til alle undergruppe hendelsene i én spørring. 
     '''
-    iCalString = f'''\
-BEGIN:VCALENDAR
-PRODID:-//mytxs.samfundet.no//MyTXS semesterplan//
-VERSION:2.0
-CALSCALE:GREGORIAN
-METHOD:PUBLISH
-X-WR-CALNAME:{korNavn} semesterplan (iCal)
-X-WR-CALDESC:Denne kalenderen ble oppdatert av MyTXS {
-datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S')}Z
-X-WR-TIMEZONE:Europe/Oslo
-BEGIN:VTIMEZONE
-TZID:Europe/Oslo
-X-LIC-LOCATION:Europe/Oslo
-BEGIN:DAYLIGHT
-TZOFFSETFROM:+0100
-TZOFFSETTO:+0200
-TZNAME:CEST
-DTSTART:19700329T020000
-RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU
-END:DAYLIGHT
-BEGIN:STANDARD
-TZOFFSETFROM:+0200
-TZOFFSETTO:+0100
-TZNAME:CET
-DTSTART:19701025T030000
-RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU
-END:STANDARD
-END:VTIMEZONE
-'''
-    for hendelse in medlem.getHendelser(korNavn):
-        for key, value in getVeventFromHendelse(hendelse, medlem).items():
-            if value:
-                iCalString += key + ':' + value + '\n'
-
-    iCalString += 'END:VCALENDAR\n'
-
-    # Split lines som e lenger enn 75 characters over fleir linja
-    iCalLines = iCalString.split('\n')
-    l = 0
-    while l < len(iCalLines):
-        if len(iCalLines[l]) > 75:
-            iCalLines.insert(l+1, ' ' + iCalLines[l][75:])
-            iCalLines[l] = iCalLines[l][:75]
-        l += 1
-
-    # Join alle lines med CRLF
-    iCalString = '\r\n'.join(iCalLines)
-
-    return downloadFile(f'{korNavn} semesterplan (iCal).ics', iCalString, content_type='text/calendar')
+    Hendelse = apps.get_model('mytxs', 'Hendelse')
+    Medlem = apps.get_model('mytxs', 'Medlem')
+    Oppmøte = apps.get_model('mytxs', 'Oppmøte')
+
+    baser = cache.get_many([veventKey(hendelse.pk) for hendelse in hendelser])
+    if mangler := [hendelse for hendelse in hendelser if veventKey(hendelse.pk) not in baser]:
+        inviterte = {}
+        for oppmøte in Oppmøte.objects.filter(
+            hendelse__in=[hendelse for hendelse in mangler if hendelse.kategori == Hendelse.UNDERGRUPPE]
+        ).select_related('medlem').order_by(*[f'-medlem__{f[1:]}' if f.startswith('-') else f'medlem__{f}' for f in Medlem._meta.ordering]):
+            inviterte.setdefault(oppmøte.hendelse_id, []).append(oppmøte.medlem)
+
+        nye = {veventKey(hendelse.pk): lagBaseVevent(hendelse, inviterte=inviterte.get(hendelse.pk, [])) for hendelse in mangler}
+        cache.set_many(nye, VEVENT_TIMEOUT)
+        baser.update(nye)
+    return {hendelse.pk: baser[veventKey(hendelse.pk)] for hendelse in hendelser}
+
+
+def medlemVevent(base, hendelse, medlem, oppmøte):
+    'Kopi av basen med det som er unikt for medlemmet: lenke til fraværet (gitt oppmøtet deres) og DTSTAMP'
+    Hendelse = apps.get_model('mytxs', 'Hendelse')
+
+    veventDict = dict(base)
+    if hendelse.kategori != Hendelse.UNDERGRUPPE and hendelse.pk and oppmøte and oppmøte.fraværTekst:
+        veventDict['DESCRIPTION'] = '\\n\\n'.join([beskrivelse for beskrivelse in [
+            base['DESCRIPTION'],
+            oppmøte.fraværTekst + ': ' + mytxsSettings.ALLOWED_HOSTS[0] + unquote(reverse('meldFravær', args=[medlem.pk, hendelse.pk]))
+        ] if beskrivelse])
+    veventDict['DTSTAMP'] = dateToICal(datetime.datetime.now(datetime.timezone.utc)) + 'Z'
+    return veventDict
+
+
+def getVeventFromHendelse(hendelse, medlem, hendelsePK=None):
+    'Genererer en dictionary med keys og values tilsvarende en iCal hendelse for medlemmet, uten cachen. For mange, bruk medlemVevents.'
+    oppmøte = hendelse.oppmøter.filter(medlem=medlem).first() if hendelse.pk else None
+    return medlemVevent(lagBaseVevent(hendelse, hendelsePK), hendelse, medlem, oppmøte)
+
+
+def medlemVevents(medlem, korNavn, chunkSize=500):
+    '''
+    Generere (hendelse, veventDict) for hendelsene medlemmet har i koret, av de cachede basene og oppmøtene til 
+    medlemmet. Hendelsene hentes i chunks, så antall spørringer ikke avhenger av antall hendelser. 
+    '''
+    Oppmøte = apps.get_model('mytxs', 'Oppmøte')
+
+    hendelser = medlem.getHendelser(korNavn).select_related('kor').prefetch_related(
+        Prefetch('oppmøter', queryset=Oppmøte.objects.filter(medlem=medlem), to_attr='medlemOppmøter')
+    )
+
+    chunk = []
+    for hendelse in hendelser.iterator(chunk_size=chunkSize):
+        chunk.append(hendelse)
+        if len(chunk) == chunkSize:
+            yield from medlemVeventsChunk(chunk, medlem)
+            chunk = []
+    yield from medlemVeventsChunk(chunk, medlem)
+
+
+def medlemVeventsChunk(hendelser, medlem):
+    baser = getBaseVevents(hendelser)
+    for hendelse in hendelser:
+        yield hendelse, medlemVevent(baser[hendelse.pk], hendelse, medlem, next(iter(hendelse.medlemOppmøter), None))
+
+
+ICAL_TIDSSONE = [
+    'X-WR-TIMEZONE:Europe/Oslo',
+    'BEGIN:VTIMEZONE',
+    'TZID:Europe/Oslo',
+    'X-LIC-LOCATION:Europe/Oslo',
+    'BEGIN:DAYLIGHT',
+    'TZOFFSETFROM:+0100',
+    'TZOFFSETTO:+0200',
+    'TZNAME:CEST',
+    'DTSTART:19700329T020000',
+    'RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU',
+    'END:DAYLIGHT',
+    'BEGIN:STANDARD',
+    'TZOFFSETFROM:+0200',
+    'TZOFFSETTO:+0100',
+    'TZNAME:CET',
+    'DTSTART:19701025T030000',
+    'RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU',
+    'END:STANDARD',
+    'END:VTIMEZONE'
+]
+
+
+def foldICalLinje(linje):
+    '''
+    Returne linja med CRLF, delt over fleir linjer som starte med mellomrom om den e lenger enn 75 oktetter. 
+    Deles mellom tegn, så vi ikke dele et tegn som tar fleir oktetter i UTF-8 (RFC 5545 3.1). 
+    '''
+    oktetter = linje.encode()
+    if len(oktetter) <= 75:
+        return linje + '\r\n'
+
+    deler = []
+    start, maks = 0, 75
+    while len(oktetter) - start > maks:
+        slutt = start + maks
+        # Oktetter på formen 10xxxxxx er fortsettelsen av et tegn
+        while oktetter[slutt] & 0xC0 == 0x80:
+            slutt -= 1
+        deler.append(oktetter[start:slutt])
+        # Mellomrommet foran fortsettelsen telles med
+        start, maks = slutt, 74
+    deler.append(oktetter[start:])
+    return b'\r\n '.join(deler).decode() + '\r\n'
+
+
+def iCalLinjer(medlem, korNavn):
+    '''
+    Generere ical innholdet til medlemmet i koret, én hendelse om gangen, så det kan streames. 
+    Hendelsene kommer fra medlemVevents, så antall spørringer ikke avhenger av antall hendelser. 
+    '''
+    yield ''.join(map(foldICalLinje, [
+        'BEGIN:VCALENDAR',
+        'PRODID:-//mytxs.samfundet.no//MyTXS semesterplan//',
+        'VERSION:2.0',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{korNavn} semesterplan (iCal)',
+        f'X-WR-CALDESC:Denne kalenderen ble oppdatert av MyTXS {datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")}Z',
+        *ICAL_TIDSSONE
+    ]))
+
+    for hendelse, veventDict in medlemVevents(medlem, korNavn):
+        yield ''.join(
+            # Linjeskift som ikke allerede er escapa ville brutt formatet
+            foldICalLinje(key + ':' + value.replace('\r\n', '\\n').replace('\n', '\\n'))
+            for key, value in veventDict.items() if value
+        )
+
+    yield foldICalLinje('END:VCALENDAR')
+
+
+def lagICal(medlem, korNavn):
+    'ical innholdet til medlemmet i koret som en streng, se iCalLinjer'
+    return ''.join(iCalLinjer(medlem, korNavn))
+
+
+def downloadICal(medlem, korNavn, iCal=None):
+    'Returne en ical download response med iCal, som kan vær en streng eller en generator. Uten iCal streames iCalLinjer.'
+    if iCal == None:
+        iCal = iCalLinjer(medlem, korNavn)
+    return downloadFile(f'{korNavn} semesterplan (iCal).ics', iCal, content_type='text/calendar')
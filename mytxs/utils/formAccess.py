@@ -101,7 +101,8 @@ def disableFormMedlem(medlem, form):
             disableFields(form)
             return False
 
-        # Ellers, gå gjennom instance for instance
+        # Ellers, gå gjennom instance for instance, etter å ha sjekket tilgangen til alle med ett oppslag
+        medlem.hentRedigerTilganger([formet.instance for formet in form.forms])
         anyNotDisabled = False
         for formet in form.forms:
             if disableFormMedlem(medlem, formet):
@@ -0,0 +1,142 @@
+import hashlib
+import re
+import time
+import urllib.parse
+
+import certifi
+import urllib3
+urllib3.util.connection.HAS_IPV6 = False
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Func, Q, Value as V
+from django.db.models.functions import Lower, Trim
+from django.utils.module_loading import import_string
+
+from mytxs.utils.jobbUtils import jobb
+from mytxs.utils.kart import oppdaterKartPunkter
+
+# Geokoding av adresser til sjekkheftekartet. Koordinatene caches i Geokode tabellen, og adresser vi ikke har sett
+# før slås opp av en jobb i bakgrunnen, så lagring av et medlem aldri venter på nettverket. Når jobben har funnet
+# koordinatene oppdateres dbCache til medlemmene med adressen. Hvem som slår opp styres av settings.GEOKODER.
+
+def normaliserAdresse(adresse):
+    'Adressen slik den lagres i Geokode, med små bokstaver og uten ekstra mellomrom'
+    return re.sub(r'\s+', ' ', adresse.strip().lower())
+
+
+def normalisertAdresse(felt):
+    'Som normaliserAdresse, men som et database uttrykk for et felt'
+    return Func(Lower(Trim(felt)), V(r'\s+'), V(' '), V('g'), function='regexp_replace')
+
+
+class Geokoder:
+    '''
+    Grensesnittet til en geokoder. slåOpp tar en liste normaliserte adresser, og yielde (adresse, cord) for hver av dem
+    etterhvert som de slås opp, der cord er {"lat": ..., "lon": ...} eller None om adressen ikke finnes. Ved feil som
+    kan gå over av seg selv (nettverk, rate limiting) raises et exception, så jobben prøves igjen seinere.
+    '''
+    def slåOpp(self, adresser):
+        raise NotImplementedError
+
+
+class GeonorgeGeokoder(Geokoder):
+    'Slår opp i adresse APIet til Kartverket, én adresse om gangen med minst settings.GEOKODER_INTERVALL sekund mellom'
+
+    http = urllib3.PoolManager(
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=certifi.where(),
+        timeout=urllib3.Timeout(5),
+        retries=urllib3.Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+        maxsize=2
+    )
+    'Deles av alle oppslag i prosessen, så forbindelsen gjenbrukes'
+
+    def slåOpp(self, adresser):
+        forrige = 0
+        for adresse in adresser:
+            time.sleep(max(0, forrige + settings.GEOKODER_INTERVALL - time.monotonic()))
+            forrige = time.monotonic()
+
+            svar = self.http.request('GET', 'https://ws.geonorge.no/adresser/v1/sok?treffPerSide=1&sok=' + urllib.parse.quote(adresse))
+            if svar.status != 200:
+                raise Exception(f'Geonorge svarte {svar.status} på "{adresse}"')
+
+            if treff := svar.json()['adresser']:
+                punkt = treff[0]['representasjonspunkt']
+                yield adresse, {'lat': punkt['lat'], 'lon': punkt['lon']}
+            else:
+                yield adresse, None
+
+
+class OfflineGeokoder(Geokoder):
+    '''
+    Geokoder uten nettverk, for testing. Alle adresser finnes, med koordinater i Trondheim utledet fra adressen,
+    bortsett fra de som inneholder "ukjent". Adressene som slås opp legges i oppslag.
+    '''
+    oppslag = []
+
+    def slåOpp(self, adresser):
+        for adresse in adresser:
+            self.oppslag.append(adresse)
+            if 'ukjent' in adresse:
+                yield adresse, None
+                continue
+            hash = int(hashlib.sha1(adresse.encode()).hexdigest(), 16)
+            yield adresse, {'lat': 63.4 + hash % 1000 / 10_000, 'lon': 10.4 + hash // 1000 % 1000 / 10_000}
+
+
+def hentCord(adresse):
+    '''
+    Koordinatene til adressen fra Geokode, eller None. Om adressen ikke er slått opp før legges den til i
+    jobbkøen, og medlemmene med adressen får koordinatene når jobben har kjørt.
+    '''
+    if not adresse:
+        return None
+    Geokode = apps.get_model('mytxs', 'Geokode')
+    adresse = normaliserAdresse(adresse)
+
+    if not (geokode := Geokode.objects.filter(adresse=adresse).first()):
+        try:
+            geokod([adresse])
+        except Exception:
+            # Kan bare skje under testing og seeding, der jobben kjøre direkte. Lagringen skal ikke feile av den grunn. 
+            pass
+        # Om jobben kjørte direkte har vi svaret allerede
+        geokode = Geokode.objects.filter(adresse=adresse).first()
+    return geokode.cord if geokode else None
+
+
+@jobb(slåSammen=lambda argumenterListe: {'args': [sorted({a for argumenter in argumenterListe for a in argumenter['args'][0]})], 'kwargs': {}})
+def geokod(adresser):
+    '''
+    Slå opp adressene som ikke allerede er i Geokode, lagre dem, og oppdater dbCache til medlemmene med adressene.
+    Det som ble slått opp lagres selv om geokoderen feiler underveis, så et nytt forsøk bare tar resten.
+    '''
+    Geokode = apps.get_model('mytxs', 'Geokode')
+    Medlem = apps.get_model('mytxs', 'Medlem')
+
+    adresser = set(adresser) - set(Geokode.objects.filter(adresse__in=adresser).values_list('adresse', flat=True))
+    if not adresser:
+        return
+
+    funnet = {}
+    try:
+        for adresse, cord in import_string(settings.GEOKODER)().slåOpp(sorted(adresser)):
+            funnet[adresse] = cord
+    finally:
+        Geokode.objects.bulk_create(
+            [Geokode(adresse=adresse, cord=cord) for adresse, cord in funnet.items()],
+            update_conflicts=True, unique_fields=['adresse'], update_fields=['cord', 'oppdatert']
+        )
+
+        medlemmer = list(Medlem.objects.alias(
+            bo=normalisertAdresse('boAdresse'),
+            foreldre=normalisertAdresse('foreldreAdresse')
+        ).filter(Q(bo__in=list(funnet)) | Q(foreldre__in=list(funnet))))
+
+        for medlem in medlemmer:
+            medlem.boAdresseCord(run=True)
+            medlem.foreldreAdresseCord(run=True)
+        Medlem.objects.bulk_update(medlemmer, ['dbCacheField'])
+        oppdaterKartPunkter(medlemmer)
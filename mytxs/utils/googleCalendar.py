@@ -2,9 +2,13 @@ import datetime
 import os
 from time import sleep
 
+from django.apps import apps
+from django.core.cache import cache
+
 from mytxs import consts
-from mytxs.utils.downloadUtils import getVeventFromHendelse
-from mytxs.utils.threadUtils import NoMailException, thread
+from mytxs.utils.downloadUtils import lagBaseVevent, medlemVevent, medlemVevents
+from mytxs.utils.jobbUtils import jobb
+from mytxs.utils.threadUtils import NoMailException
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -31,11 +35,30 @@ def exponentialBackoff(func):
     return _decorator
 
 
+BATCH_STØRRELSE = 50
+'Maks antall operasjoner per request til batch endepunktet til Google Calendar'
+
+KALENDERE_SYNKET_KEY = 'googleKalendereSynket'
+KALENDERE_SYNKET_TIMEOUT = 60 * 60 * 24
+'''
+Hvor lenge vi stole på at GoogleKalender har alle kalenderne etter synkKalendere. Kalendere vi oppretter lagres 
+med en gang, og fixGoogleCalendar synkroniserer hver time, så dette e bare en sikkerhet. 
+'''
+
 class GoogleCalendarManager:
-    'Denne raise diverse exceptions om den ikkje kan instansieres.'
-    def __init__(self, requestCountDown=None):
+    '''
+    Denne raise diverse exceptions om den ikkje kan instansieres. service kan gis for å slippe Google under testing.
+
+    createEvent, updateEvent og deleteEvent legges i en kø, og sendes av sendBatch gjennom batch endepunktet, med 
+    BATCH_STØRRELSE operasjoner per request. Kalender idene og event idene slås opp i GoogleKalender og GoogleHendelse, 
+    heller enn å liste alle kalenderne eller søke etter eventen for hver endring. 
+    '''
+    def __init__(self, requestCountDown=None, service=None):
         self.requestCountDown = requestCountDown
-        self.service = None
+        self.kø = []
+        self.service = service
+        if service:
+            return
         creds = None
         SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
@@ -91,7 +114,9 @@ class GoogleCalendarManager:
 
     @exponentialBackoff
     def deleteCalendar(self, calendarId):
-        return self.service.calendars().delete(calendarId=calendarId).execute()
+        self.service.calendars().delete(calendarId=calendarId).execute()
+        # Tar med seg GoogleHendelse radene til kalenderen
+        apps.get_model('mytxs', 'GoogleKalender').objects.filter(calendarId=calendarId).delete()
 
     @exponentialBackoff
     def getCalendarList(self):
@@ -103,35 +128,185 @@ class GoogleCalendarManager:
 
     @exponentialBackoff
     def getEventId(self, calendarId, UID):
-        return self.service.events().list(calendarId=calendarId, privateExtendedProperty=[f'UID={UID}']).execute().get('items', [])[0]['id']
+        'Søk etter eventen hos Google, for events som ikke er i GoogleHendelse. Returne None om den ikke finnes.'
+        if items := self.service.events().list(calendarId=calendarId, privateExtendedProperty=[f'UID={UID}']).execute().get('items', []):
+            return items[0]['id']
 
     @exponentialBackoff
+    def executeBatch(self, requests):
+        'Kjøre requestene i én batch request, og returne en liste av (response, exception) i samme rekkefølge'
+        svar = {}
+        batch = self.service.new_batch_http_request()
+        for i, request in enumerate(requests):
+            batch.add(request, callback=lambda requestId, response, exception: svar.__setitem__(int(requestId), (response, exception)), request_id=str(i))
+        batch.execute()
+        return [svar[i] for i in range(len(requests))]
+
     def createEvent(self, calendarId, body):
-        return self.service.events().insert(calendarId=calendarId, body=body).execute()
+        self.kø.append(('create', calendarId, body['extendedProperties']['private']['UID'], body))
 
-    @exponentialBackoff
     def updateEvent(self, calendarId, body):
-        eventId = self.getEventId(calendarId, body['extendedProperties']['private']['UID'])
-        return self.service.events().update(calendarId=calendarId, eventId=eventId, body=body).execute()
+        self.kø.append(('update', calendarId, body['extendedProperties']['private']['UID'], body))
 
-    @exponentialBackoff
     def deleteEvent(self, calendarId, UID):
-        return self.service.events().delete(calendarId=calendarId, eventId=self.getEventId(calendarId, UID)).execute()
+        self.kø.append(('delete', calendarId, UID, None))
+
+    def getEventIds(self, calendarUIDs):
+        '''
+        Returne en dictionary som mappe fra (calendarId, UID) til eventId, fra GoogleHendelse. De som mangler 
+        (events fra før tabellen fantes) søkes etter hos Google og lagres, de som ikke finnes der heller utelates.
+        '''
+        GoogleHendelse = apps.get_model('mytxs', 'GoogleHendelse')
+        eventIds = {
+            (calendarId, UID): eventId for calendarId, UID, eventId in GoogleHendelse.objects.filter(
+                kalender_id__in={calendarId for calendarId, UID in calendarUIDs},
+                UID__in={UID for calendarId, UID in calendarUIDs}
+            ).values_list('kalender_id', 'UID', 'eventId') if (calendarId, UID) in calendarUIDs
+        }
+        funnet = {}
+        for calendarId, UID in calendarUIDs - eventIds.keys():
+            if eventId := self.getEventId(calendarId, UID):
+                funnet[(calendarId, UID)] = eventId
+        self.lagreEventIds(funnet)
+        return eventIds | funnet
+
+    def lagreEventIds(self, eventIds):
+        'Lagre {(calendarId, UID): eventId} i GoogleHendelse, for kalendere vi har i GoogleKalender'
+        GoogleKalender = apps.get_model('mytxs', 'GoogleKalender')
+        GoogleHendelse = apps.get_model('mytxs', 'GoogleHendelse')
+        if not eventIds:
+            return
+        kalendere = set(GoogleKalender.objects.filter(
+            calendarId__in={calendarId for calendarId, UID in eventIds}
+        ).values_list('calendarId', flat=True))
+        GoogleHendelse.objects.bulk_create(
+            [GoogleHendelse(kalender_id=calendarId, UID=UID, eventId=eventId) for (calendarId, UID), eventId in eventIds.items() if calendarId in kalendere],
+            update_conflicts=True,
+            unique_fields=['kalender', 'UID'],
+            update_fields=['eventId']
+        )
+
+    def slettEventIds(self, calendarUIDs):
+        GoogleHendelse = apps.get_model('mytxs', 'GoogleHendelse')
+        kalendere = {}
+        for calendarId, UID in calendarUIDs:
+            kalendere.setdefault(calendarId, []).append(UID)
+        for calendarId, UIDs in kalendere.items():
+            GoogleHendelse.objects.filter(kalender_id=calendarId, UID__in=UIDs).delete()
+
+    def sendBatch(self):
+        '''
+        Send operasjonene i køen gjennom batch endepunktet, og hold GoogleHendelse oppdatert. Operasjoner som 
+        rate limites prøves igjen med exponential backoff, oppdateringer av events som mangler opprettes, og 
+        sletting av events som mangler ignoreres. 
+        '''
+        kø, self.kø = self.kø, []
+        eventIds = self.getEventIds({(calendarId, UID) for handling, calendarId, UID, body in kø if handling != 'create'})
+
+        attempt = 0
+        while kø:
+            operasjoner = []
+            for handling, calendarId, UID, body in kø:
+                eventId = eventIds.get((calendarId, UID))
+                if handling == 'update' and not eventId:
+                    handling = 'create'
+                if handling == 'create':
+                    operasjoner.append((handling, calendarId, UID, body, self.service.events().insert(calendarId=calendarId, body=body)))
+                elif handling == 'update':
+                    operasjoner.append((handling, calendarId, UID, body, self.service.events().update(calendarId=calendarId, eventId=eventId, body=body)))
+                elif eventId:
+                    operasjoner.append((handling, calendarId, UID, body, self.service.events().delete(calendarId=calendarId, eventId=eventId)))
+
+            kø, opprettet, slettet, feil, rateLimited = [], {}, set(), [], False
+            for i in range(0, len(operasjoner), BATCH_STØRRELSE):
+                batch = operasjoner[i:i+BATCH_STØRRELSE]
+                for (handling, calendarId, UID, body, request), (response, exception) in zip(batch, self.executeBatch([o[-1] for o in batch])):
+                    if not exception:
+                        if handling == 'create':
+                            opprettet[(calendarId, UID)] = response['id']
+                        elif handling == 'delete':
+                            slettet.add((calendarId, UID))
+                    elif not isinstance(exception, HttpError):
+                        feil.append(exception)
+                    elif exception.status_code in [403, 429] or exception.status_code >= 500:
+                        kø.append((handling, calendarId, UID, body))
+                        rateLimited = True
+                    elif exception.status_code in [404, 410] and handling == 'update':
+                        # Eventen er slettet hos Google, så vi oppretter den på nytt
+                        eventIds.pop((calendarId, UID))
+                        kø.append((handling, calendarId, UID, body))
+                    elif exception.status_code in [404, 410] and handling == 'delete':
+                        slettet.add((calendarId, UID))
+                    else:
+                        feil.append(exception)
+
+            self.lagreEventIds(opprettet)
+            self.slettEventIds(slettet)
+            eventIds.update(opprettet)
+
+            if feil:
+                raise feil[0]
+            if rateLimited:
+                if attempt >= 5:
+                    raise NoMailException(f'Google Calendar batch failed for {len(kø)} operations.')
+                sleep(2**attempt)
+                attempt += 1
+
+    def lagreKalender(self, korNavn, medlem, calendarId):
+        'Lagre kalenderen til medlemmet i koret i GoogleKalender'
+        GoogleKalender = apps.get_model('mytxs', 'GoogleKalender')
+        Kor = apps.get_model('mytxs', 'Kor')
+        kor = Kor.objects.get(navn=korNavn)
+        GoogleKalender.objects.filter(kor=kor, medlem=medlem).exclude(calendarId=calendarId).delete()
+        GoogleKalender.objects.get_or_create(kor=kor, medlem=medlem, calendarId=calendarId)
+
+    def synkKalendere(self, calendarList=None):
+        '''
+        Synkroniser GoogleKalender med kalenderne hos Google, fra ett getCalendarList kall: kalendere som mangler 
+        legges til, og rader for kalendere som ikke finnes lenger slettes. Markere tabellen som synkronisert. 
+        '''
+        GoogleKalender = apps.get_model('mytxs', 'GoogleKalender')
+        Kor = apps.get_model('mytxs', 'Kor')
+        Medlem = apps.get_model('mytxs', 'Medlem')
+
+        if calendarList == None:
+            calendarList = self.getCalendarList()
+
+        GoogleKalender.objects.exclude(calendarId__in=[calendar['id'] for calendar in calendarList]).delete()
+
+        korPKs = dict(Kor.objects.values_list('navn', 'pk'))
+        kalendere = {}
+        for calendar in calendarList:
+            # Description er "<korNavn>-<medlem pk>", se getOrCreateAndShareCalendar
+            korNavn, _, medlemPK = calendar.get('description', '').partition('-')
+            if korNavn in korPKs and medlemPK.isdigit():
+                kalendere.setdefault((korPKs[korNavn], int(medlemPK)), calendar['id'])
+        medlemPKs = set(Medlem.objects.filter(pk__in={medlemPK for korPK, medlemPK in kalendere}).values_list('pk', flat=True))
+        GoogleKalender.objects.bulk_create([
+            GoogleKalender(kor_id=korPK, medlem_id=medlemPK, calendarId=calendarId) 
+            for (korPK, medlemPK), calendarId in kalendere.items() if medlemPK in medlemPKs
+        ], ignore_conflicts=True)
+
+        cache.set(KALENDERE_SYNKET_KEY, True, KALENDERE_SYNKET_TIMEOUT)
 
     def getCalendarIDs(self, korNavn, medlemmer):
-        'Returne en dicitonary som mappe fra medlem til google kalender id'
-        calendars = {}
-        for calendar in self.getCalendarList():
-            if not calendar.get('description', ''):
-                # Dette vil være tilfelle for google brukeren sin (uslettelige) personal calendar
-                continue
-            if calendar.get('description', '').split('-')[0] != korNavn:
-                continue
-            medlemPK = int(calendar.get('description', '').split('-')[1])
-            for medlem in medlemmer:
-                if medlem.pk == medlemPK:
-                    calendars[medlem] = calendar['id']
-        return calendars
+        '''
+        Returne en dicitonary som mappe fra medlem til google kalender id, fra GoogleKalender. Om noen mangler og 
+        tabellen ikke er synkronisert nylig synkroniseres den først, så vi ikke hoppe over kalendere vi ikke vet om. 
+        '''
+        GoogleKalender = apps.get_model('mytxs', 'GoogleKalender')
+
+        def fraTabellen():
+            return dict(GoogleKalender.objects.filter(
+                kor__navn=korNavn,
+                medlem__in=medlemmer
+            ).values_list('medlem_id', 'calendarId'))
+
+        calendarIds = fraTabellen()
+        if any(medlem.pk not in calendarIds for medlem in medlemmer) and not cache.get(KALENDERE_SYNKET_KEY):
+            self.synkKalendere()
+            calendarIds = fraTabellen()
+        return {medlem: calendarIds[medlem.pk] for medlem in medlemmer if medlem.pk in calendarIds}
 
 
 def iCalDateTimeToISO(dateTimeStr, addTimeDelta=None):
@@ -188,7 +363,7 @@ def getHendelseBody(veventDict):
     return body
 
 
-@thread
+@jobb
 def getOrCreateAndShareCalendar(korNavn, medlem, gmail):
     gCalManager = GoogleCalendarManager(requestCountDown=200)
 
@@ -199,17 +374,19 @@ def getOrCreateAndShareCalendar(korNavn, medlem, gmail):
         return
 
     calendarId = gCalManager.createCalendar(f'{korNavn} semesterplan', f'{korNavn}-{medlem.pk}')
+    gCalManager.lagreKalender(korNavn, medlem, calendarId)
 
     gCalManager.shareCalendar(calendarId, gmail)
 
-    for hendelse in medlem.getHendelser(korNavn):
+    for hendelse, vevent in medlemVevents(medlem, korNavn):
         gCalManager.createEvent(
             calendarId,
-            getHendelseBody(getVeventFromHendelse(hendelse, medlem))
+            getHendelseBody(vevent)
         )
+    gCalManager.sendBatch()
 
 
-@thread
+@jobb
 def updateGoogleCalendar(hendelse, changed=False, oldMedlemmer=[], newMedlemmer=[], hendelsePK=None):
     'Oppdatere Google Calendar gitt liste av gamle og nye medlemmer. hendelsePK til bruk ved sletting.'
     gCalManager = GoogleCalendarManager(requestCountDown=200)
@@ -220,8 +397,12 @@ def updateGoogleCalendar(hendelse, changed=False, oldMedlemmer=[], newMedlemmer=
     else:
         medlemCalendars = gCalManager.getCalendarIDs(hendelse.kor.navn, oldMedlemmer+newMedlemmer)
     
+    # Basen lages én gang for alle medlemmene, uten cachen siden jobben kan kjøre etter en nyere lagring av hendelsen
+    base = lagBaseVevent(hendelse, hendelsePK=hendelsePK)
+    oppmøter = {oppmøte.medlem_id: oppmøte for oppmøte in hendelse.oppmøter.all()} if hendelse.pk else {}
+
     for medlem, calendarId in medlemCalendars.items():
-        vevent = getVeventFromHendelse(hendelse, medlem, hendelsePK=hendelsePK)
+        vevent = medlemVevent(base, hendelse, medlem, oppmøter.get(medlem.pk))
         old = medlem in oldMedlemmer
         new = medlem in newMedlemmer
         if new and not old:
@@ -239,3 +420,5 @@ def updateGoogleCalendar(hendelse, changed=False, oldMedlemmer=[], newMedlemmer=
                 calendarId, 
                 vevent['UID']
             )
+
+    gCalManager.sendBatch()
@@ -0,0 +1,100 @@
+import datetime
+import hashlib
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+
+from mytxs import consts
+
+# iCal kalenderen til hvert medlem og kor, som pollers av kalenderklientene. Den genererte kalenderen caches per
+# (medlem, kor) med en hash av innholdet, som serves som ETag av iCal viewet, så uendrede kalendere får 304 uten at
+# vi rør Hendelse. Cachen er gyldig så lenge versjonene til korene og medlemmet er de samme, og de bumpes av
+# iCalSignals.py når en hendelse i koret, eller medlemmet sine oppmøter eller verv, endres. Dagens dato er med
+# fordi fraværteksten avhenger av den. Første henting etter en endring streames og caches underveis av cacheICal.
+
+ICAL_TIMEOUT = 60 * 60 * 24 * 2
+
+VERSJON_TIMEOUT = 60 * 60
+'''
+Hvor lenge versjonene lever. Bumpen må nå alle prosessene, så cachen må vær delt (se CACHES i settings.py), men 
+om den ikke er det serves en utdatert kalender ihvertfall ikke i mer enn en time. En versjon som går ut gir bare 
+at kalenderen genereres på nytt, og lagreICal beholder ETagen om innholdet er likt, så klientene får fortsatt 304. 
+'''
+
+def iCalKorKey(korPK):
+    return f'iCalKorVersjon-{korPK}'
+
+
+def iCalMedlemKey(medlemPK):
+    return f'iCalMedlemVersjon-{medlemPK}'
+
+
+def bumpICalVersjoner(korPKs=[], medlemPKs=[]):
+    versjon = time.time_ns()
+    cache.set_many({
+        **{iCalKorKey(pk): versjon for pk in korPKs},
+        **{iCalMedlemKey(pk): versjon for pk in medlemPKs}
+    }, VERSJON_TIMEOUT)
+
+
+def getICalVersjon(medlem, korNavn):
+    '''
+    Versjonen til kalenderen: dagens dato og versjonene til korene og medlemmet satt sammen. 
+    Versjoner som mangler i cachen settes, så de ikke treffer en gammel kalender. 
+    '''
+    Kor = apps.get_model('mytxs', 'Kor')
+    # Sangern hendelser havner i storkor kalenderen, se Medlem.getHendelser
+    korPKs = Kor.objects.filter(
+        navn__in=[korNavn, consts.Kor.Sangern] if korNavn in consts.bareStorkorNavn else [korNavn]
+    ).order_by('pk').values_list('pk', flat=True)
+
+    keys = [iCalKorKey(pk) for pk in korPKs] + [iCalMedlemKey(medlem.pk)]
+    versjoner = cache.get_many(keys)
+    if mangler := {key: time.time_ns() for key in keys if key not in versjoner}:
+        cache.set_many(mangler, VERSJON_TIMEOUT)
+        versjoner.update(mangler)
+    return f'{datetime.date.today()}-' + '-'.join(str(versjoner[key]) for key in keys)
+
+
+def iCalHash(iCalString):
+    'Hash av innholdet, uten tidsstemplene som endres hver gang kalenderen genereres'
+    return hashlib.sha1('\n'.join(
+        linje for linje in iCalString.replace('\r\n ', '').split('\r\n') if not linje.startswith(('DTSTAMP:', 'X-WR-CALDESC:'))
+    ).encode()).hexdigest()
+
+
+def iCalKey(medlem, korNavn):
+    return f'iCal-{medlem.pk}-{korNavn}'
+
+
+def getCachetICal(medlem, korNavn, versjon):
+    '''
+    Den cachede kalenderen til medlemmet i koret som {"iCal": str, "etag": str, "sistEndret": int}, der sistEndret 
+    er et unix timestamp, eller None om den ikke er cachet med denne versjonen. 
+    '''
+    if (data := cache.get(iCalKey(medlem, korNavn))) and data['versjon'] == versjon:
+        return data
+
+
+def lagreICal(medlem, korNavn, versjon, iCalString):
+    'Cache kalenderen med versjonen, og returne dataen som getCachetICal'
+    data = cache.get(iCalKey(medlem, korNavn))
+    etag = iCalHash(iCalString)
+    if data and data['etag'] == etag:
+        # Ingenting har endret seg for dette medlemmet, så vi beholder den gamle kalenderen og ETagen
+        data['versjon'] = versjon
+    else:
+        data = {'versjon': versjon, 'iCal': iCalString, 'etag': etag, 'sistEndret': int(time.time())}
+    cache.set(iCalKey(medlem, korNavn), data, ICAL_TIMEOUT)
+    return data
+
+
+def cacheICal(medlem, korNavn, versjon, deler):
+    'Yielde delene av kalenderen videre, og cache den med lagreICal når alt er generert'
+    iCal = []
+    for iCalDel in deler:
+        iCal.append(iCalDel)
+        yield iCalDel
+    lagreICal(medlem, korNavn, versjon, ''.join(iCal))
+
@@ -0,0 +1,235 @@
+import datetime
+import hashlib
+import json
+import sys
+import time
+import traceback
+
+from django.apps import apps
+from django.conf import settings
+from django.core import mail, serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from mytxs.utils.loggUtils import samleLogger
+from mytxs.utils.threadUtils import THREAD_LOCAL, NoMailException, thread
+
+# Jobbkøen e en tabell (Jobb) i databasen, slik at arbeid som skal gjøres etter et request ikke forsvinn om
+# prosessen dør. Requests legg jobber i køen, og kjøre dem etter responsen i en thread som før. Det som ikke
+# blir kjørt der plukkes opp av jobbWorker kommandoen, eller cron om ingen worker kjøre.
+
+MAKS_FORSØK = 5
+'Antall forsøk før en jobb markeres som feilet'
+
+KJØRER_TIMEOUT = datetime.timedelta(hours=1)
+'Hvor lenge en jobb kan stå som kjører før vi anntar at prosessen døde, og kjøre den på nytt'
+
+
+jobbFunksjoner = {}
+'Alle funksjoner med @jobb, fra import path til den dekorerte funksjonen'
+
+def jobb(func=None, slåSammen=None):
+    '''
+    Decorator som gjør at funksjonen legges i jobbkøen heller enn å kjøres direkte. Argumentene må vær json,
+    modellinstanser (lagres som et øyeblikksbilde) eller lister og dicts av disse.
+
+    slåSammen e en funksjon som tar en liste av serialiserte argumenter ({"args": [...], "kwargs": {...}})
+    og returne ett. Da slås alle jobbene til funksjonen fra et request sammen til én, se slåSammenJobber.
+
+    Som med thread kjøre vi direkte under testing og seeding.
+    '''
+    if not func:
+        return lambda func: jobb(func, slåSammen=slåSammen)
+
+    def _decorator(*args, **kwargs):
+        if 'test' in sys.argv or 'seed' in sys.argv:
+            return func(*args, **kwargs)
+        leggTilJobb(func, *args, **kwargs)
+    _decorator.direkte = func
+    _decorator.slåSammen = slåSammen
+    _decorator.__name__ = func.__name__
+    _decorator.__module__ = func.__module__
+
+    jobbFunksjoner[f'{func.__module__}.{func.__name__}'] = _decorator
+    return _decorator
+
+
+def serialiser(verdi):
+    'Gjør argumentene til en jobb om til json, modellinstanser blir et øyeblikksbilde via djangos serializer.'
+    if isinstance(verdi, models.Model):
+        return {'instans': json.loads(serializers.serialize('json', [verdi]))[0]}
+    if isinstance(verdi, (list, tuple)):
+        return [serialiser(v) for v in verdi]
+    if isinstance(verdi, dict):
+        return {k: serialiser(v) for k, v in verdi.items()}
+    return verdi
+
+
+def deserialiser(verdi):
+    'Motsatt av serialiser. Instanser kommer tilbake usaved, med pk og feltene slik de var da jobben ble lagt til.'
+    if isinstance(verdi, dict) and 'instans' in verdi:
+        return next(serializers.deserialize('json', json.dumps([verdi['instans']]))).object
+    if isinstance(verdi, list):
+        return [deserialiser(v) for v in verdi]
+    if isinstance(verdi, dict):
+        return {k: deserialiser(v) for k, v in verdi.items()}
+    return verdi
+
+
+def lagJobb(func, *args, **kwargs):
+    'Lag en (ulagret) Jobb for funksjonen.'
+    return lagJobbFraArgumenter(
+        f'{func.__module__}.{func.__name__}', 
+        {'args': serialiser(list(args)), 'kwargs': serialiser(kwargs)}
+    )
+
+
+def lagJobbFraArgumenter(funksjon, argumenter):
+    'Lag en (ulagret) Jobb fra serialiserte argumenter. Nøkkelen e en hash av funksjon og argument, og brukes for å unngå duplikater.'
+    Jobb = apps.get_model('mytxs', 'Jobb')
+    nøkkel = hashlib.sha1(f'{funksjon}:{json.dumps(argumenter, sort_keys=True, cls=DjangoJSONEncoder)}'.encode()).hexdigest()
+    return Jobb(funksjon=funksjon, argumenter=argumenter, nøkkel=nøkkel)
+
+
+def slåSammenJobber(jobber):
+    '''
+    Slå sammen jobbene fra et request for funksjoner som har slåSammen, på plassen til den første av dem. 
+    Antall jobber som ble slått inn i en annen lagres i sammenslått, så vi kan sjå hva vi spare. 
+    '''
+    grupper = {}
+    for jobb in jobber:
+        if getattr(jobbFunksjoner.get(jobb.funksjon), 'slåSammen', None):
+            grupper.setdefault(jobb.funksjon, []).append(jobb)
+
+    resultat = []
+    for jobb in jobber:
+        gruppe = grupper.get(jobb.funksjon)
+        if not gruppe:
+            resultat.append(jobb)
+        elif gruppe[0] == jobb:
+            sammenslått = lagJobbFraArgumenter(jobb.funksjon, jobbFunksjoner[jobb.funksjon].slåSammen([j.argumenter for j in gruppe]))
+            sammenslått.sammenslått = sum(j.sammenslått for j in gruppe) + len(gruppe) - 1
+            resultat.append(sammenslått)
+    return resultat
+
+
+def leggTilJobb(func, *args, **kwargs):
+    '''
+    Legg til en jobb i køen. I et request samles de i THREAD_LOCAL.jobber, og ThreadingMiddleware lagre og kjøre
+    dem etter responsen. Utenfor et request lagres den med en gang, og kjøres i en thread.
+    '''
+    jobb = lagJobb(func, *args, **kwargs)
+
+    jobber = getattr(THREAD_LOCAL, 'jobber', None)
+    if jobber != None:
+        jobber.append(jobb)
+    else:
+        lagreJobber([jobb])
+        thread(kjørJobber)()
+
+
+def lagreJobber(jobber):
+    '''
+    Lagre jobber i køen, etter å ha slått sammen det som kan slås sammen. Om en identisk jobb allerede venter 
+    telles den heller opp i sammenslått (og ignore_conflicts på den delvise unique constrainten tar race conditions), 
+    og det samme gjelder duplikater i lista. Returne antall jobber vi slapp å legge til. 
+    '''
+    Jobb = apps.get_model('mytxs', 'Jobb')
+
+    unike = {}
+    for jobb in slåSammenJobber(jobber):
+        if jobb.nøkkel in unike:
+            unike[jobb.nøkkel].sammenslått += jobb.sammenslått + 1
+        else:
+            unike[jobb.nøkkel] = jobb
+
+    ventende = set(Jobb.objects.filter(status=Jobb.VENTER, nøkkel__in=unike.keys()).values_list('nøkkel', flat=True))
+    for nøkkel in ventende:
+        Jobb.objects.filter(status=Jobb.VENTER, nøkkel=nøkkel).update(sammenslått=F('sammenslått') + unike[nøkkel].sammenslått + 1)
+
+    nye = [jobb for nøkkel, jobb in unike.items() if nøkkel not in ventende]
+    Jobb.objects.bulk_create(nye, ignore_conflicts=True)
+    return len(jobber) - len(nye)
+
+
+def hentNesteJobb():
+    '''
+    Claim neste jobb som skal kjøres med SELECT ... FOR UPDATE SKIP LOCKED, slik at flere workers kan kjøre
+    samtidig uten å ta samme jobb. Jobber som har stått som kjører for lenge (prosessen døde) tas også.
+    På databaser uten SKIP LOCKED (sqlite) ignorerer django select_for_update, og da e det bare én worker som gjelder.
+    '''
+    Jobb = apps.get_model('mytxs', 'Jobb')
+    nå = timezone.now()
+
+    with transaction.atomic():
+        jobb = Jobb.objects.select_for_update(skip_locked=True).filter(
+            Q(status=Jobb.VENTER, kjørEtter__lte=nå) |
+            Q(status=Jobb.KJØRER, startet__lt=nå - KJØRER_TIMEOUT)
+        ).order_by('kjørEtter', 'pk').first()
+
+        if not jobb:
+            return None
+
+        jobb.status = Jobb.KJØRER
+        jobb.startet = nå
+        jobb.forsøk += 1
+        jobb.save(update_fields=['status', 'startet', 'forsøk'])
+    return jobb
+
+
+def kjørJobb(jobb):
+    'Kjør en claimet jobb, og lagre resultatet. Ved feil prøve vi igjen med eksponentiell backoff.'
+    Jobb = apps.get_model('mytxs', 'Jobb')
+
+    start = time.perf_counter()
+    try:
+        func = import_string(jobb.funksjon)
+        func = getattr(func, 'direkte', func)
+        with samleLogger():
+            func(*deserialiser(jobb.argumenter['args']), **deserialiser(jobb.argumenter['kwargs']))
+    except Exception as exception:
+        jobb.kjøretid = datetime.timedelta(seconds=time.perf_counter() - start)
+        jobb.feilmelding = traceback.format_exc()
+
+        if jobb.forsøk < MAKS_FORSØK and not isinstance(exception, NoMailException):
+            jobb.status = Jobb.VENTER
+            jobb.kjørEtter = timezone.now() + datetime.timedelta(seconds=30 * 2**jobb.forsøk)
+        else:
+            jobb.status = Jobb.FEILET
+            if not settings.DEBUG and not isinstance(exception, NoMailException):
+                mail.mail_admins(subject=f'Jobb feilet: {jobb.funksjon}', message=jobb.feilmelding)
+
+        try:
+            with transaction.atomic():
+                jobb.save(update_fields=['status', 'kjørEtter', 'kjøretid', 'feilmelding'])
+        except IntegrityError:
+            # En identisk jobb har blitt lagt til mens denne kjørte, og den tar over forsøket
+            jobb.status = Jobb.FEILET
+            jobb.save(update_fields=['status', 'kjøretid', 'feilmelding'])
+        return False
+
+    jobb.status = Jobb.FERDIG
+    jobb.kjøretid = datetime.timedelta(seconds=time.perf_counter() - start)
+    jobb.save(update_fields=['status', 'kjøretid'])
+    return True
+
+
+def kjørJobber(tidsgrense=None):
+    'Kjør jobber til køen er tom, eller tidsgrense (sekund) er nådd. Returne antall jobber som ble kjørt.'
+    start = time.perf_counter()
+    antall = 0
+    while tidsgrense == None or time.perf_counter() - start < tidsgrense:
+        if not (jobb := hentNesteJobb()):
+            break
+        kjørJobb(jobb)
+        antall += 1
+    return antall
+
+
+def slettGamleJobber(alder=datetime.timedelta(days=7)):
+    'Slett ferdige og feilede jobber eldre enn alder, så tabellen ikke vokse for alltid.'
+    Jobb = apps.get_model('mytxs', 'Jobb')
+    Jobb.objects.filter(status__in=[Jobb.FERDIG, Jobb.FEILET], opprettet__lt=timezone.now() - alder).delete()
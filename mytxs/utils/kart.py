@@ -0,0 +1,96 @@
+import datetime
+import gzip
+import hashlib
+import json
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+
+from mytxs import consts
+from mytxs.utils.modelUtils import stemmegruppeVerv, vervInnehavelseAktiv
+
+# Datasettet til sjekkheftekartet, som serves gzippet med en ETag av sjekkhefteKartData viewet. Punktet til hvert
+# medlem caches for seg, og regnes ut på nytt av kartSignals.py når medlemmet lagres. Selve datasettet caches under
+# en versjon som bumpes når et punkt endrer seg eller en vervInnehavelse endres, og settes da sammen på nytt av de
+# cachede punktene. Dagens dato er med i nøkkelen fordi hvem som er aktive avhenger av den.
+
+PUNKT_TIMEOUT = 60 * 60 * 24
+'Hvor lenge et punkt caches, i tilfelle noe endres uten at signalene fanger det opp (f.eks. bulk operasjoner)'
+
+def kartPunktKey(medlemPK):
+    return f'kartPunkt-{medlemPK}'
+
+
+VERSJON_TIMEOUT = 60 * 60
+'''
+Hvor lenge versjonen lever. Bumpen må nå alle prosessene, så cachen må vær delt (se CACHES i settings.py), 
+men om den ikke er det blir et skjult medlem ihvertfall borte fra kartet innen en time. 
+'''
+
+def getKartVersjon():
+    return cache.get_or_set('kartVersjon', time.time_ns, VERSJON_TIMEOUT)
+
+
+def bumpKartVersjon():
+    cache.set('kartVersjon', time.time_ns(), VERSJON_TIMEOUT)
+
+
+def slettKartPunkt(medlemPK):
+    cache.delete(kartPunktKey(medlemPK))
+
+
+def kartPunkt(medlem):
+    '''
+    Dataen kartet treng om medlemmet, eller False om de ikke har noen synlige adresser med koordinater. 
+    Regnes ut fra instansen alene, tilsvarende annotatePublic, så signalene kan gjøre det uten spørringer. 
+    '''
+    synlig = int(medlem.innstillinger.get('sjekkhefteSynlig', 0))
+    boCord = medlem.boAdresseCord() if medlem.boAdresse and synlig & 2**consts.sjekkhefteSynligOptions.index('boAdresse') else None
+    foreldreCord = medlem.foreldreAdresseCord() if medlem.foreldreAdresse and synlig & 2**consts.sjekkhefteSynligOptions.index('foreldreAdresse') else None
+    if not boCord and not foreldreCord:
+        return False
+    return {
+        'navn': medlem.navn,
+        'boCord': boCord,
+        'foreldreCord': foreldreCord,
+        'storkorNavn': medlem.storkorNavn(),
+        'pk': medlem.pk
+    }
+
+
+def oppdaterKartPunkter(medlemmer):
+    'Cache punktene til medlemmene på nytt, og bump versjonen om noen av dem endret seg'
+    gamle = cache.get_many([kartPunktKey(medlem.pk) for medlem in medlemmer])
+    nye = {kartPunktKey(medlem.pk): kartPunkt(medlem) for medlem in medlemmer}
+    if endret := {key: punkt for key, punkt in nye.items() if key not in gamle or gamle[key] != punkt}:
+        cache.set_many(endret, PUNKT_TIMEOUT)
+        bumpKartVersjon()
+
+
+def getKartData():
+    '''
+    Datasettet til kartet som {"gzip": bytes, "etag": str}. Om det er utdatert settes det sammen av de cachede
+    punktene til de aktive medlemmene, og bare punktene som mangler regnes ut.
+    '''
+    key = f'kartData-{datetime.date.today()}-{getKartVersjon()}'
+    if data := cache.get(key):
+        return data
+
+    Medlem = apps.get_model('mytxs', 'Medlem')
+    medlemPKs = list(Medlem.objects.filter(
+        vervInnehavelseAktiv(),
+        stemmegruppeVerv('vervInnehavelser__verv')
+    ).distinct().values_list('pk', flat=True))
+
+    cachet = cache.get_many([kartPunktKey(pk) for pk in medlemPKs])
+    punkter = {pk: cachet[kartPunktKey(pk)] for pk in medlemPKs if kartPunktKey(pk) in cachet}
+    if mangler := [pk for pk in medlemPKs if pk not in punkter]:
+        nye = {medlem.pk: kartPunkt(medlem) for medlem in Medlem.objects.filter(pk__in=mangler)}
+        punkter.update(nye)
+        cache.set_many({kartPunktKey(pk): punkt for pk, punkt in nye.items()}, PUNKT_TIMEOUT)
+
+    innhold = json.dumps([punkter[pk] for pk in medlemPKs if punkter[pk]]).encode()
+    data = {'gzip': gzip.compress(innhold), 'etag': hashlib.sha1(innhold).hexdigest()}
+    cache.set(key, data, 60 * 60 * 24)
+    return data
@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import connection, transaction
+
+from mytxs.utils.threadUtils import THREAD_LOCAL
+
+# Logging i bulk. Signalene i logSignals.py lage ikke Logg objekter direkte, men oppføringer som lagres av
+# lagreLogger. Inni samleLogger samles oppføringene for hele requesten eller jobben, og lagres etter commit
+# med et fast antall spørringer. Utenfor lagres de med en gang, som før.
+
+class RelatertLogg:
+    '''
+    Plassholder i verdien til en oppføring for en relasjon. Erstattes av lagreLogger med pk til nyeste logg
+    for det relaterte objektet, eller str representasjonen av det om det ikke har noen logg.
+    '''
+    def __init__(self, model, pk, relatert=None):
+        self.model = model
+        self.pk = pk
+        self.relatert = relatert
+
+    def strRep(self):
+        if self.relatert == None and self.pk != None:
+            self.relatert = self.model.objects.filter(pk=self.pk).first()
+        return str(self.relatert)
+
+
+def leggTilLogg(oppføring):
+    '''
+    Legg til en oppføring, på formen {"model", "instancePK", "change", "value", "strRep", "author", "kor"},
+    eller {"m2mName", "fromModel", "fromPK", "toModel", "toPK", "change", "author"} for m2m. Inni en transaksjon
+    blir den bare med i batchen om transaksjonen commites, slik at vi ikke logge ting som ble rullet tilbake.
+    '''
+    batch = getattr(THREAD_LOCAL, 'loggBatch', None)
+    if batch == None:
+        lagreLogger([oppføring])
+    elif connection.in_atomic_block:
+        transaction.on_commit(lambda: batch.append(oppføring))
+    else:
+        batch.append(oppføring)
+
+
+@contextmanager
+def samleLogger():
+    '''
+    Samle alle logger inni blokken, og lagre dem samlet etter commit. Brukes rundt requests (ThreadingMiddleware),
+    jobber og andre bulk operasjoner. Om vi allerede samle logger gjør denne ingenting, så den kan nøstes.
+    '''
+    if getattr(THREAD_LOCAL, 'loggBatch', None) != None:
+        yield
+        return
+
+    batch = THREAD_LOCAL.loggBatch = []
+    try:
+        yield
+    finally:
+        del THREAD_LOCAL.loggBatch
+        transaction.on_commit(lambda: lagreLogger(batch))
+
+
+def lagreSamledeLogger():
+    '''
+    Lagre det samleLogger har samlet så langt med en gang, og tøm batchen. For lange bulk operasjoner (seed --scale)
+    som ellers ville hatt alle oppføringene i minnet til slutt. Må kalles utenfor en transaksjon.
+    '''
+    batch = getattr(THREAD_LOCAL, 'loggBatch', None)
+    if batch:
+        lagreLogger(list(batch))
+        batch.clear()
+
+
+def erRelasjon(model, key):
+    field = next((f for f in model._meta.concrete_fields if f.name == key), None)
+    return field != None and field.is_relation
+
+
+def lagreLogger(oppføringer):
+    '''
+    Lagre oppføringer som Logg og LoggM2M objekter. Nyeste logg for alle objekter vi treng slås opp i LoggHode
+    med én spørring, og alt lagres med én bulk_create per modell. Oppføringer kan referere til logger som lages i samme
+    batch, de får pk først etter bulk_create og fikses med en bulk_update etterpå.
+    '''
+    if not oppføringer:
+        return
+
+    Logg = apps.get_model('mytxs', 'Logg')
+    LoggHode = apps.get_model('mytxs', 'LoggHode')
+    LoggM2M = apps.get_model('mytxs', 'LoggM2M')
+
+    # Skaff nyeste logg for alle objektene oppføringene handle om eller peke på
+    nøkler = set()
+    for oppføring in oppføringer:
+        if 'm2mName' in oppføring:
+            nøkler |= {(oppføring['fromModel'].__name__, oppføring['fromPK']), (oppføring['toModel'].__name__, oppføring['toPK'])}
+        else:
+            nøkler.add((oppføring['model'].__name__, oppføring['instancePK']))
+            nøkler |= {(v.model.__name__, v.pk) for v in oppføring['value'].values() if isinstance(v, RelatertLogg)}
+    nyeste = Logg.objects.getNyesteLogger(nøkler)
+
+    # For å sammenligne relasjoner med eksisterende logger treng vi instancePK til loggene de peke på
+    loggInstancePKs = {pk: (model, instancePK) for pk, model, instancePK in Logg.objects.filter(pk__in=[
+        v for logg in nyeste.values() for k, v in logg.value.items() if isinstance(v, int) and erRelasjon(logg.getModel(), k)
+    ]).values_list('pk', 'model', 'instancePK')}
+
+    def identitet(verdi):
+        'Gjør en relasjonsverdi sammenlignbar på tvers av logger, altså (model, instancePK) til loggen den peke på'
+        if isinstance(verdi, Logg):
+            return (verdi.model, verdi.instancePK)
+        if isinstance(verdi, int):
+            return loggInstancePKs.get(verdi)
+        return verdi
+
+    def endret(model, verdi, forrige):
+        if not forrige or verdi.keys() != forrige.value.keys():
+            return True
+        return any(
+            identitet(v) != identitet(forrige.value[k]) if erRelasjon(model, k) else v != forrige.value[k]
+            for k, v in verdi.items()
+        )
+
+    nyeLogger = []
+    nyeM2Ms = []
+    for oppføring in oppføringer:
+        if 'm2mName' in oppføring:
+            fromLogg = nyeste.get((oppføring['fromModel'].__name__, oppføring['fromPK']))
+            toLogg = nyeste.get((oppføring['toModel'].__name__, oppføring['toPK']))
+            if fromLogg and toLogg:
+                nyeM2Ms.append(LoggM2M(
+                    m2mName=oppføring['m2mName'],
+                    fromLogg=fromLogg,
+                    toLogg=toLogg,
+                    change=oppføring['change'],
+                    author=oppføring['author']
+                ))
+            continue
+
+        model = oppføring['model']
+        verdi = {
+            k: (nyeste.get((v.model.__name__, v.pk)) or v.strRep()) if isinstance(v, RelatertLogg) else v
+            for k, v in oppføring['value'].items()
+        }
+
+        nøkkel = (model.__name__, oppføring['instancePK'])
+        if oppføring['change'] == Logg.UPDATE and not endret(model, verdi, nyeste.get(nøkkel)):
+            # Dersom ingenting endra seg, ikkje lag en ny logg
+            continue
+
+        nyeste[nøkkel] = Logg(
+            model=model.__name__,
+            instancePK=oppføring['instancePK'],
+            change=oppføring['change'],
+            value=verdi,
+            strRep=oppføring['strRep'],
+            author=oppføring['author'],
+            kor=oppføring['kor']
+        )
+        nyeLogger.append(nyeste[nøkkel])
+
+    # Bytt ut relasjoner til lagrede logger med pk, og husk de som peke på logger i denne batchen
+    fiks = []
+    for logg in nyeLogger:
+        if ulagrede := {k: v for k, v in logg.value.items() if isinstance(v, Logg) and not v.pk}:
+            fiks.append((logg, ulagrede))
+        logg.value = {k: None if k in ulagrede else v.pk if isinstance(v, Logg) else v for k, v in logg.value.items()}
+
+    Logg.objects.bulk_create(nyeLogger, batch_size=500)
+
+    for logg, ulagrede in fiks:
+        logg.value.update({k: v.pk for k, v in ulagrede.items()})
+    Logg.objects.bulk_update([logg for logg, ulagrede in fiks], ['value'], batch_size=500)
+
+    # Flytt LoggHode til den nyeste loggen for hvert objekt, nyeste inneholde nå bare lagrede logger
+    nyePKs = {logg.pk for logg in nyeLogger}
+    LoggHode.objects.bulk_create(
+        [LoggHode(model=model, instancePK=pk, logg=logg) for (model, pk), logg in nyeste.items() if logg.pk in nyePKs],
+        update_conflicts=True, unique_fields=['model', 'instancePK'], update_fields=['logg'], batch_size=500
+    )
+
+    LoggM2M.objects.bulk_create(nyeM2Ms, batch_size=500)
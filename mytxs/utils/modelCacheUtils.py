@@ -1,7 +1,15 @@
+from collections import Counter
+import copy
+import logging
+
+from django.apps import apps
 from django.db import models
+from django.db.models import Q, QuerySet
+
+from mytxs.utils.jobbUtils import jobb
+from mytxs.utils.modelUtils import getAllRelatedModelsWithFieldNameAndReverse, post_bulk_create
 
-from mytxs.utils.modelUtils import getAllRelatedModelsWithFieldNameAndReverse
-from mytxs.utils.threadUtils import thread
+logger = logging.getLogger('mytxs.cacheQS')
 
 class DbCacheModel(models.Model):
     '''
@@ -13,70 +21,300 @@ class DbCacheModel(models.Model):
 
     dbCacheField = models.JSONField(editable=False, default=dict)
 
-    def shouldUpdateRelation(self, oldSelf, reverseRelation, model, fkChanged):
+    def shouldUpdateRelation(self, oldSelf, triggers, fkChanged):
         '''
-        Si om vi burde calle save utover denne relasjonen. Formelen her er komplisert:
+        Si om vi burde propagere utover denne relasjonen, gitt triggers fra registeret. Formelen her er komplisert:
         - Om det er noen felt som ser på oss, og vi har nettopp blitt opprettet, endret FK eller blitt slettet. 
         - Om noen av feltene som ser på oss enten ikke stiller noen krav, eller feltet hos oss de ser på er endret siden oldSelf.
         '''
-        for dbCacheFieldName in getDbCachedFields(model):
-            fields = [p.split('.')[1] for p in getattr(model, dbCacheFieldName).paths if p.split('.')[0] == reverseRelation]
-            if (fields and fkChanged) or any([f == '' or getAttrAndCall(self, f) != getAttrAndCall(oldSelf, f) for f in fields]):
-                return True
-        return False
-
-    def saveRelated(self, oldSelf=None, caller=None, delete=False):
-        'Lagre relaterte objekt basert på dbCache sin path.'
-        for relation, reverseRelation, model in getAllRelatedModelsWithFieldNameAndReverse(type(self)):
-            isForwardFK = isinstance(type(self)._meta.get_field(relation), models.ForeignKey)
-            fkChanged = isForwardFK and (oldSelf == None or getattr(oldSelf, relation) != getattr(self, relation))
-            if not self.shouldUpdateRelation(oldSelf, reverseRelation, model, fkChanged or delete):
-                continue
+        if triggers and fkChanged:
+            return True
+        return any([f == '' or getAttrAndCall(self, f) != getAttrAndCall(oldSelf, f) for f in triggers])
 
-            relatedList = set()
-            if isForwardFK:
-                relatedList.add(getattr(self, relation))
-                if oldSelf:
-                    relatedList.add(getattr(oldSelf, relation))
-            else:
-                relatedList.update(model.objects.filter(**{reverseRelation: self.pk}))
-            relatedList.discard(None)
+    @classmethod
+    def dbCacheQueryset(cls, queryset):
+        '''
+        Querysettet propagateDbCache henter instanser via. Override denne for å annotate det de cachede metodene 
+        treng, slik at et helt lag kan rekalkuleres med én spørring. Instansene får da dbCacheAnnotert=True. 
+        '''
+        return queryset
 
-            for related in relatedList:
-                if caller == f'{relation}#{related.pk}':
-                    continue
+    def save(self, *args, propagated=False, **kwargs):
+        '''
+        Save som vedlikeheld dbCache fields og relaterte avhengige dbCache fields. propagated betyr at 
+        propagateDbCache allerede har rekalkulert instansen og tar seg av å propagere videre. 
+        '''
+        if propagated:
+            return super().save(*args, **kwargs)
 
-                type(self).__bases__[0].save(related, caller=f'{reverseRelation}#{self.pk}')
+        dbCacheInfo = getDbCacheInfo(type(self))
 
-    def save(self, *args, caller=None, **kwargs):
-        'Save som vedlikeheld dbCache fields og relaterte avhengige dbCache fields.'
-        for key in [k for k in self.dbCacheField.keys() if k not in getDbCachedFields(type(self))]:
+        for key in [k for k in self.dbCacheField.keys() if k not in dbCacheInfo['methods']]:
             del self.dbCacheField[key]
 
         oldSelf = type(self).objects.filter(pk=self.pk).first()
 
-        for dbCacheFieldName in getDbCachedFields(type(self)):
-            localFields = [p[1:] for p in getattr(type(self), dbCacheFieldName).paths if p.split('.')[0] == '' and p.split('.')[1] != '']
-
+        for dbCacheFieldName, localFields in dbCacheInfo['localFields'].items():
             if len(localFields) == 0 or any([getAttrAndCall(self, field) != getAttrAndCall(oldSelf, field) for field in localFields]):
                 getattr(self, dbCacheFieldName)(run=True)
 
         super().save(*args, **kwargs)
 
-        if caller == None:
-            thread(self.saveRelated)(oldSelf, caller)
-        else:
-            self.saveRelated(oldSelf, caller)
+        propagateDbCacheJobb([[self._meta.label, self.pk, oldSelf]])
+
+    @classmethod
+    def bulkCreate(cls, instances, batch_size=500):
+        '''
+        bulk_create som fylle dbCacheField direkte, siden save ikke kjøre. De cachede metodene kan dermed ikke 
+        bruke pk, men kan bruke relaterte objekter som allerede er satt på instansene. Sende post_bulk_create 
+        slik at f.eks. loggingen kan gjøres i bulk, og propagere videre om noen er avhengige av modellen. 
+        '''
+        dbCacheInfo = getDbCacheInfo(cls)
+        for instance in instances:
+            for method in dbCacheInfo['methods']:
+                getattr(instance, method)(run=True)
+
+        instances = cls.objects.bulk_create(instances, batch_size=batch_size)
+        post_bulk_create.send(sender=cls, instances=instances)
+
+        if instances and dbCacheInfo['relations']:
+            propagateDbCacheJobb([[cls._meta.label, instance.pk, None] for instance in instances])
+        return instances
 
     def delete(self, *args, **kwargs):
-        'Delete som vedlikeheld dbCache fields og relaterte avhengige dbCache fields.'
+        '''
+        Delete som vedlikeheld dbCache fields og relaterte avhengige dbCache fields. Hvem som er avhengige av oss 
+        må finnes før vi slettes, ellers har CASCADE og SET_NULL allerede fjernet knytningene. 
+        '''
+        dirty = getDbCacheDirty(type(self), [(self, self)], delete=True)
+        visited = [[self._meta.label, self.pk]]
         super().delete(*args, **kwargs)
-        thread(self.saveRelated)(delete=True)
+        if dirty:
+            propagateDirtyJobb({model._meta.label: list(pks) for model, pks in dirty.items()}, visited)
 
     class Meta:
         abstract = True
 
 
+def getDbCacheDirty(model, pairs, delete=False):
+    '''
+    Gitt en liste av (instans, gammel instans) av model, returne {relatert model: set av pks} som må rekalkuleres. 
+    Gjør maks én spørring per relasjon, uansett hvor mange instanser det er. 
+    '''
+    dirty = {}
+    for relation in getDbCacheInfo(model)['relations']:
+        attname = relation['attname']
+
+        pks = set()
+        reversePKs = []
+        for instance, oldInstance in pairs:
+            fkChanged = attname and (oldInstance == None or getattr(oldInstance, attname) != getattr(instance, attname))
+            if not instance.shouldUpdateRelation(oldInstance, relation['triggers'], fkChanged or delete):
+                continue
+
+            if attname:
+                pks.add(getattr(instance, attname))
+                if oldInstance:
+                    pks.add(getattr(oldInstance, attname))
+            else:
+                reversePKs.append(instance.pk)
+
+        if reversePKs:
+            pks.update(relation['model'].objects.filter(**{f'{relation["reverseRelation"]}__in': reversePKs}).values_list('pk', flat=True))
+        pks.discard(None)
+
+        if pks:
+            dirty.setdefault(relation['model'], set()).update(pks)
+    return dirty
+
+
+def hasAbstractSave(model):
+    'Om en abstrakt modell mellom model og DbCacheModel har sin egen save, som da må kjøres per instans.'
+    for base in model.__mro__[1:]:
+        if base == DbCacheModel:
+            return False
+        if 'save' in vars(base):
+            return True
+    return False
+
+
+dbCacheRegistry = {}
+'Registeret over dbCache, fra model til resultatet av buildDbCacheInfo. Fylles av buildDbCacheRegistry.'
+
+def findDbCachedMethods(model):
+    'Returne liste av navn på methods som er dbCached, via introspeksjon. Bruk getDbCachedFields utenfor registeret.'
+    return [f for f in dir(model) if getattr(getattr(model, f, None), 'dbCached', False)]
+
+
+def buildDbCacheInfo(model):
+    '''
+    Bygg registeret for én modell, altså:
+    - methods: navnet på de cachede metodene. 
+    - localFields: {metode: lokale felt den ser på}, tom liste betyr at den kjøre ved hver lagring. 
+    - propagatedMethods: metodene som kjøre når et relatert objekt trigger oss, altså de uten lokale felt. 
+    - forwardFKs: FKene våre, som propagateDbCache select_relate. 
+    - relations: relasjonene der den andre siden har cachede metoder som ser på oss. For hver relasjon e triggers 
+      den omvendte indeksen {felt hos oss: [metoder på den andre siden]}, der felt '' betyr hver lagring. 
+      attname e satt for FKer, altså når vi kan slå opp den andre siden uten en spørring. 
+    '''
+    methods = findDbCachedMethods(model)
+    localFields = {m: [p[1:] for p in getattr(model, m).paths if p.split('.')[0] == '' and p.split('.')[1] != ''] for m in methods}
+
+    relations = []
+    for relation, reverseRelation, relatedModel in getAllRelatedModelsWithFieldNameAndReverse(model):
+        triggers = {}
+        for relatedMethod in findDbCachedMethods(relatedModel):
+            for path in getattr(relatedModel, relatedMethod).paths:
+                if path.split('.')[0] == reverseRelation:
+                    triggers.setdefault(path.split('.')[1], []).append(relatedMethod)
+        if not triggers:
+            continue
+
+        field = model._meta.get_field(relation)
+        relations.append({
+            'relation': relation,
+            'reverseRelation': reverseRelation,
+            'model': relatedModel,
+            'attname': field.attname if isinstance(field, models.ForeignKey) else None,
+            'triggers': triggers,
+        })
+
+    return {
+        'methods': methods,
+        'localFields': localFields,
+        'propagatedMethods': [m for m in methods if not localFields[m]],
+        'forwardFKs': [f.name for f in model._meta.concrete_fields if isinstance(f, models.ForeignKey)],
+        'relations': relations,
+    }
+
+
+def buildDbCacheRegistry():
+    'Bygg registeret for alle modeller, kalles fra MytxsConfig.ready() slik at lagring slepp introspeksjon.'
+    dbCacheRegistry.clear()
+    for model in apps.get_models():
+        dbCacheRegistry[model] = buildDbCacheInfo(model)
+
+
+def getDbCacheInfo(model):
+    'Slå opp i registeret. Modeller som ikke fantes da det ble bygd (f.eks. testmodeller) legges til ved første oppslag.'
+    if model not in dbCacheRegistry:
+        dbCacheRegistry[model] = buildDbCacheInfo(model)
+    return dbCacheRegistry[model]
+
+
+def propagateDbCacheFrom(sources):
+    '''
+    Propager dbCache videre fra sources ({model: [(instans, gammel instans)]}), etter at de er lagret. Med flere 
+    sources slås dirty settene sammen, så hver instans bare rekalkuleres én gang. En source som er dirty for en 
+    annen source rekalkuleres også, ellers markeres de som visited slik at vi ikke går tilbake til dem. 
+    '''
+    dirty = {}
+    for model, pairs in sources.items():
+        for relatedModel, relatedPKs in getDbCacheDirty(model, pairs).items():
+            dirty.setdefault(relatedModel, set()).update(relatedPKs)
+
+    propagateDbCache(dirty, {
+        (model, instance.pk) for model, pairs in sources.items() for instance, oldInstance in pairs 
+        if instance.pk not in dirty.get(model, set())
+    })
+
+
+def slåSammenPropagateDbCache(argumenterListe):
+    'Slå sammen propagateDbCacheJobb fra et request, og behold den eldste gamle instansen per (model, pk).'
+    sources = {}
+    for argumenter in argumenterListe:
+        for modelLabel, pk, oldInstance in argumenter['args'][0]:
+            sources.setdefault((modelLabel, pk), [modelLabel, pk, oldInstance])
+    return {'args': [list(sources.values())], 'kwargs': {}}
+
+
+@jobb(slåSammen=slåSammenPropagateDbCache)
+def propagateDbCacheJobb(sources):
+    '''
+    Jobben DbCacheModel.save legg i køen, med sources på formen [["app.Model", pk, gammel instans]]. Instansene 
+    hentes på nytt, slik at vi propagere den nyeste tilstanden om de har blitt lagret igjen før jobben kjøre. 
+    Er de slettet siden tar delete sin jobb seg av det. 
+    '''
+    pairs = {}
+    for modelLabel, pk, oldInstance in sources:
+        pairs.setdefault(apps.get_model(modelLabel), {})[pk] = oldInstance
+
+    propagateDbCacheFrom({
+        model: [(instance, oldInstances[instance.pk]) for instance in model.objects.filter(pk__in=oldInstances.keys())]
+        for model, oldInstances in pairs.items()
+    })
+
+
+def slåSammenPropagateDirty(argumenterListe):
+    'Slå sammen propagateDirtyJobb fra et request, altså unionen av dirty og visited.'
+    dirty = {}
+    visited = []
+    for argumenter in argumenterListe:
+        for modelLabel, pks in argumenter['args'][0].items():
+            dirty[modelLabel] = sorted(set(dirty.get(modelLabel, [])) | set(pks))
+        visited.extend(v for v in argumenter['args'][1] if v not in visited)
+    return {'args': [dirty, visited], 'kwargs': {}}
+
+
+@jobb(slåSammen=slåSammenPropagateDirty)
+def propagateDirtyJobb(dirty, visited):
+    'Jobben DbCacheModel.delete legg i køen, med dirty på formen {"app.Model": [pks]} og visited [["app.Model", pk]].'
+    propagateDbCache(
+        {apps.get_model(modelLabel): set(pks) for modelLabel, pks in dirty.items()},
+        {(apps.get_model(modelLabel), pk) for modelLabel, pk in visited}
+    )
+
+
+def propagateDbCache(dirty, visited):
+    '''
+    Rekalkulere dbCache for alle instansene i dirty ({model: set av pks}), lag for lag utover relasjonsgrafen. 
+    Per lag og modell blir det én spørring for å hent instansene, én bulk_update, og én spørring per relasjon 
+    for å finne neste lag. Antall spørringer vokse dermed med dybden av grafen, ikke antall rader. 
+
+    Rekalkulering kjøre de cachede metodene som ikke ser på lokale felt, tilsvarende en vanlig save der ingen 
+    lokale felt har endra seg. visited e (model, pk) som allerede er rekalkulert, og hoppes over, slik at 
+    vi ikke går tilbake til den som trigget oss. 
+    '''
+    while dirty:
+        nextDirty = {}
+        for model, pks in dirty.items():
+            pks = {pk for pk in pks if (model, pk) not in visited}
+            if not pks:
+                continue
+
+            dbCacheInfo = getDbCacheInfo(model)
+
+            pairs = []
+            for instance in model.dbCacheQueryset(model.objects.filter(pk__in=pks).select_related(*dbCacheInfo['forwardFKs'])):
+                visited.add((model, instance.pk))
+                instance.dbCacheAnnotert = True
+
+                for key in [k for k in instance.dbCacheField.keys() if k not in dbCacheInfo['methods']]:
+                    del instance.dbCacheField[key]
+
+                oldInstance = copy.copy(instance)
+                oldInstance.dbCacheField = dict(instance.dbCacheField)
+
+                for dbCacheFieldName in dbCacheInfo['propagatedMethods']:
+                    getattr(instance, dbCacheFieldName)(run=True)
+
+                pairs.append((instance, oldInstance))
+
+            if hasAbstractSave(model):
+                for instance, oldInstance in pairs:
+                    model.__bases__[0].save(instance, propagated=True)
+            else:
+                model.objects.bulk_update(
+                    [instance for instance, oldInstance in pairs if instance.dbCacheField != oldInstance.dbCacheField], 
+                    ['dbCacheField'], 
+                    batch_size=500
+                )
+
+            for relatedModel, relatedPKs in getDbCacheDirty(model, pairs).items():
+                nextDirty.setdefault(relatedModel, set()).update(relatedPKs)
+        dirty = nextDirty
+
+
 def getAttrAndCall(self, field):
     'Hjelpemetode som calle etter getattr dersom det e callable'
     res = getattr(self, field, None)
@@ -87,7 +325,7 @@ def getAttrAndCall(self, field):
 
 def getDbCachedFields(model):
     'Returne liste av navn på methods som er dbCached'
-    return [f for f in dir(model) if getattr(getattr(model, f, None), 'dbCached', False)]
+    return getDbCacheInfo(model)['methods']
 
 
 def dbCache(actualMethod=None, paths=[], runOnNone=False):
@@ -150,12 +388,35 @@ def cachedMethod(method):
     return _decorator
 
 
+cacheQSTeller = Counter()
+'Treff og bom for cacheQS per metode, f.eks. cacheQSTeller["filter", "bom"]. Bom betyr at vi måtte gå til databasen.'
+
+cacheQSLookups = {
+    'exact': lambda a, b: a == b,
+    'iexact': lambda a, b: a != None and b != None and str(a).lower() == str(b).lower(),
+    'in': lambda a, b: a in b,
+    'contains': lambda a, b: a != None and str(b) in str(a),
+    'icontains': lambda a, b: a != None and str(b).lower() in str(a).lower(),
+    'startswith': lambda a, b: a != None and str(a).startswith(str(b)),
+    'istartswith': lambda a, b: a != None and str(a).lower().startswith(str(b).lower()),
+    'isnull': lambda a, b: (a == None) == b,
+    'gt': lambda a, b: a != None and a > b,
+    'gte': lambda a, b: a != None and a >= b,
+    'lt': lambda a, b: a != None and a < b,
+    'lte': lambda a, b: a != None and a <= b,
+}
+'Lookups cacheQS kan svare på i python, med samme semantikk som i sql for NULL'
+
+
 def cacheQS(qs, props=['navn']):
     '''
-    Cache et queryset slik at man kan bruk filter og exists uten ytterligere db oppslag.
-    Primært tiltenkt brukt med medlem sine tilganger, siden vi filterer navn og exists på det querysettet ofte,
-    men kan også brukes til andre ting ved å endre props argumentet. En fremtidig utvikling er å utvide til å også 
-    håndtere exclude, men da igjen er det mye vanligere å bruke filter exists enn exclude exists. 
+    Cache et queryset slik at vi kan bruk filter, exclude, exists, count, get, first, order_by, values og 
+    values_list uten ytterligere db oppslag. Primært tiltenkt brukt med medlem sine tilganger, siden vi filterer 
+    navn og exists på det querysettet ofte, men kan også brukes til andre ting ved å endre props argumentet. 
+
+    Filter og exclude støtte Q objekter (med &, | og ~) og lookupsa i cacheQSLookups, på feltene i props og pk. 
+    Exists, count, get, first, contains og iterering svare django allerede på fra _result_cache. Alt vi ikke 
+    kan garanter rett svar på går til databasen som før, og telles som bom i cacheQSTeller. 
 
     For å bruk cacheQS på relaterte fields, se eksempelet på medlem.tilganger:
     `return cacheQS(tilganger.select_related('kor'), props=['navn', 'kor', 'kor__navn'])`
@@ -163,40 +424,133 @@ def cacheQS(qs, props=['navn']):
     # Populate queryset cachen om den ikkje alt e populated
     qs._fetch_all()
 
-    def cacheDecorator(actualFunction, cacheFunction):
+    # Felt vi kan slå opp, inkludert pk og id (fremmednøkkel) til relasjonene i props
+    felt = {'pk', 'id', *props, *(f'{p}__pk' for p in props), *(f'{p}_id' for p in props)}
+
+    def cacheDecorator(actualFunction, cacheFunction, cacheResultat=True):
         def _decorator(*args, **kwargs):
-            # resultCacheFunction transformere _result_cache. Om den returne False 
-            # skal vi dropp å sett result cache, tolk det som at den cacheFunksjon 
-            # ikkje kunna garanter rett resultat. 
+            # cacheFunction transformere _result_cache. Om den returne None skal vi dropp å sett 
+            # result cache, tolk det som at den ikkje kunna garanter rett resultat. 
             result = actualFunction(*args, **kwargs)
             resultCache = cacheFunction(*args, **kwargs)
-            if resultCache == False:
-                print('cacheQS failed for cacheFunction:', cacheFunction.__name__, props, args, kwargs, qs.model)
+            if resultCache == None:
+                cacheQSTeller[actualFunction.__name__, 'bom'] += 1
+                logger.debug('cacheQS bom for %s på %s, props=%s, args=%s, kwargs=%s', cacheFunction.__name__, qs.model.__name__, props, args, kwargs)
                 return result
+            cacheQSTeller[actualFunction.__name__, 'treff'] += 1
             result._result_cache = resultCache
-            return cacheQS(result, props=props)
+            # values og values_list gir dicts og tuples, de kan vi ikke slå opp i videre
+            return cacheQS(result, props=props) if cacheResultat else result
         return _decorator
 
-    def filterFunction(*args, **kwargs):
-        if not all(map(lambda k: (k.removesuffix('__in') in props), kwargs.keys())):
-            return False
-        resultCache = qs._result_cache
+    def getByLookup(o, *keys):
+        if not keys or o == None:
+            return o
+        return getByLookup(getattr(o, keys[0]), *keys[1:])
+
+    def getVerdi(o, key):
+        'Verdien til key på o, med relasjoner som pk slik at de kan sammenlignes med både instanser og pks'
+        verdi = getByLookup(o, *key.split('__'))
+        return verdi.pk if isinstance(verdi, models.Model) else verdi
+
+    def normaliser(verdi):
+        'Gjør verdien i et lookup sammenlignbar med getVerdi, eller returne None om vi ikke kan bruk den'
+        if isinstance(verdi, QuerySet):
+            if verdi._result_cache is None:
+                return None
+            verdi = verdi._result_cache
+        elif hasattr(verdi, 'resolve_expression'):
+            return None
+        if isinstance(verdi, (list, tuple, set, frozenset)):
+            return [v.pk if isinstance(v, models.Model) else v for v in verdi]
+        return verdi.pk if isinstance(verdi, models.Model) else verdi
+
+    def parseQ(q):
+        '''
+        Gjør et Q objekt om til en funksjon av en instans som returne om den matche, 
+        eller returne None om Q objektet har noe vi ikke støtte. 
+        '''
+        sjekker = []
+        for child in q.children:
+            if isinstance(child, Q):
+                sjekk = parseQ(child)
+            elif isinstance(child, tuple):
+                key, verdi = child
+                *path, lookup = key.split('__')
+                if lookup not in cacheQSLookups or not path:
+                    path, lookup = [*path, lookup], 'exact'
+                if '__'.join(path) not in felt:
+                    return None
+                if lookup == 'exact' and verdi is None:
+                    # filter(felt=None) e i django det samme som felt__isnull=True
+                    lookup, verdi = 'isnull', True
+                elif (verdi := normaliser(verdi)) is None:
+                    return None
+                sjekk = lambda o, key='__'.join(path), lookup=cacheQSLookups[lookup], verdi=verdi: lookup(getVerdi(o, key), verdi)
+            else:
+                sjekk = None
+            if sjekk == None:
+                return None
+            sjekker.append(sjekk)
 
-        def getByLookup(o, *keys):
-            return getByLookup(getattr(o, keys[0]), *keys[1:]) if keys else o
+        kombiner = all if q.connector == Q.AND else any
+        if q.negated:
+            return lambda o: not kombiner(sjekk(o) for sjekk in sjekker)
+        return lambda o: kombiner(sjekk(o) for sjekk in sjekker)
 
-        for key, value in kwargs.items():
-            if key.endswith('__in'):
-                resultCache = list(filter(lambda r: getByLookup(r, *key[:-4].split('__')) in value, resultCache))
-            else:
-                resultCache = list(filter(lambda r: getByLookup(r, *key.split('__')) == value, resultCache))
+    def filterFunction(*args, **kwargs):
+        if not (sjekk := parseQ(Q(*args, **kwargs))):
+            return None
+        return [r for r in qs._result_cache if sjekk(r)]
+
+    def excludeFunction(*args, **kwargs):
+        if not (sjekk := parseQ(Q(*args, **kwargs))):
+            return None
+        return [r for r in qs._result_cache if not sjekk(r)]
+
+    def orderByFunction(*fields):
+        if not all(isinstance(f, str) and f.removeprefix('-') in felt for f in fields):
+            return None
+        resultCache = list(qs._result_cache)
+        # Sorter på nøklene bakfra, siden sort e stabil. NULL kommer sist stigende og først synkende, som i postgres. 
+        for f in reversed(fields):
+            if any(isinstance(getByLookup(r, *f.removeprefix('-').split('__')), models.Model) for r in resultCache):
+                # Sortering på en relasjon bruke ordering til den relaterte modellen, det gjør vi ikke her
+                return None
+            verdier = [getVerdi(r, f.removeprefix('-')) for r in resultCache]
+            rekkefølge = sorted(range(len(resultCache)), key=lambda i: (verdier[i] == None, verdier[i] if verdier[i] != None else 0), reverse=f.startswith('-'))
+            resultCache = [resultCache[i] for i in rekkefølge]
         return resultCache
-    
-    def flatValuesListFunction(*args, **kwargs):
-        if kwargs.get('flat') == False or args[0] not in props:
-            return False
-        return list(map(lambda r: getattr(r, args[0]), qs._result_cache))
+
+    def reverseFunction():
+        return list(reversed(qs._result_cache))
+
+    def allFunction():
+        return list(qs._result_cache)
+
+    def distinctFunction(*fields):
+        if fields:
+            return None
+        return list({r.pk: r for r in qs._result_cache}.values())
+
+    def valuesFunction(*fields, **expressions):
+        if not fields or expressions or not all(f in felt for f in fields):
+            return None
+        return [{f: getVerdi(r, f) for f in fields} for r in qs._result_cache]
+
+    def valuesListFunction(*fields, flat=False, named=False):
+        if not fields or named or not all(f in felt for f in fields):
+            return None
+        if flat:
+            return [getVerdi(r, fields[0]) for r in qs._result_cache]
+        return [tuple(getVerdi(r, f) for f in fields) for r in qs._result_cache]
 
     qs.filter = cacheDecorator(qs.filter, filterFunction)
-    qs.values_list = cacheDecorator(qs.values_list, flatValuesListFunction)
+    qs.exclude = cacheDecorator(qs.exclude, excludeFunction)
+    qs.order_by = cacheDecorator(qs.order_by, orderByFunction)
+    qs.reverse = cacheDecorator(qs.reverse, reverseFunction)
+    qs.all = cacheDecorator(qs.all, allFunction)
+    qs.distinct = cacheDecorator(qs.distinct, distinctFunction)
+    qs.values = cacheDecorator(qs.values, valuesFunction, cacheResultat=False)
+    qs.values_list = cacheDecorator(qs.values_list, valuesListFunction, cacheResultat=False)
     return qs
@@ -1,12 +1,16 @@
 import datetime
+import inspect
 import os
 import random
 import re
 
 from django.apps import apps
+from django.contrib.postgres.search import TrigramWordSimilarity
 from django.core.exceptions import FieldDoesNotExist
-from django.db.models import Q, Case, When, ManyToManyField, ManyToManyRel, ForeignObjectRel, Min
+from django.db.models import Q, F, Case, When, Func, ManyToManyField, ManyToManyRel, ForeignObjectRel, Min, QuerySet, TextField, Value as V
+from django.db.models.functions import Lower
 from django.db.models.fields.related import RelatedField
+from django.dispatch import Signal
 from django.forms import ValidationError
 from django.utils.translation import gettext_lazy as _
 
@@ -184,8 +188,12 @@ def getPathToKor(model):
     return 'kor'
 
 
+post_bulk_create = Signal()
+'Sendes av DbCacheModel.bulkCreate med sender=model og instances=de opprettede instansene, siden bulk_create ikke sende post_save'
+
+
 def getInstancesForKor(model, kor):
-    'Returne alle instanser av modellen for et queryset med kor'
+    'Returne alle instanser av modellen for et queryset med kor, eller et set av kor pks'
     if model.__name__ == 'Medlem':
         return model.objects.filter(
             stemmegruppeVerv('vervInnehavelser__verv', includeDirr=True), 
@@ -193,7 +201,7 @@ def getInstancesForKor(model, kor):
         )
     
     if model.__name__ == 'Kor':
-        return kor
+        return kor if isinstance(kor, QuerySet) else model.objects.filter(pk__in=kor)
     
     return model.objects.filter(
         **{f'{getPathToKor(model)}__in': kor}
@@ -275,6 +283,33 @@ def joinQ(*Qs, joinOp='|'):
     return resQ
 
 
+class ImmutableUnaccent(Func):
+    '''
+    unaccent er ikke IMMUTABLE i postgres, og kan derfor ikke brukes i en GeneratedField eller en indeks. 
+    mytxs_unaccent er en IMMUTABLE wrapper rundt den, opprettet i migrasjon 0028. 
+    '''
+    function = 'mytxs_unaccent'
+    output_field = TextField()
+
+
+def søkeform(tekst):
+    'Teksten i samme form som søkefelt som Medlem.søkenavn, altså uten diakritiske tegn og med små bokstaver'
+    return Lower(ImmutableUnaccent(V(tekst) if isinstance(tekst, str) else tekst))
+
+
+def søk(queryset, felt, tekst):
+    '''
+    Fritekstsøk på et søkefelt, der hvert ord i teksten må finnes i feltet, eller ligne nok på et ord i feltet 
+    til at skrivefeil går greit (settings.SØK_TERSKEL). Begge deler kan bruke en gin_trgm_ops indeks på feltet. 
+    Annotere rangering, summen av hvor godt hvert ord treffer, som resultatene kan sorteres på. 
+    '''
+    ordene = tekst.split()
+    queryset = queryset.filter(*[
+        Q(**{f'{felt}__contains': søkeform(ord)}) | Q(**{f'{felt}__trigram_word_similar': søkeform(ord)}) for ord in ordene
+    ])
+    return queryset.annotate(rangering=sum((TrigramWordSimilarity(søkeform(ord), felt) for ord in ordene), start=V(0.0)))
+
+
 def getSourceM2MModel(model, fieldName):
     'Gitt en av modellene og et fieldName skaffer denne modellen som m2m feltet står på'
     try:
@@ -301,6 +336,24 @@ def bareAktiveDecorator(func):
     return _decorator
 
 
+def tilgangMemoDecorator(func):
+    '''
+    Legges etter bareAktiveDecorator på sideTilgangQueryset og redigerTilgangQueryset, og memoisere resultatet i 
+    medlem.tilgangMemo på argumentene (model, resModel, fieldType). Siden request.user.medlem lever ett request 
+    blir dette et memo per request. Vi returne en kopi så ingen deler result cachen til querysettet. 
+    '''
+    signatur = inspect.signature(func)
+    def _decorator(self, *args, **kwargs):
+        argumenter = signatur.bind(self, *args, **kwargs)
+        argumenter.apply_defaults()
+        nøkkel = (func.__name__, *list(argumenter.arguments.values())[1:])
+        if nøkkel not in self.tilgangMemo:
+            self.tilgangMemo[nøkkel] = func(self, *args, **kwargs)
+        return self.tilgangMemo[nøkkel].all()
+
+    return _decorator
+
+
 def korLookup(kor, path=''):
     '''
     Returne et Q lookup for å spør om kor=kor, der vi
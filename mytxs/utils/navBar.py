@@ -1,3 +1,7 @@
+import datetime
+import time
+
+from django.core.cache import cache
 from django.http.request import HttpRequest
 from django.template.defaultfilters import capfirst
 from django.urls import reverse
@@ -12,7 +16,8 @@ class navBarNode():
         eller den bare skal forwarde til children urler. Merk at om en side har isPage=False vil den automatisk 
         fjernes av generateURLs, dersom den ikke har noen children med isPage=True. defaultParameters hiver på 
         det på enden av denne nodens url, altså ?a=b osv, f.eks. slik at hendelseListe siden bare skal være dagens
-        og fremtidige hendelser. 
+        og fremtidige hendelser. defaultParameters kan inneholde {år} og {iDag}, som fylles inn når urlen leses, 
+        slik at en cachet navBar ikke blir utdatert ved midnatt. 
         '''
         self.children = {}
         self.parent = parent
@@ -86,10 +91,48 @@ class navBarNode():
             child.generateURLs(urlSoFar=urlSoFar + ([child.key] if child.inURL else []))
         
         if self.isPage:
-            self.url = reverse(urlSoFar[0], args=urlSoFar[1:] if len(urlSoFar) > 1 else None) + self.defaultParameters
-        else:
-            child = next(iter(self.children.values()), None)
-            if child and (url := getattr(child, 'url', None)):
-                self.url = url
-            if not hasattr(self, 'url'):
-                del self.parent.children[self.key]
+            self.path = reverse(urlSoFar[0], args=urlSoFar[1:] if len(urlSoFar) > 1 else None)
+        elif not self.children:
+            del self.parent.children[self.key]
+
+
+    @property
+    def url(self):
+        'Urlen til noden. Om noden ikke er en side forwarde vi til første child.'
+        if self.isPage:
+            today = datetime.date.today()
+            return self.path + self.defaultParameters.format(år=today.year, iDag=today)
+        return next(iter(self.children.values())).url
+
+
+def getNavBarVersjon(medlemPK=None):
+    'Returne tilgangsversjonen til medlemmet, eller den globale om medlemPK er None'
+    return cache.get_or_set(f'navBarVersjon-{medlemPK}', time.time_ns, None)
+
+
+def bumpNavBarVersjon(medlemPK=None):
+    '''
+    Invalidere cachede navBars ved å bumpe tilgangsversjonen til medlemmet, eller den globale om medlemPK er None. 
+    Merk at en None medlemPK fra en instans (f.eks. instance.medlem_id) dermed invalidere alle, som e trygt. 
+    '''
+    cache.set(f'navBarVersjon-{medlemPK}', time.time_ns(), None)
+
+
+def bumpNavBarVersjoner(medlemPKs):
+    'Som bumpNavBarVersjon, for mange medlemmer samtidig'
+    versjon = time.time_ns()
+    cache.set_many({f'navBarVersjon-{medlemPK}': versjon for medlemPK in medlemPKs}, None)
+
+
+def navBarCacheKey(medlemPK):
+    '''
+    Cache key for navBar til et medlem. Dagens dato e med fordi aktive verv og tilganger avhenge av datoen, 
+    så da bygges navBar på nytt hver dag uansett. Begge versjonene hentes med ett cache oppslag, og de som 
+    mangler settes, slik at en cachet navBar bare koste to oppslag totalt. 
+    '''
+    keys = ['navBarVersjon-None', f'navBarVersjon-{medlemPK}']
+    versjoner = cache.get_many(keys)
+    if mangler := {key: time.time_ns() for key in keys if key not in versjoner}:
+        cache.set_many(mangler, None)
+        versjoner.update(mangler)
+    return f'navBar-{medlemPK}-{datetime.date.today()}-' + '-'.join(str(versjoner[key]) for key in keys)
@@ -0,0 +1,159 @@
+from collections import Counter
+import json
+import logging
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('mytxs.sql')
+
+# Måling av SQL per request, brukt av SqlBudsjettMiddleware. Tilsvarende benchmarkQueries, men lett nok til
+# å kjøre i prod uten django-debug-toolbar. Threads som startes fra requesten (se threadUtils.thread) måles
+# under samme requestId, og rapporteres når de e ferdig siden responsen allerede e sendt da.
+
+def sqlForm(sql):
+    '''
+    Formen til en spørring, altså sql uten parametre. Django gir oss allerede sql med %s for parametre,
+    men lister av ulik lengde (IN (%s, %s, ...) og VALUES (...), (...)) slås sammen så de blir lik.
+    '''
+    sql = re.sub(r'\((%s, )*%s\)', '(%s...)', sql)
+    return re.sub(r'(\(%s\.\.\.\)(, )?)+', '(%s...)', sql)
+
+
+class SqlMåling:
+    'Teller spørringer og tid i databasen. Brukes som connection.execute_wrapper.'
+
+    def __init__(self, requestId=None, beskrivelse=''):
+        self.requestId = requestId or uuid.uuid4().hex[:8]
+        self.beskrivelse = beskrivelse
+        self.antall = 0
+        self.tid = 0
+        self.former = Counter()
+        'Antall ganger hver sqlForm er kjørt'
+        self.eksempler = {}
+        'Første sql og params for hver sqlForm, så de kan kjøres på nytt med EXPLAIN'
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tid += time.perf_counter() - start
+            self.antall += 1
+            form = sqlForm(sql)
+            self.former[form] += 1
+            if not many:
+                self.eksempler.setdefault(form, (sql, params))
+
+    def nPluss1(self):
+        'Former som har kjørt minst SQL_N_PLUSS_1 ganger, altså trolig en spørring i en løkke'
+        return [(form, antall) for form, antall in self.former.most_common() if antall >= settings.SQL_N_PLUSS_1]
+
+    def rapporter(self):
+        'Logg målingen om den gikk over budsjettet eller har N+1 spørringer'
+        nPluss1 = self.nPluss1()
+        if self.antall <= settings.SQL_BUDSJETT_ANTALL and self.tid <= settings.SQL_BUDSJETT_TID and not nPluss1:
+            return
+
+        logger.warning('\n'.join([
+            f'[{self.requestId}] {self.beskrivelse}: {self.antall} spørringer, {self.tid * 1000:.0f}ms i databasen',
+            *(f'\t{antall}x {form[:300]}' for form, antall in nPluss1)
+        ]))
+
+    def iThread(self, func):
+        'Wrap func så spørringene den gjør i en annen thread måles og rapporteres under samme requestId'
+        def _decorator(*args, **kwargs):
+            måling = SqlMåling(self.requestId, f'{self.beskrivelse} (etter respons, {getattr(func, "__name__", "thread")})')
+            try:
+                with connection.execute_wrapper(måling):
+                    return func(*args, **kwargs)
+            finally:
+                måling.rapporter()
+        return _decorator
+
+    def serverTiming(self, totalTid):
+        'Verdi til Server-Timing headeren, som vises i nettleserens devtools'
+        return f'db;dur={self.tid * 1000:.1f};desc="{self.antall} queries", total;dur={totalTid * 1000:.1f}'
+
+
+# Analyse av planer fra EXPLAIN ANALYZE, brukt av benchmarkQueries --explain. De store nøstede subqueryene fra
+# f.eks. annotateStemmegruppe og annotateFravær ser greie ut i SQL, men planen vise om postgres gjør dem fornuftig.
+
+STOR_TABELL = 10_000
+'Antall rader (estimert av postgres) en tabell må ha før en seq scan på den flagges'
+
+FEILESTIMAT = 10
+'Hvor mange ganger feil radestimatet i en nested loop må være før det flagges'
+
+def explain(sql, params):
+    'Kjør spørringen med EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), og returne resultatet ({"Plan": ..., "Execution Time": ...})'
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+        resultat = cursor.fetchone()[0]
+    return (json.loads(resultat) if isinstance(resultat, str) else resultat)[0]
+
+
+def tabellStørrelser():
+    'Estimert antall rader i hver tabell, fra pg_class'
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+        return {navn: int(rader) for navn, rader in cursor.fetchall()}
+
+
+def planNoder(node):
+    'Alle nodene i planen, dybde først'
+    yield node
+    for barn in node.get('Plans', []):
+        yield from planNoder(barn)
+
+
+def nodeNavn(node):
+    return ' '.join(filter(None, [node['Node Type'], node.get('Relation Name'), node.get('Index Name')]))
+
+
+def planForm(node):
+    'Formen til planen, altså nodetypene og tabellene og indeksene de bruke, uten kostnader og tider'
+    barn = ', '.join(planForm(b) for b in node.get('Plans', []))
+    return f'{nodeNavn(node)}({barn})' if barn else nodeNavn(node)
+
+
+def analyserPlan(resultat, tabeller):
+    '''
+    Trekk ut det som er verdt å sjå på fra resultatet av explain, gitt tabellStørrelser:
+    - seqScans: Seq Scan på tabeller med flere enn STOR_TABELL rader. 
+    - feilestimater: Nested Loops, og sidene dems, der antall rader er mer enn FEILESTIMAT ganger feil estimert. 
+      Nested loops e bare raske om den ytre siden e lita, så et feilestimat her e ofte grunnen til en treg spørring. 
+    - dyresteNoder: De tre nodene som brukte mest tid selv, altså uten tida til barna. 
+    '''
+    noder = list(planNoder(resultat['Plan']))
+
+    def tid(node):
+        return node.get('Actual Total Time', 0) * node.get('Actual Loops', 1)
+
+    def egenTid(node):
+        return tid(node) - sum(tid(barn) for barn in node.get('Plans', []))
+
+    def feil(node):
+        faktisk, estimert = node.get('Actual Rows', 0) + 1, node['Plan Rows'] + 1
+        return max(faktisk, estimert) / min(faktisk, estimert)
+
+    nestedLoops = [n for n in noder if n['Node Type'] == 'Nested Loop']
+    return {
+        'tid': resultat['Execution Time'],
+        'form': planForm(resultat['Plan']),
+        'seqScans': [
+            {'tabell': n['Relation Name'], 'rader': tabeller[n['Relation Name']], 'loops': n.get('Actual Loops', 1), 'fjernetAvFilter': n.get('Rows Removed by Filter', 0)}
+            for n in noder if n['Node Type'] == 'Seq Scan' and tabeller.get(n['Relation Name'], 0) > STOR_TABELL
+        ],
+        'feilestimater': [
+            {'node': nodeNavn(n), 'estimert': n['Plan Rows'], 'faktisk': n.get('Actual Rows', 0), 'loops': n.get('Actual Loops', 1)}
+            for n in {id(n): n for nestedLoop in nestedLoops for n in [nestedLoop, *nestedLoop.get('Plans', [])]}.values() if feil(n) >= FEILESTIMAT
+        ],
+        'dyresteNoder': [
+            {'node': nodeNavn(n), 'egenTid': round(egenTid(n), 3), 'kostnad': n['Total Cost']}
+            for n in sorted(noder, key=egenTid, reverse=True)[:3]
+        ],
+    }
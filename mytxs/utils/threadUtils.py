@@ -50,8 +50,13 @@ def thread(func=None):
         if 'test' in sys.argv or 'seed' in sys.argv:
             return func(*args, **kwargs)
 
+        target = mailException(func, request=getattr(THREAD_LOCAL, 'request', None))
+        if måling := getattr(THREAD_LOCAL, 'sqlMåling', None):
+            # Mål spørringene i threaden under samme request, se SqlBudsjettMiddleware
+            target = måling.iThread(target)
+
         thread = threading.Thread(
-            target=mailException(func, request=getattr(THREAD_LOCAL, 'request', None)),
+            target=target,
             args=args, 
             kwargs=kwargs,
             daemon=True
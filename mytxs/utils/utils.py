@@ -1,16 +1,13 @@
 import datetime
 from io import BytesIO
 from PIL import Image
-import certifi
-import urllib3
-urllib3.util.connection.HAS_IPV6 = False
 
 from django.core.files import File
 
 # Alle generelle ting ellers
 
-def cropImage(imageFile, name, width, height):
-    'Resize et bilde til width og height, og returne en (ulagret) file'
+def cropImage(imageFile, name, width, height, format='JPEG'):
+    'Resize et bilde til width og height, og returne en (ulagret) file i formatet'
     bilde = Image.open(imageFile)
 
     # Fjern transparency
@@ -39,7 +36,7 @@ def cropImage(imageFile, name, width, height):
 
     bilde.verify()
     bildeBytes = BytesIO()
-    bilde.save(bildeBytes, 'JPEG')
+    bilde.save(bildeBytes, format)
     return File(bildeBytes, name=name)
 
 
@@ -65,21 +62,3 @@ def getStemmegrupper(stemmefordeling, lengde=2, ekstraDybde=0):
             stemmegrupper = ','.join([(f'{s},1{s},2{s}' if len(s) == l else s) for s in stemmegrupper.split(',')])
     
     return stemmegrupper.split(',')
-
-
-def getCord(adresse):
-    try:
-        http = urllib3.PoolManager(
-            cert_reqs="CERT_REQUIRED",
-            ca_certs=certifi.where(),
-            timeout=urllib3.Timeout(5)
-        )
-
-        cord = http.request("GET", 'https://ws.geonorge.no/adresser/v1/sok?sok='+adresse).json()
-        if len(cord['adresser']) > 0:
-            cord = cord['adresser'][0]['representasjonspunkt']
-            del cord['epsg']
-
-            return cord
-    except:
-        pass
@@ -9,6 +9,7 @@ from django.shortcuts import redirect
 
 from mytxs.models import Dekorasjon, Medlem
 from mytxs.models import Medlem, Sang, SangFil
+from mytxs.utils.bildeUtils import variantMedlemPK
 
 # Utils til bruk i og rundt views
 
@@ -121,6 +122,10 @@ class HttpResponseUnauthorized(HttpResponse):
 
 def harFilTilgang(medlem, filePath):
     'Returne instance dersom medlemmet har tilgang til fila.'
+    # Varianter av sjekkhefte bildet, som ikke ligger i et FileField
+    if medlemPK := variantMedlemPK(filePath):
+        return Medlem.objects.filter(pk=medlemPK).exclude(bilde='').first() or False
+
     instance, fieldName = filePathToInstance(filePath)
 
     if not instance:
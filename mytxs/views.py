@@ -1,7 +1,7 @@
 import csv
 import datetime
+import gzip
 from io import BytesIO
-import json
 import os
 from urllib.parse import quote
 import zipfile
@@ -13,13 +13,14 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm, SetPasswordForm
 from django.contrib.auth.models import User as AuthUser
 from django.core import mail
-from django.db.models import Q, F, IntegerField, Prefetch, Case, When
+from django.db.models import Q, F, Prefetch, Case, When
 from django.db.models.fields import BLANK_CHOICE_DASH
-from django.db.models.functions import Cast
 from django.forms import inlineformset_factory, modelform_factory, modelformset_factory
-from django.http import FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
 from django.http import FileResponse, HttpResponse 
 
@@ -29,15 +30,18 @@ from mytxs.forms import HendelseFilterForm, LoggFilterForm, MedlemFilterForm, Na
 from mytxs.management.commands.transfer import transferByJWT
 from mytxs.models import Dekorasjon, DekorasjonInnehavelse, Hendelse, Kor, Lenke, Logg, Medlem, MedlemQuerySet, Repertoar, Sang, SangFil, Tilgang, Turne, Verv, VervInnehavelse, Oppmøte
 from mytxs.forms import HendelseFilterForm, LoggFilterForm, MedlemFilterForm, NavnKorFilterForm, RepertoarFilterForm, SangFilterForm, ShareCalendarForm, TurneFilterForm, VervFilterForm, OppmøteFilterForm
+from mytxs.utils.bildeUtils import variantMedlemPK
 from mytxs.utils.formAccess import addHelpText, disableBrukt, disableFields, disableFormMedlem, removeFields
 from mytxs.utils.formAddField import addBulkFileUpload, addDeleteCheckbox, addDeleteUserCheckbox, addHendelseMedlemmer, addReverseM2M
 from mytxs.utils.googleCalendar import getOrCreateAndShareCalendar
+from mytxs.utils.iCalCache import cacheICal, getCachetICal, getICalVersjon, lagreICal
+from mytxs.utils.kart import getKartData
 from mytxs.utils.lazyDropdown import lazyDropdown
 from mytxs.utils.formUtils import filesIfPost, limitDekorasjonInnehavelseDelete, postIfPost, dekorasjonInlineFormsetArgs, vervInlineFormsetArgs, understemmeFormsetArgs, sangInlineFormsetArgs
 from mytxs.utils.hashUtils import addHash, testHash
 from mytxs.utils.modelUtils import inneværendeSemester, korLookup, qBool, randomDistinct, vervInnehavelseAktiv, stemmegruppeVerv, annotateInstance
 from mytxs.utils.pagination import getPaginatedInlineFormSet, addPaginatorPage
-from mytxs.utils.downloadUtils import downloadFile, downloadICal, downloadVCard
+from mytxs.utils.downloadUtils import downloadFile, downloadICal, downloadVCard, iCalLinjer, lagICal
 from mytxs.utils.utils import getHalvårStart
 from mytxs.utils.viewUtils import harFilTilgang, harTilgang, redirectToInstance
 
@@ -51,10 +55,15 @@ def serve(request, path, download=False):
 
     try:
         suffix = '.' + path.split('.')[1] if '.' in path else ''
-        return FileResponse(open('uploads/'+path, 'rb'), as_attachment=download, filename=str(instance).replace(suffix, '') + suffix)
+        response = FileResponse(open('uploads/'+path, 'rb'), as_attachment=download, filename=str(instance).replace(suffix, '') + suffix)
     except FileNotFoundError:
         return HttpResponseNotFound()
 
+    if variantMedlemPK(path):
+        # Urlen til varianter inneholder bildeVersjon, så de kan caches så lenge nettleseren vil
+        patch_cache_control(response, private=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
 
 @login_required
 def serveSangZip(request, filePKs):
@@ -177,6 +186,63 @@ def endreLogin(request):
     })
 
 
+@login_required
+def sjekkhefteKartData(request):
+    'Datasettet til sjekkheftekartet, gzippet og med ETag så nettleseren bare treng å spør om det har endret seg'
+    if not request.user.medlem.navBar['sjekkheftet/kart']:
+        return HttpResponseForbidden()
+
+    kartData = getKartData()
+    # Den gzippede og den ukomprimerte kroppen er forskjellige bytes, så de må ha hver sin ETag
+    brukGzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = f'"{kartData["etag"]}-gzip"' if brukGzip else f'"{kartData["etag"]}"'
+    if not (response := get_conditional_response(request, etag=etag)):
+        if brukGzip:
+            response = HttpResponse(kartData['gzip'], content_type='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(kartData['gzip']), content_type='application/json')
+
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+JUBILEUM_ANTALL = 40
+'Hvor mange bursdager jubileum siden vise om gangen'
+
+def bursdagQueryset():
+    'Aktive medlemmer med synlig fødselsdato, for jubileum siden og kommendeBursdager'
+    return Medlem.objects.distinct().annotateKarantenekor(storkor=True).annotatePublic().filter(
+        vervInnehavelseAktiv(), 
+        stemmegruppeVerv('vervInnehavelser__verv'),
+        public__fødselsdato__isnull=False
+    )
+
+
+@login_required
+def kommendeBursdager(request):
+    'De neste bursdagene som JSON, med limit og offset i GET parameterne'
+    if not request.user.medlem.navBar['sjekkheftet/jubileum']:
+        return HttpResponseForbidden()
+
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if limit < 1 or offset < 0:
+        return HttpResponseBadRequest()
+
+    return JsonResponse([{
+        'pk': medlem.pk,
+        'navn': medlem.navn,
+        'fødselsdato': medlem.public__fødselsdato,
+        'karantenekor': medlem.karantenekor
+    } for medlem in bursdagQueryset().kommendeBursdager(limit, offset)], safe=False)
+
+
 @harTilgang
 def sjekkheftet(request, side, underside=None):
     if side == 'søk':
@@ -187,30 +253,23 @@ def sjekkheftet(request, side, underside=None):
 
         medlemFilterForm = MedlemFilterForm(request.GET)
 
-        request.queryset = medlemFilterForm.applyFilter(request.queryset)\
-            .order_by(*Medlem._meta.ordering).annotatePublic().sjekkheftePrefetch(kor=None)
+        request.queryset = medlemFilterForm.applyFilter(request.queryset)
 
         if request.GET.get('vcard'):
-            return downloadVCard(request.queryset)
+            return downloadVCard(request.queryset.annotatePublic().sjekkheftePrefetch(kor=None))
+
+        # Paginer før annotatePublic og sjekkheftePrefetch, så de bare kjøres for medlemmene på siden
+        addPaginatorPage(request)
+        pks = [medlem.pk for medlem in request.paginatorPage]
+        medlemmer = Medlem.objects.filter(pk__in=pks).annotateKarantenekor(storkor=True).annotatePublic().sjekkheftePrefetch(kor=None).in_bulk()
 
         return render(request, 'mytxs/sjekkheftetSøk.html', {
-            'grupperinger': {'': request.queryset}, 
+            'grupperinger': {'': [medlemmer[pk] for pk in pks]}, 
             'heading': 'Sjekkheftet',
             'filterForm': medlemFilterForm
         })
     
     if side == 'kart':
-        request.medlemMapData = json.dumps([{
-            'navn': medlem.navn,
-            'boCord': medlem.boAdresseCord() if medlem.public__boAdresse else None,
-            'foreldreCord': medlem.foreldreAdresseCord() if medlem.public__foreldreAdresse else None,
-            'storkorNavn': medlem.storkorNavn(),
-            'pk': medlem.pk
-        } for medlem in Medlem.objects.distinct().filter(
-            vervInnehavelseAktiv(),
-            stemmegruppeVerv('vervInnehavelser__verv')
-        ).annotatePublic().exclude(public__boAdresse__isnull=True, public__foreldreAdresse__isnull=True)])
-
         return render(request, 'mytxs/sjekkhefteKart.html')
 
     if side == 'sjekkhefTest':
@@ -229,6 +288,7 @@ def sjekkheftet(request, side, underside=None):
     # Gruperinger er visuelle grupperinger i sjekkheftet på samme side, klassisk stemmegrupper. 
     grupperinger = {}
     sjekkheftetDatoForm = None
+    jubileumOffsets = None
     if kor := Kor.objects.filter(navn=side).first():
         sjekkheftetDatoForm = SjekkhefteDatoForm(request.GET, medlem=request.user.medlem, korNavn=kor.navn)
         dato = sjekkheftetDatoForm.getDato()
@@ -279,32 +339,30 @@ def sjekkheftet(request, side, underside=None):
                 grupperinger[medlem.stemmegruppe].append(medlem)
 
     elif side == 'jubileum':
-        request.queryset = Medlem.objects.distinct().annotateKarantenekor(storkor=True).annotatePublic().filter(
-            vervInnehavelseAktiv(), 
-            stemmegruppeVerv('vervInnehavelser__verv'),
-            public__fødselsdato__isnull=False
-        )
+        request.queryset = bursdagQueryset()
 
-        # Måten dette funke e at for å produser en index med tilsvarende sortering som
-        # date_of_year (som ikke finnes i Django), gange vi måneden med 31, og legger på dagen.
-        # Så må vi bare ta modulus 403 (den maksimale 12*31+31), også har vi det:)
-        today = datetime.date.today()
-        today = today.month*31 + today.day
+        # Sorteringen på neste bursdag gjøres på fødselsdag indeksen, og vi viser bare en side av gangen
+        try:
+            offset = max(int(request.GET.get('offset', 0)), 0)
+        except ValueError:
+            offset = 0
+        medlemmer = request.queryset.sjekkheftePrefetch(kor=None).kommendeBursdager(JUBILEUM_ANTALL + 1, offset)
 
-        request.queryset = request.queryset\
-            .order_by(Cast((F('fødselsdato__month') * 31 + F('fødselsdato__day') - today + 403), output_field=IntegerField()) % 403)\
-            .sjekkheftePrefetch(kor=None)
-
-        grupperinger = {'': request.queryset}
+        grupperinger = {'': medlemmer[:JUBILEUM_ANTALL]}
+        jubileumOffsets = {
+            'forrige': max(offset - JUBILEUM_ANTALL, 0) if offset else None,
+            'neste': offset + JUBILEUM_ANTALL if len(medlemmer) > JUBILEUM_ANTALL else None
+        }
 
     elif side == 'fellesEmner':
-        for emne in request.user.medlem.emnekoder.split():
-            emne = emne.strip(',')
-            medlem = Medlem.objects.filter(
-                emnekoder__icontains=emne
-            ).sjekkheftePrefetch(kor=None).annotatePublic()
+        # Alle medlemmene som tar et av emnene dine, én rad per felles emne, i én spørring
+        medlemmer = Medlem.objects.filter(
+            emner__emnekode__in=request.user.medlem.emner.values('emnekode')
+        ).annotate(emnekode=F('emner__emnekode')).annotatePublic().sjekkheftePrefetch(kor=None)\
+            .order_by('emnekode', *Medlem._meta.ordering)
 
-            grupperinger[emne.upper()] = medlem
+        for medlem in medlemmer:
+            grupperinger.setdefault(medlem.emnekode, []).append(medlem)
 
         return render(request, 'mytxs/fellesEmner.html', {
             'heading': 'Sjekkheftet', 'grupperinger': grupperinger
@@ -317,6 +375,7 @@ def sjekkheftet(request, side, underside=None):
         'grupperinger': grupperinger, 
         'heading': 'Sjekkheftet',
         'sjekkheftetDatoForm': sjekkheftetDatoForm,
+        'jubileumOffsets': jubileumOffsets,
     })
 
 
@@ -581,7 +640,22 @@ def iCal(request, kor, medlemPK):
         messages.error(request, 'Du har ikke tilgang til dette korets kalender')
         return redirect('login')
 
-    return downloadICal(medlem, kor)
+    versjon = getICalVersjon(medlem, kor)
+    if not (iCalData := getCachetICal(medlem, kor, versjon)):
+        if not request.headers.get('If-None-Match') and not request.headers.get('If-Modified-Since'):
+            # Klienten har ingen kopi, så kalenderen streames mens den genereres, og caches når den er ferdig
+            return downloadICal(medlem, kor, cacheICal(medlem, kor, versjon, iCalLinjer(medlem, kor)))
+        # Pollere får 304 om innholdet ikke har endret seg, selv om versjonen har det
+        iCalData = lagreICal(medlem, kor, versjon, lagICal(medlem, kor))
+
+    etag = f'"{iCalData["etag"]}"'
+    if not (response := get_conditional_response(request, etag=etag, last_modified=iCalData['sistEndret'])):
+        response = downloadICal(medlem, kor, iCalData['iCal'])
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(iCalData['sistEndret'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @harTilgang(instanceModel=Oppmøte, lookupToArgNames={'medlem__pk': 'medlemPK', 'hendelse__pk': 'hendelsePK'}, 